@@ -0,0 +1,184 @@
+import heapq
+import random
+from itertools import product
+from threading import Thread
+from time import perf_counter
+
+from django.db import connection
+
+from bot_logic.models import STACK_CHOICES, Client, Event, Question, Speaker, UserTg
+from load_testing import (
+    BIOGRAPHIES, QUESTIONS, STUB_BOT_TOKEN, LoadTest, StubRequest, disable_run_async, percentile, seed_program,
+)
+from partner_matching import PartnerIndex, partner_index
+from question_buffer import QuestionBuffer, question_buffer
+
+BENCHMARK_TG_ID_BASE = 2 * 10 ** 9
+# наивные варианты на больших размерах медленные, их хватает замерить несколько раз
+BASELINE_REPEAT = 20
+WORDS = sorted({word for biography in BIOGRAPHIES for word in biography.split()} | {
+    'ml', 'rust', 'postgres', 'sql', 'linux', 'android', 'ios', 'qa', 'product', 'design',
+    'аналитика', 'стартап', 'команда', 'высоконагруженные', 'системы', 'облака',
+})
+
+
+def timings(func, arguments):
+    samples = []
+    for argument in arguments:
+        started = perf_counter()
+        func(argument)
+        samples.append(perf_counter() - started)
+    return samples
+
+
+def latency_row(benchmark, variant, size, samples):
+    return {
+        'benchmark': benchmark, 'variant': variant, 'size': size, 'runs': len(samples),
+        'p50_ms': percentile(samples, 0.5) * 1000, 'p95_ms': percentile(samples, 0.95) * 1000,
+    }
+
+
+def throughput_row(benchmark, variant, size, seconds):
+    return {
+        'benchmark': benchmark, 'variant': variant, 'size': size,
+        'seconds': seconds, 'per_second': size / seconds if seconds else 0,
+    }
+
+
+def random_biography(rng):
+    return ' '.join(rng.choices(WORDS, k=rng.randint(3, 12)))
+
+
+def bench_partners(clients, repeat, seed, k=10):
+    """Подбор собеседников: PartnerIndex.top_k против попарного сравнения в Python."""
+    rng = random.Random(seed)
+    stacks = [key for key, _ in STACK_CHOICES] + [None]
+    index = PartnerIndex()
+    index.is_built = True
+    for client_id in range(1, clients + 1):
+        index.upsert(client_id, random_biography(rng), rng.choice(stacks))
+    queries = [rng.randint(1, clients) for _ in range(repeat)]
+
+    vectors = [(client_id, index.vector_of(client_id)) for client_id in range(1, clients + 1)]
+
+    def per_pair(client_id):
+        vector = index.vector_of(client_id)
+        scores = ((float(vector @ other), other_id)
+                  for other_id, other in vectors if other_id != client_id)
+        return [other_id for _, other_id in heapq.nlargest(k, scores)]
+
+    return [
+        latency_row('partners', 'top_k', clients, timings(lambda client_id: index.top_k(client_id, k), queries)),
+        latency_row('partners', 'per_pair', clients, timings(per_pair, queries[:BASELINE_REPEAT])),
+    ]
+
+
+def bench_lookup(users, repeat, seed):
+    """Профиль по tg_id: поиск по уникальному индексу против полного просмотра
+    таблицы по неиндексированному полю, как было до миграции 0014."""
+    rng = random.Random(seed)
+    UserTg.objects.bulk_create(
+        [UserTg(tg_id=BENCHMARK_TG_ID_BASE + number, nic_tg=f'bench{number}') for number in range(users)],
+        batch_size=2000)
+    numbers = [rng.randrange(users) for _ in range(repeat)]
+    indexed = timings(
+        lambda number: UserTg.objects.filter(tg_id=BENCHMARK_TG_ID_BASE + number).first(), numbers)
+    scan = timings(
+        lambda number: UserTg.objects.filter(nic_tg=f'bench{number}').first(), numbers[:BASELINE_REPEAT])
+    return [
+        latency_row('lookup', 'tg_id_index', users, indexed),
+        latency_row('lookup', 'full_scan', users, scan),
+    ]
+
+
+def write_concurrently(threads, questions, write):
+    """Раздаёт вопросы потокам и возвращает время, за которое все они записаны."""
+    def worker(part):
+        try:
+            for question in part:
+                write(question)
+        finally:
+            connection.close()
+
+    workers = [Thread(target=worker, args=(questions[number::threads],)) for number in range(threads)]
+    started = perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return perf_counter() - started
+
+
+def bench_questions(count, threads, seed):
+    """Запись вопросов из многих потоков: по одному create на вопрос против QuestionBuffer."""
+    rng = random.Random(seed)
+    speaker = Speaker.objects.create(
+        user=UserTg.objects.create(tg_id=BENCHMARK_TG_ID_BASE - 1, is_speaker=True), name='Спикер')
+    client = Client.objects.create(user=UserTg.objects.create(tg_id=BENCHMARK_TG_ID_BASE - 2), name='Гость')
+    event = Event.objects.create(name='Бенчмарк')
+
+    def make_questions():
+        return [Question(speaker=speaker, client=client, event=event, text=rng.choice(QUESTIONS))
+                for _ in range(count)]
+
+    per_row = write_concurrently(threads, make_questions(), lambda question: question.save())
+
+    buffer = QuestionBuffer()
+    buffer.start()
+    started = perf_counter()
+    write_concurrently(threads, make_questions(), buffer.add)
+    buffer.stop()
+    buffered = perf_counter() - started
+
+    return [
+        throughput_row('questions', 'create_per_row', count, per_row),
+        throughput_row('questions', 'question_buffer', count, buffered),
+    ]
+
+
+def bench_dispatch(levels, workers, lanes, api_latency, seed):
+    """Пропускная способность диспетчера при levels одновременных гостей: экраны
+    только для чтения в пуле потоков run_async против обработки прямо в дорожках."""
+    from bot import build_bot, build_dispatcher
+
+    event = seed_program()
+    partner_index.build()
+    rows = []
+    question_buffer.start()
+    try:
+        for run, (concurrency, pooled) in enumerate(product(levels, (True, False))):
+            bot = build_bot(
+                STUB_BOT_TOKEN, workers, lanes,
+                request_class=lambda **kwargs: StubRequest(latency=api_latency, **kwargs))
+            dispatcher = build_dispatcher(bot, workers, lanes, flood_control=None)
+            if not pooled:
+                for handlers in dispatcher.handlers.values():
+                    disable_run_async(handlers)
+            dispatcher.bot_data['provider_token'] = 'load-test'
+            # у каждого прогона свои гости, чтобы регистрации не повторялись
+            report = LoadTest(
+                dispatcher, event, attendees=max(10, 2 * concurrency), concurrency=concurrency,
+                seed=seed, first_attendee=run * 10 ** 5).run()
+            rows.append({
+                'benchmark': 'dispatch', 'variant': 'run_async' if pooled else 'lanes_only',
+                'size': concurrency, 'updates': report['updates'], 'dropped': report['dropped'],
+                'seconds': report['seconds'], 'per_second': report['throughput'],
+                'p95_ms': report['p95'] * 1000,
+            })
+    finally:
+        question_buffer.stop()
+    return rows
+
+
+def database_profile():
+    """Движок и настройки соединений, чтобы прогоны на SQLite и PostgreSQL было с чем сравнить."""
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode')
+            journal_mode = cursor.fetchone()[0]
+        options = connection.settings_dict['OPTIONS']
+        return f"sqlite, journal_mode={journal_mode}, transaction_mode={options.get('transaction_mode')}"
+    pool = connection.settings_dict['OPTIONS'].get('pool')
+    if pool:
+        return f"{connection.vendor}, pool max_size={pool['max_size']}"
+    return f"{connection.vendor}, CONN_MAX_AGE={connection.settings_dict['CONN_MAX_AGE']}"
@@ -1,4 +1,7 @@
 import os
+from queue import Queue
+from threading import Thread
+
 import django
 try:
     os.environ.setdefault('DJANGO_SETTINGS_MODULE',
@@ -7,12 +10,17 @@ try:
 except Exception as e:
     print(e)
 
+from django.conf import settings
+from django.db import close_old_connections
 from environs import Env, EnvError
+from telegram import Update
 from telegram.ext import (
     CommandHandler, Updater, PreCheckoutQueryHandler, MessageHandler, Filters,
-    ConversationHandler, CallbackQueryHandler
+    ConversationHandler, CallbackQueryHandler, ExtBot, TypeHandler
 )
 from bot_utils import set_bot_menu_commands
+from metrics import InstrumentedRequest, instrument_dispatcher, register_gauge, dump_metrics, remove_metrics_files
+from update_scheduler import LaneDispatcher, ReleasingJobQueue
 from handlers import (
     ask_question, start, donate, precheckout, successful_payment,
     help, CHOOSE_ROLE, TYPING_ORGANIZER_PASSWORD, ROLE_GUEST_CALLBACK, ROLE_SPEAKER_CALLBACK,
@@ -22,25 +30,41 @@ from handlers import (
     question_input, QUESTION_INPUT, REGISTER_NAME, REGISTER_PHONE, REGISTER_STACK,
     register_name, register_phone, register_stack, cancel_conversation,
     timeline, find_partner, BIO_INPUT, receive_biography, cancel_partner_search,
-    register_for_event, handle_event_selection, get_client_main_keyboard, EVENT_SELECTION
+    register_for_event, handle_event_selection, EVENT_SELECTION,
+    warm_up_screens, BROADCAST_TEXT, BROADCAST_AUDIENCE, start_broadcast, broadcast_text,
+    broadcast_audience, cancel_broadcast, turn_page, join_pairing, all_questions,
+    toggle_live_questions, popular_questions, cancel_event_registration, ignore_update
 )
+from broadcasts import BroadcastSender
+from notifications import delivery_queue
+from partner_matching import partner_index
+from pairing import pairing_scheduler
+from question_buffer import question_buffer
+from live_questions import live_questions
+from program_version import program_version
+from flood_control import flood_control
+from persistence import persistence
+from rate_limits import TokenBucket
+from shard_events import shard_events
+from sharding import ShardedDispatcher
 
 
-def main():
-    env = Env()
-    env.read_env()
-    try:
-        bot_token = env.str('TELEGRAM_TOKEN')
-        provider_token = env.str('TELEGRAM_PROVIDER_TOKEN')
-    except EnvError:
-        return
+def build_bot(bot_token, workers, lanes, request_class=InstrumentedRequest, base_url=None):
+    # по соединению на каждый поток: воркеры, дорожки, диспетчер, поллинг, JobQueue
+    return ExtBot(bot_token, base_url=base_url, request=request_class(con_pool_size=workers + lanes + 4))
 
-    updater = Updater(bot_token, use_context=True)
-    dispatcher = updater.dispatcher
-    dispatcher.bot_data['provider_token'] = provider_token
-    set_bot_menu_commands(updater)
+
+def build_dispatcher(bot, workers, lanes, lane_queue_size=0, job_queue=None, flood_control=flood_control,
+                     persistence=None, shards=1):
+    """Диспетчер со всеми обработчиками бота. Сам по себе в сеть не ходит,
+    поэтому его можно собрать и с ботом-заглушкой, например для нагрузочного теста."""
+    dispatcher = LaneDispatcher(
+        bot, Queue(), workers=workers, job_queue=job_queue, persistence=persistence,
+        lanes=lanes, lane_queue_size=lane_queue_size, shards=shards)
+    persistent = persistence is not None
 
     role_conversation = ConversationHandler(
+        name='role', persistent=persistent,
         entry_points=[CommandHandler('start', start)],
         states={
             CHOOSE_ROLE: [
@@ -58,6 +82,7 @@ def main():
     )
 
     question_conversation = ConversationHandler(
+        name='question', persistent=persistent,
         entry_points=[CallbackQueryHandler(
             ask_question, pattern='^ask_question$')],
         states={
@@ -72,6 +97,7 @@ def main():
     )
 
     partner_conversation = ConversationHandler(
+        name='partner_search', persistent=persistent,
         entry_points=[CallbackQueryHandler(
             find_partner, pattern='^find_partner$')],
         states={
@@ -87,23 +113,15 @@ def main():
     )
 
     event_registration_handler = ConversationHandler(
+        name='event_registration', persistent=persistent,
         entry_points=[CallbackQueryHandler(
             register_for_event, pattern='^register_for_event$')],
         states={
             EVENT_SELECTION: [
                 CallbackQueryHandler(handle_event_selection,
                                      pattern=r'^register_event_\d+$'),
-                CallbackQueryHandler(
-                    lambda u, c: (
-                        u.callback_query.answer(),
-                        u.callback_query.edit_message_text(
-                            "Регистрация отменена.",
-                            reply_markup=get_client_main_keyboard()
-                        ),
-                        ConversationHandler.END
-                    ),
-                    pattern='^cancel_event_registration$'
-                )
+                CallbackQueryHandler(cancel_event_registration,
+                                     pattern='^cancel_event_registration$'),
             ],
             REGISTER_NAME: [MessageHandler(Filters.text & ~Filters.command, register_name)],
             REGISTER_PHONE: [MessageHandler(Filters.text & ~Filters.command, register_phone)],
@@ -111,61 +129,244 @@ def main():
         },
         fallbacks=[
             CommandHandler('cancel', cancel_conversation),
-            CallbackQueryHandler(
-                lambda u, c: (
-                    u.callback_query.answer(),
-                    u.callback_query.edit_message_text(
-                        "Регистрация отменена.",
-                        reply_markup=get_client_main_keyboard()
-                    ),
-                    ConversationHandler.END
-                ),
-                pattern='^cancel_event_registration$'
-            )
+            CallbackQueryHandler(cancel_event_registration, pattern='^cancel_event_registration$'),
         ],
         allow_reentry=True
     )
 
+    broadcast_conversation = ConversationHandler(
+        name='broadcast', persistent=persistent,
+        entry_points=[MessageHandler(
+            Filters.text('ОРГАНИЗОВАТЬ РАССЫЛКУ'), start_broadcast)],
+        states={
+            BROADCAST_TEXT: [MessageHandler(Filters.text & ~Filters.command, broadcast_text)],
+            BROADCAST_AUDIENCE: [CallbackQueryHandler(
+                broadcast_audience, pattern=r'^broadcast_to_(clients|speakers|event_\d+)$')],
+        },
+        fallbacks=[
+            CallbackQueryHandler(cancel_broadcast, pattern='^cancel_broadcast$'),
+            CommandHandler('cancel', cancel_broadcast)
+        ]
+    )
+
+    if flood_control:
+        # группа -1 срабатывает раньше всех остальных обработчиков
+        dispatcher.add_handler(TypeHandler(Update, flood_control.check), group=-1)
     dispatcher.add_handler(CallbackQueryHandler(
         speaker_approval, pattern=r'^(approve|reject)_speaker_\d+$'))
     dispatcher.add_handler(role_conversation)
     dispatcher.add_handler(question_conversation)
     dispatcher.add_handler(partner_conversation)
     dispatcher.add_handler(event_registration_handler)
+    dispatcher.add_handler(broadcast_conversation)
     dispatcher.add_handler(CallbackQueryHandler(
         cancel_question, pattern='^cancel_question$'))
     dispatcher.add_handler(MessageHandler(Filters.text(
-        'ГЛЯНУТЬ ИВЕНТЫ') | Filters.text('глянуть ивенты'), speaker_events))
+        'ГЛЯНУТЬ ИВЕНТЫ') | Filters.text('глянуть ивенты'), speaker_events,
+        run_async=True))
     dispatcher.add_handler(MessageHandler(Filters.text(
         'НАЧАТЬ ДОКЛАД') | Filters.text('начать доклад'), start_talk))
     dispatcher.add_handler(MessageHandler(Filters.text(
-        'ГЛЯНУТЬ ВОПРОСЫ') | Filters.text('глянуть вопросы'), view_questions))
+        'ГЛЯНУТЬ ВОПРОСЫ') | Filters.text('глянуть вопросы'), view_questions,
+        run_async=True))
     dispatcher.add_handler(MessageHandler(Filters.text(
         'ЗАВЕРШИТЬ ВЫСТУПЛЕНИЕ') | Filters.text('завершить выступление'), finish_talk))
+    dispatcher.add_handler(MessageHandler(Filters.text(
+        'ПОТОК ВОПРОСОВ') | Filters.text('поток вопросов'), toggle_live_questions))
+    dispatcher.add_handler(CallbackQueryHandler(
+        all_questions, pattern='^all_questions$', run_async=True))
+    dispatcher.add_handler(CallbackQueryHandler(
+        popular_questions, pattern='^popular_questions$', run_async=True))
     dispatcher.add_handler(CommandHandler('ask', ask_question))
-    dispatcher.add_handler(CommandHandler('help', help))
+    dispatcher.add_handler(CommandHandler('help', help, run_async=True))
     dispatcher.add_handler(CallbackQueryHandler(
         ask_question, pattern='^ask_question$'))
     dispatcher.add_handler(CallbackQueryHandler(
-        timeline, pattern='^timeline$'))
+        timeline, pattern='^timeline$', run_async=True))
     dispatcher.add_handler(CallbackQueryHandler(
         find_partner, pattern='^find_partner$'))
+    dispatcher.add_handler(CallbackQueryHandler(
+        join_pairing, pattern='^join_pairing$'))
     dispatcher.add_handler(PreCheckoutQueryHandler(precheckout))
     dispatcher.add_handler(MessageHandler(
         Filters.successful_payment, successful_payment))
     dispatcher.add_handler(MessageHandler(Filters.text('Поддержать'), donate))
     dispatcher.add_handler(MessageHandler(
-        Filters.text('Программы'), programs_button))
+        Filters.text('Программы'), programs_button, run_async=True))
     dispatcher.add_handler(MessageHandler(
-        Filters.text('Актуалочка'), actual_button))
+        Filters.text('Актуалочка'), actual_button, run_async=True))
     dispatcher.add_handler(MessageHandler(
-        Filters.text('Подробнее'), event_details))
+        Filters.text('Подробнее'), event_details, run_async=True))
+    dispatcher.add_handler(CallbackQueryHandler(
+        program_details, pattern='^program_details$', run_async=True))
     dispatcher.add_handler(CallbackQueryHandler(
-        program_details, pattern='^program_details$'))
-    dispatcher.add_handler(MessageHandler(Filters.all, lambda u, c: None))
+        turn_page, pattern='^pg:', run_async=True))
+    dispatcher.add_handler(MessageHandler(Filters.all, ignore_update))
+
+    instrument_dispatcher(dispatcher)
+    register_gauge(
+        'meetup_bot_lane_queued', 'Обновлений в очереди дорожки',
+        lambda: [({'lane': stats['lane']}, stats['queued']) for stats in dispatcher.lane_stats()])
+    register_gauge(
+        'meetup_bot_lane_processed', 'Обработано обновлений дорожкой',
+        lambda: [({'lane': stats['lane']}, stats['processed']) for stats in dispatcher.lane_stats()])
+    return dispatcher
+
+
+def configure_jobs(dispatcher, job_queue, env, metrics_file, poll_questions=False):
+    """Кэши и периодические задачи процесса, который обрабатывает обновления."""
+    lane_stats_interval = env.int('BOT_LANE_STATS_INTERVAL', 0)
+    if lane_stats_interval:
+        job_queue.run_repeating(
+            lambda context: print(f'Дорожки: {dispatcher.lane_stats()}'),
+            interval=lane_stats_interval)
+    job_queue.run_repeating(
+        lambda context: dump_metrics(metrics_file),
+        interval=env.int('BOT_METRICS_DUMP_INTERVAL', 15))
+
+    program_version.check()
+    job_queue.run_repeating(
+        program_version.job, interval=env.float('PROGRAM_VERSION_CHECK_INTERVAL', 5))
+    warm_up_screens()
+    partner_index.build()
+    if poll_questions:
+        live_questions.poll_database = True
+    else:
+        question_buffer.add_flush_listener(live_questions.collect)
+    job_queue.run_repeating(
+        live_questions.job, interval=env.float('LIVE_QUESTIONS_INTERVAL', 5))
+
+
+def run_shard(shard, shards, updates, acks, events, options):
+    """Процесс-обработчик при BOT_SHARDS > 1: получает обновления своих чатов от
+    процесса-приёмника и подтверждает каждое после обработки, а сбросы кэшей
+    отправляет остальным процессам через shard_events."""
+    env = Env()
+    env.read_env()
+    workers = env.int('BOT_WORKERS', 16)
+    lanes = env.int('BOT_LANES', os.cpu_count() or 4)
+    bot = build_bot(options['bot_token'], workers, lanes, base_url=options['base_url'])
+    job_queue = ReleasingJobQueue()
+    # общий лимит флуд-контроля делится между процессами поровну
+    bucket = flood_control.global_bucket
+    flood_control.global_bucket = TokenBucket(bucket.rate / shards, bucket.capacity / shards)
+    # лимит уведомлений делят процессы-обработчики и главный процесс с раундами и рассылками
+    delivery_queue.share_rate(shards + 1)
+    use_persistence = options['persistence']
+    dispatcher = build_dispatcher(
+        bot, workers, lanes, lane_queue_size=env.int('BOT_LANE_QUEUE_SIZE', 0), job_queue=job_queue,
+        persistence=persistence if use_persistence else None, shards=shards)
+    job_queue.set_dispatcher(dispatcher)
+    dispatcher.bot_data['provider_token'] = options['provider_token']
+    dispatcher.on_processed = lambda update: acks.put((shard, [update.update_id]))
+    shard_events.connect(shard, events)
+    configure_jobs(dispatcher, job_queue, env, f'{settings.BOT_METRICS_FILE}.{shard}', poll_questions=True)
+
+    job_queue.start()
+    dispatcher_thread = Thread(target=dispatcher.start, name='dispatcher')
+    dispatcher_thread.start()
+    question_buffer.start()
+    if use_persistence:
+        persistence.start()
+    while True:
+        item = updates.get()
+        if item is None:
+            break
+        if isinstance(item, dict):
+            dispatcher.update_queue.put(Update.de_json(item, bot))
+            continue
+        try:
+            shard_events.apply(*item)
+        except Exception as e:
+            print(f'Ошибка при обработке события другого шарда {item}: {e}')
+        finally:
+            close_old_connections()
+    dispatcher.stop()
+    dispatcher_thread.join()
+    job_queue.stop()
+    question_buffer.stop()
+    if use_persistence:
+        dispatcher.update_persistence()
+        persistence.flush()
+    delivery_queue.shutdown()
+
+
+def main():
+    env = Env()
+    env.read_env()
+    try:
+        bot_token = env.str('TELEGRAM_TOKEN')
+        provider_token = env.str('TELEGRAM_PROVIDER_TOKEN')
+    except EnvError:
+        return
+
+    workers = env.int('BOT_WORKERS', 16)
+    lanes = env.int('BOT_LANES', os.cpu_count() or 4)
+    shards = env.int('BOT_SHARDS', 1)
+    # например, локальный fake_bot_api вместо api.telegram.org для замеров
+    base_url = env.str('TELEGRAM_BASE_URL', None)
+    # незаконченные диалоги и user_data переживают перезапуск; Updater сам
+    # вызывает persistence.flush() при остановке
+    use_persistence = env.bool('BOT_PERSISTENCE', True)
+    remove_metrics_files(settings.BOT_METRICS_FILE)
+    job_queue = ReleasingJobQueue()
+    if shards > 1:
+        # этот процесс только принимает обновления и раскладывает их по процессам-обработчикам
+        bot = build_bot(bot_token, workers=1, lanes=1, base_url=base_url)
+        dispatcher = ShardedDispatcher(
+            bot, Queue(), shards=shards, job_queue=job_queue,
+            max_pending=env.int('BOT_SHARD_MAX_PENDING', 10000),
+            worker_options={
+                'bot_token': bot_token, 'provider_token': provider_token,
+                'base_url': base_url, 'persistence': use_persistence,
+            })
+        # свою долю лимита уведомлений раунды и рассылки делят с процессами-обработчиками
+        delivery_queue.share_rate(shards + 1)
+        shard_stats_interval = env.int('BOT_SHARD_STATS_INTERVAL', 0)
+        if shard_stats_interval:
+            job_queue.run_repeating(
+                lambda context: print(f'Шарды: {dispatcher.shard_stats()}'),
+                interval=shard_stats_interval)
+    else:
+        bot = build_bot(bot_token, workers, lanes, base_url=base_url)
+        dispatcher = build_dispatcher(
+            bot, workers, lanes, lane_queue_size=env.int('BOT_LANE_QUEUE_SIZE', 0), job_queue=job_queue,
+            persistence=persistence if use_persistence else None)
+        configure_jobs(dispatcher, job_queue, env, settings.BOT_METRICS_FILE)
+    # заявки на нетворкинг лежат в базе, раунды проводит только главный процесс
+    job_queue.run_repeating(
+        pairing_scheduler.job, interval=env.int('PAIRING_ROUND_INTERVAL', 600))
+    job_queue.set_dispatcher(dispatcher)
+    updater = Updater(dispatcher=dispatcher, workers=None)
+    dispatcher.bot_data['provider_token'] = provider_token
+    set_bot_menu_commands(updater)
+
+    # рассылки идут из одного процесса, чтобы общий лимит Telegram соблюдался и при шардировании
+    broadcast_sender = BroadcastSender(
+        bot, rate=env.float('BROADCAST_RATE', 25), shared_bucket=delivery_queue.bucket)
+    dispatcher.bot_data['broadcast_sender'] = broadcast_sender
 
-    updater.start_polling()
+    webhook_url = env.str('TELEGRAM_WEBHOOK_URL', '')
+    if webhook_url:
+        url_path = env.str('WEBHOOK_PATH', bot_token)
+        updater.start_webhook(
+            listen=env.str('WEBHOOK_LISTEN', '127.0.0.1'),
+            port=env.int('WEBHOOK_PORT', 8443),
+            url_path=url_path,
+            webhook_url=f"{webhook_url.rstrip('/')}/{url_path}",
+            max_connections=env.int('WEBHOOK_MAX_CONNECTIONS', 40),
+        )
+    else:
+        updater.start_polling()
+    broadcast_sender.start()
+    if shards <= 1:
+        question_buffer.start()
+        if use_persistence:
+            persistence.start()
     updater.idle()
+    question_buffer.stop()
+    broadcast_sender.stop()
+    delivery_queue.shutdown()
 
 
 if __name__ == '__main__':
@@ -2,7 +2,7 @@ from django.contrib import admin
 from .models import (
     UserTg, Client, Speaker,
     Event, Session, SpeakerSession,
-    Question
+    Question, Broadcast, BroadcastDelivery
 )
 
 
@@ -53,3 +53,17 @@ class QuestionAdmin(admin.ModelAdmin):
     list_display = ("speaker", "client", "created_at")
     search_fields = ("text", "speaker__name", "client__name")
     list_filter = ("created_at",)
+
+
+@admin.register(Broadcast)
+class BroadcastAdmin(admin.ModelAdmin):
+    list_display = ("created_at", "audience", "event", "is_finished", "finished_at")
+    search_fields = ("text",)
+    list_filter = ("audience", "is_finished")
+
+
+@admin.register(BroadcastDelivery)
+class BroadcastDeliveryAdmin(admin.ModelAdmin):
+    list_display = ("broadcast", "chat_id", "status", "attempts", "sent_at")
+    search_fields = ("chat_id",)
+    list_filter = ("status",)
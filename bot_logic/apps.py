@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class BotLogicConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'bot_logic'
+
+    def ready(self):
+        # версия программы в базе должна подниматься и при правках в админке
+        import program_version  # noqa: F401
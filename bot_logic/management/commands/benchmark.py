@@ -0,0 +1,64 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+SCENARIOS = ('partners', 'lookup', 'questions', 'dispatch')
+
+
+class Command(BaseCommand):
+    help = ('Повторяемые замеры во временной базе: подбор собеседников, поиск '
+            'профиля по tg_id, запись вопросов из многих потоков и пропускная '
+            'способность диспетчера с пулом run_async и без него.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('scenarios', nargs='*', help=f"что замерить: {', '.join(SCENARIOS)}; по умолчанию всё")
+        parser.add_argument('--clients', type=int, default=50000, help='анкет в индексе собеседников')
+        parser.add_argument('--users', type=int, default=100000, help='пользователей для поиска по tg_id')
+        parser.add_argument('--questions', type=int, default=800, help='вопросов для записи')
+        parser.add_argument('--threads', type=int, default=16, help='потоков, пишущих вопросы')
+        parser.add_argument('--concurrency', default='1,10,100',
+                            help='сколько гостей пишут одновременно, через запятую')
+        parser.add_argument('--workers', type=int, default=16, help='потоки для run_async-обработчиков')
+        parser.add_argument('--lanes', type=int, default=4, help='дорожки диспетчера')
+        parser.add_argument('--api-latency', type=float, default=0.05,
+                            help='задержка ответа заглушки Telegram API, секунды')
+        parser.add_argument('--repeat', type=int, default=200, help='повторов замера задержки')
+        parser.add_argument('--seed', type=int, default=1, help='seed для воспроизводимых данных')
+        parser.add_argument('--json', action='store_true', help='напечатать результаты одной строкой JSON')
+
+    def handle(self, *args, **options):
+        from benchmarks import bench_dispatch, bench_lookup, bench_partners, bench_questions, database_profile
+        from load_testing import temporary_database
+
+        scenarios = options['scenarios'] or SCENARIOS
+        unknown = set(scenarios) - set(SCENARIOS)
+        if unknown:
+            raise CommandError(f"Неизвестные замеры: {', '.join(sorted(unknown))}")
+        try:
+            levels = [int(level) for level in options['concurrency'].split(',')]
+        except ValueError:
+            raise CommandError(f"--concurrency ожидает числа через запятую: {options['concurrency']}")
+        rows = []
+        with temporary_database(prefix='meetup_bench_'):
+            profile = database_profile()
+            if 'partners' in scenarios:
+                rows += bench_partners(options['clients'], options['repeat'], options['seed'])
+            if 'lookup' in scenarios:
+                rows += bench_lookup(options['users'], options['repeat'], options['seed'])
+            if 'questions' in scenarios:
+                rows += bench_questions(options['questions'], options['threads'], options['seed'])
+            if 'dispatch' in scenarios:
+                rows += bench_dispatch(
+                    levels, options['workers'], options['lanes'], options['api_latency'], options['seed'])
+
+        if options['json']:
+            self.stdout.write(json.dumps({'database': profile, 'results': rows}))
+            return
+        self.stdout.write(f'База: {profile}')
+        for row in rows:
+            name = f"{row['benchmark']}.{row['variant']} (n={row['size']})"
+            if 'per_second' in row:
+                self.stdout.write(f"{name:<44}{row['seconds']:>9.2f} с{row['per_second']:>12.0f} /с")
+            else:
+                self.stdout.write(
+                    f"{name:<44}p50 {row['p50_ms']:>9.3f} мс   p95 {row['p95_ms']:>9.3f} мс   ({row['runs']} замеров)")
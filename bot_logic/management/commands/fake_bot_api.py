@@ -0,0 +1,57 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = ('Локальная замена Telegram Bot API для сквозных замеров. Бот направляется '
+            'на неё переменной TELEGRAM_BASE_URL; по Ctrl+C печатается сводка вызовов.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8081)
+        parser.add_argument('--latency', type=float, default=0, help='задержка каждого ответа, секунды')
+        parser.add_argument('--jitter', type=float, default=0, help='случайная добавка к задержке, секунды')
+        parser.add_argument('--retry-after-rate', type=float, default=0, help='доля ответов 429 RetryAfter')
+        parser.add_argument('--retry-after', type=int, default=1, help='retry_after в ответах 429, секунды')
+        parser.add_argument('--error-rate', type=float, default=0, help='доля ответов 500')
+        parser.add_argument('--enforce-limits', action='store_true',
+                            help='отвечать 429 при превышении лимитов, как Telegram')
+        parser.add_argument('--global-limit', type=int, default=30, help='сообщений в секунду на всех')
+        parser.add_argument('--chat-limit', type=int, default=1, help='сообщений в секунду в один чат')
+        parser.add_argument('--seed', type=int, default=None)
+        parser.add_argument('--replay', help='.jsonl с обновлениями, которые нужно отправить боту')
+        parser.add_argument('--rate', type=float, default=50, help='обновлений в секунду при --replay')
+
+    def handle(self, *args, **options):
+        from fake_bot_api import FakeBotApi
+
+        api = FakeBotApi(
+            host=options['host'], port=options['port'], latency=options['latency'], jitter=options['jitter'],
+            retry_after_rate=options['retry_after_rate'], retry_after=options['retry_after'],
+            error_rate=options['error_rate'], enforce_limits=options['enforce_limits'],
+            global_limit=options['global_limit'], chat_limit=options['chat_limit'], seed=options['seed'],
+        ).start()
+        self.stdout.write(f'Fake Bot API слушает {api.base_url}. Запустите бота с TELEGRAM_BASE_URL={api.base_url}')
+        try:
+            if options['replay']:
+                self.replay(api, options['replay'], options['rate'])
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            api.stop()
+        self.stdout.write(json.dumps(api.stats(), ensure_ascii=False, indent=2))
+
+    def replay(self, api, path, rate):
+        with open(path, encoding='utf-8') as file:
+            updates = [json.loads(line) for line in file if line.strip()]
+        self.stdout.write(f'Отправляю {len(updates)} обновлений, {rate:g} в секунду')
+        started = time.monotonic()
+        for number, update in enumerate(updates):
+            delay = started + number / rate - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            api.push_update(update)
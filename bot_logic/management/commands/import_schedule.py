@@ -0,0 +1,256 @@
+import csv
+import json
+from datetime import datetime
+from itertools import chain
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from bot_logic.models import Event, Session, Speaker, SpeakerSession, UserTg
+from program_version import program_version
+from shard_events import shard_events
+from user_profiles import invalidate_user_profile
+
+BATCH_SIZE = 500
+
+
+class DryRun(Exception):
+    pass
+
+
+def invalidate_profiles(tg_ids):
+    def invalidate():
+        for tg_id in tg_ids:
+            invalidate_user_profile(tg_id)
+
+    # сбрасываем после коммита, чтобы бот не успел закэшировать профиль до импорта
+    transaction.on_commit(invalidate)
+    for tg_id in tg_ids:
+        shard_events.publish('profile', tg_id)
+
+
+def read_records(path):
+    """Построчно читает программу из .jsonl или .csv, целиком — из .json."""
+    suffix = Path(path).suffix.lower()
+    with open(path, encoding='utf-8-sig', newline='') as file:
+        if suffix == '.csv':
+            yield from enumerate(csv.DictReader(file), start=2)
+        elif suffix == '.jsonl':
+            for line_number, line in enumerate(file, start=1):
+                if line.strip():
+                    yield line_number, json.loads(line)
+        elif suffix == '.json':
+            yield from enumerate(json.load(file), start=1)
+        else:
+            raise CommandError(f'Неизвестный формат файла: {path}. Поддерживаются .json, .jsonl и .csv')
+
+
+def parse_moment(value, day):
+    value = (value or '').strip()
+    moment = parse_datetime(value)
+    if moment is None and day:
+        try:
+            moment = datetime.combine(day, datetime.strptime(value, '%H:%M').time())
+        except ValueError:
+            moment = None
+    if moment is None:
+        raise ValueError(f'не удалось разобрать время «{value}»')
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+class Command(BaseCommand):
+    help = ('Загружает программу конференции из JSON/JSONL/CSV: создаёт и обновляет '
+            'мероприятия, спикеров, доклады и выступления пачками в одной транзакции.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='файл с программой: .json, .jsonl или .csv')
+        parser.add_argument('--event', help='мероприятие для строк без поля event')
+        parser.add_argument('--date', help='дата для времени в формате ЧЧ:ММ, например 2025-06-01')
+        parser.add_argument('--dry-run', action='store_true', help='показать изменения, ничего не сохраняя')
+
+    def handle(self, *args, **options):
+        day = None
+        if options['date']:
+            try:
+                day = datetime.strptime(options['date'], '%Y-%m-%d').date()
+            except ValueError:
+                raise CommandError('Дата должна быть в формате ГГГГ-ММ-ДД')
+
+        rows, errors = self.parse_rows(options['path'], options['event'], day)
+        self.report = {}
+        try:
+            with transaction.atomic():
+                speakers = self.upsert_speakers(rows, errors)
+                rows = [row for row in rows if row['speaker_key'] in speakers]
+                events = self.upsert_events(rows)
+                sessions = self.upsert_sessions(rows, events)
+                self.upsert_talks(rows, events, sessions, speakers)
+                # пачечные запросы не вызывают сигналов, поэтому кэши бота сбрасываем явно
+                program_version.bump()
+                if options['dry_run']:
+                    raise DryRun
+        except DryRun:
+            self.stdout.write('Пробный запуск, изменения не сохранены.')
+
+        for line_number, error in sorted(errors):
+            self.stderr.write(f'Строка {line_number}: {error}')
+        for title, (created, updated, unchanged) in self.report.items():
+            self.stdout.write(f'{title}: создано {created}, изменено {updated}, без изменений {unchanged}')
+
+    def parse_rows(self, path, default_event, day):
+        rows, errors = [], []
+        for line_number, record in read_records(path):
+            try:
+                title = (record.get('talk_title') or '').strip()
+                if not title:
+                    raise ValueError('не указано название доклада')
+                event_name = (record.get('event') or default_event or '').strip()
+                if not event_name:
+                    raise ValueError('не указано мероприятие, передайте --event')
+                speaker_tg_id = record.get('speaker_tg_id')
+                speaker_tg_id = int(speaker_tg_id) if speaker_tg_id not in (None, '') else None
+                speaker_name = (record.get('speaker_name') or '').strip()
+                start = parse_moment(record.get('start_time'), day)
+                finish = parse_moment(record.get('end_time'), day)
+                if finish <= start:
+                    raise ValueError('доклад заканчивается раньше, чем начинается')
+            except (TypeError, ValueError) as e:
+                errors.append((line_number, str(e)))
+                continue
+            rows.append({
+                'line_number': line_number,
+                'event': event_name,
+                'title': title,
+                'speaker_tg_id': speaker_tg_id,
+                'speaker_name': speaker_name,
+                'speaker_key': speaker_tg_id if speaker_tg_id is not None else speaker_name,
+                'start': start,
+                'finish': finish,
+            })
+        return rows, errors
+
+    def count(self, title, created=0, updated=0, unchanged=0):
+        self.report[title] = (created, updated, unchanged)
+
+    def upsert_events(self, rows):
+        bounds = {}
+        for row in rows:
+            start, finish = bounds.get(row['event'], (row['start'], row['finish']))
+            bounds[row['event']] = (min(start, row['start']), max(finish, row['finish']))
+
+        events = {event.name: event for event in Event.objects.filter(name__in=bounds)}
+        new_events = [
+            Event(name=name, start_event=start, finish_event=finish)
+            for name, (start, finish) in bounds.items() if name not in events
+        ]
+        Event.objects.bulk_create(new_events, batch_size=BATCH_SIZE)
+
+        changed = []
+        for event in events.values():
+            start, finish = bounds[event.name]
+            if event.start_event is None or event.start_event > start \
+                    or event.finish_event is None or event.finish_event < finish:
+                event.start_event = min(event.start_event or start, start)
+                event.finish_event = max(event.finish_event or finish, finish)
+                changed.append(event)
+        Event.objects.bulk_update(changed, ['start_event', 'finish_event'], batch_size=BATCH_SIZE)
+
+        self.count('Мероприятия', len(new_events), len(changed), len(events) - len(changed))
+        events.update((event.name, event) for event in new_events)
+        return events
+
+    def upsert_speakers(self, rows, errors):
+        names = {}
+        for row in rows:
+            names.setdefault(row['speaker_key'], row['speaker_name'])
+        tg_ids = [key for key in names if isinstance(key, int)]
+        plain_names = [key for key in names if not isinstance(key, int)]
+
+        users = {user.tg_id: user for user in UserTg.objects.filter(tg_id__in=tg_ids)}
+        new_users = [UserTg(tg_id=tg_id, is_speaker=True) for tg_id in tg_ids if tg_id not in users]
+        UserTg.objects.bulk_create(new_users, batch_size=BATCH_SIZE)
+        users.update((user.tg_id, user) for user in new_users)
+        not_speakers = [user for user in users.values() if not user.is_speaker]
+        UserTg.objects.filter(pk__in=[user.pk for user in not_speakers]).update(is_speaker=True)
+
+        speakers = {}
+        for speaker in Speaker.objects.filter(user__tg_id__in=tg_ids).select_related('user'):
+            speakers.setdefault(speaker.user.tg_id, speaker)
+        for speaker in Speaker.objects.filter(name__in=plain_names):
+            speakers.setdefault(speaker.name, speaker)
+
+        existing = len(speakers)
+        changed = []
+        for tg_id, speaker in speakers.items():
+            if isinstance(tg_id, int) and names[tg_id] and speaker.name != names[tg_id]:
+                speaker.name = names[tg_id]
+                changed.append(speaker)
+        Speaker.objects.bulk_update(changed, ['name'], batch_size=BATCH_SIZE)
+
+        new_speakers = [
+            Speaker(user=users[tg_id], name=names[tg_id] or None)
+            for tg_id in tg_ids if tg_id not in speakers
+        ]
+        Speaker.objects.bulk_create(new_speakers, batch_size=BATCH_SIZE)
+        speakers.update((speaker.user.tg_id, speaker) for speaker in new_speakers)
+        # bulk_create и update не шлют сигналы, профили в кэше бота сбрасываем сами
+        invalidate_profiles({user.tg_id for user in chain(new_users, not_speakers)}
+                            | {speaker.user.tg_id for speaker in new_speakers})
+
+        missing = [name for name in plain_names if name not in speakers]
+        for row in rows:
+            if row['speaker_key'] in missing:
+                errors.append((row['line_number'], f'спикер «{row["speaker_name"]}» не найден, '
+                                                   'укажите speaker_tg_id'))
+
+        self.count('Спикеры', len(new_speakers), len(changed), existing - len(changed))
+        return speakers
+
+    def upsert_sessions(self, rows, events):
+        keys = {(events[row['event']].id, row['title']) for row in rows}
+        sessions = {
+            (session.event_id, session.title): session
+            for session in Session.objects.filter(
+                event_id__in={event_id for event_id, _ in keys},
+                title__in={title for _, title in keys})
+        }
+        new_sessions = [
+            Session(event_id=event_id, title=title)
+            for event_id, title in sorted(keys) if (event_id, title) not in sessions
+        ]
+        Session.objects.bulk_create(new_sessions, batch_size=BATCH_SIZE)
+
+        self.count('Доклады', len(new_sessions), 0, len(keys) - len(new_sessions))
+        sessions.update(((session.event_id, session.title), session) for session in new_sessions)
+        return {key: sessions[key] for key in keys}
+
+    def upsert_talks(self, rows, events, sessions, speakers):
+        talks = {}
+        for row in rows:
+            session = sessions[(events[row['event']].id, row['title'])]
+            talks[(session.id, speakers[row['speaker_key']].id)] = row
+
+        existing = {
+            (talk.session_id, talk.speaker_id): talk
+            for talk in SpeakerSession.objects.filter(session_id__in={key[0] for key in talks})
+        }
+        new_talks, changed = [], []
+        for (session_id, speaker_id), row in talks.items():
+            talk = existing.get((session_id, speaker_id))
+            if talk is None:
+                new_talks.append(SpeakerSession(
+                    session_id=session_id, speaker_id=speaker_id,
+                    start_session=row['start'], finish_session=row['finish']))
+            elif (talk.start_session, talk.finish_session) != (row['start'], row['finish']):
+                talk.start_session, talk.finish_session = row['start'], row['finish']
+                changed.append(talk)
+        SpeakerSession.objects.bulk_create(new_talks, batch_size=BATCH_SIZE)
+        SpeakerSession.objects.bulk_update(
+            changed, ['start_session', 'finish_session'], batch_size=BATCH_SIZE)
+
+        self.count('Выступления', len(new_talks), len(changed), len(talks) - len(new_talks) - len(changed))
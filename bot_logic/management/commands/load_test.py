@@ -0,0 +1,82 @@
+import json
+import os
+
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = ('Нагрузочный тест: синтетические гости проходят сценарии бота через '
+            'настоящий диспетчер с заглушкой Telegram API во временной базе.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--attendees', type=int, default=200, help='число гостей')
+        parser.add_argument('--concurrency', type=int, default=50, help='сколько гостей пишут одновременно')
+        parser.add_argument('--workers', type=int, default=16, help='потоки для run_async-обработчиков')
+        parser.add_argument('--lanes', type=int, default=os.cpu_count() or 4, help='дорожки диспетчера')
+        parser.add_argument('--seed', type=int, default=1, help='seed для воспроизводимых прогонов')
+        parser.add_argument('--api-latency', type=float, default=0,
+                            help='задержка ответа заглушки Telegram API, секунды')
+        parser.add_argument('--flood-control', action='store_true', help='включить флуд-контроль')
+        parser.add_argument('--no-run-async', action='store_true',
+                            help='обрабатывать всё в дорожках, без пула потоков run_async')
+        parser.add_argument('--json', action='store_true', help='напечатать отчёт одной строкой JSON')
+
+    def handle(self, *args, **options):
+        from load_testing import temporary_database
+
+        with temporary_database():
+            report = self.run_load_test(options)
+        if options['json']:
+            self.stdout.write(json.dumps(report))
+        else:
+            self.print_report(report)
+
+    def run_load_test(self, options):
+        from bot import build_bot, build_dispatcher
+        from flood_control import flood_control
+        from load_testing import STUB_BOT_TOKEN, LoadTest, StubRequest, disable_run_async, seed_program
+        from notifications import delivery_queue
+        from partner_matching import partner_index
+        from question_buffer import question_buffer
+        from bot_logic.models import Question
+
+        event = seed_program()
+        partner_index.build()
+        bot = build_bot(
+            STUB_BOT_TOKEN, options['workers'], options['lanes'],
+            request_class=lambda **kwargs: StubRequest(latency=options['api_latency'], **kwargs))
+        dispatcher = build_dispatcher(
+            bot, options['workers'], options['lanes'],
+            flood_control=flood_control if options['flood_control'] else None)
+        if options['no_run_async']:
+            for handlers in dispatcher.handlers.values():
+                disable_run_async(handlers)
+        dispatcher.bot_data['provider_token'] = 'load-test'
+        load_test = LoadTest(
+            dispatcher, event, attendees=options['attendees'],
+            concurrency=options['concurrency'], seed=options['seed'])
+
+        question_buffer.start()
+        try:
+            report = load_test.run()
+        finally:
+            question_buffer.stop()
+            delivery_queue.shutdown()
+        report['api_calls'] = dict(bot.request.calls)
+        report['questions'] = Question.objects.count()
+        return report
+
+    def print_report(self, report):
+        self.stdout.write(
+            f"Обновлений: {report['updates']}, потеряно: {report['dropped']}, "
+            f"за {report['seconds']:.2f} с — {report['throughput']:.1f} обновлений/с")
+        self.stdout.write(
+            f"Ответ гостю: p50 {report['p50'] * 1000:.1f} мс, "
+            f"p95 {report['p95'] * 1000:.1f} мс, p99 {report['p99'] * 1000:.1f} мс")
+        self.stdout.write(f"{'Обработчик':<28}{'вызовы':>8}{'ошибки':>8}{'p50, мс':>10}{'p95, мс':>10}{'p99, мс':>10}")
+        for name, stats in report['handlers'].items():
+            self.stdout.write(
+                f"{name:<28}{stats['calls']:>8}{stats['errors']:>8}"
+                f"{stats['p50'] * 1000:>10.1f}{stats['p95'] * 1000:>10.1f}{stats['p99'] * 1000:>10.1f}")
+        self.stdout.write(f"Сохранено вопросов: {report['questions']}")
+        self.stdout.write(f"Запросы к Telegram API: {report['api_calls']}")
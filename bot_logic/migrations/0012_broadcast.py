@@ -0,0 +1,49 @@
+# Generated by Django 5.2.1 on 2026-10-18 09:44
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot_logic', '0011_eventregistration'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Broadcast',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('text', models.TextField(verbose_name='Текст')),
+                ('audience', models.CharField(choices=[('clients', 'Все гости'), ('speakers', 'Спикеры'), ('event', 'Участники мероприятия')], max_length=15, verbose_name='Аудитория')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Создана')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='Завершена')),
+                ('is_finished', models.BooleanField(default=False, verbose_name='Разослана')),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='broadcasts', to='bot_logic.usertg', verbose_name='автор')),
+                ('event', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='broadcasts', to='bot_logic.event', verbose_name='мероприятие')),
+            ],
+            options={
+                'verbose_name': 'рассылка',
+                'verbose_name_plural': 'рассылки',
+            },
+        ),
+        migrations.CreateModel(
+            name='BroadcastDelivery',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('chat_id', models.BigIntegerField(verbose_name='Телеграм id получателя')),
+                ('status', models.CharField(choices=[('pending', 'Ожидает'), ('sent', 'Доставлено'), ('failed', 'Ошибка')], default='pending', max_length=10, verbose_name='Статус')),
+                ('attempts', models.PositiveSmallIntegerField(default=0, verbose_name='Попыток')),
+                ('sent_at', models.DateTimeField(blank=True, null=True, verbose_name='Отправлено')),
+                ('error', models.TextField(blank=True, null=True, verbose_name='Ошибка')),
+                ('broadcast', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='deliveries', to='bot_logic.broadcast', verbose_name='рассылка')),
+            ],
+            options={
+                'verbose_name': 'доставка рассылки',
+                'verbose_name_plural': 'доставки рассылок',
+                'indexes': [models.Index(fields=['status', 'broadcast'], name='bot_logic_b_status_c16f8a_idx')],
+                'unique_together': {('broadcast', 'chat_id')},
+            },
+        ),
+    ]
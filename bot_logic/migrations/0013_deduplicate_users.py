@@ -0,0 +1,74 @@
+from django.db import migrations
+from django.db.models import Count
+
+
+def merge_duplicates(model, group_field, relations, flag_fields=(), fill_fields=()):
+    """Оставляет по одной записи на значение group_field (с наименьшим id).
+
+    Ссылки с дублей переносятся на оставшуюся запись, флаги объединяются через «или»,
+    а пустые поля заполняются значениями из дублей."""
+    duplicated = (model.objects.values(group_field)
+                  .annotate(copies=Count('id')).filter(copies__gt=1)
+                  .values_list(group_field, flat=True))
+    for value in list(duplicated):
+        kept, *copies = model.objects.filter(**{group_field: value}).order_by('id')
+        copy_ids = [copy.id for copy in copies]
+        for related_model, field, unique_with in relations:
+            related = related_model.objects.filter(**{f'{field}_id__in': copy_ids})
+            if unique_with:
+                # на каждое значение unique_with остаётся одна запись: сначала своя,
+                # затем с наименьшим id, иначе две копии столкнутся после переноса
+                taken = set(related_model.objects.filter(
+                    **{f'{field}_id': kept.id}).values_list(unique_with, flat=True))
+                clashing = []
+                for related_id, value in related.order_by('id').values_list('id', unique_with):
+                    if value in taken:
+                        clashing.append(related_id)
+                    else:
+                        taken.add(value)
+                related_model.objects.filter(id__in=clashing).delete()
+            related.update(**{f'{field}_id': kept.id})
+
+        for copy in copies:
+            for field in flag_fields:
+                setattr(kept, field, getattr(kept, field) or getattr(copy, field))
+            for field in fill_fields:
+                if not getattr(kept, field):
+                    setattr(kept, field, getattr(copy, field))
+        model.objects.filter(id__in=copy_ids).delete()
+        kept.save()
+
+
+def deduplicate_users(apps, schema_editor):
+    UserTg = apps.get_model('bot_logic', 'UserTg')
+    Client = apps.get_model('bot_logic', 'Client')
+    Speaker = apps.get_model('bot_logic', 'Speaker')
+    EventRegistration = apps.get_model('bot_logic', 'EventRegistration')
+    Question = apps.get_model('bot_logic', 'Question')
+    SpeakerSession = apps.get_model('bot_logic', 'SpeakerSession')
+    Broadcast = apps.get_model('bot_logic', 'Broadcast')
+
+    merge_duplicates(
+        UserTg, 'tg_id',
+        [(Client, 'user', None), (Speaker, 'user', None), (Broadcast, 'created_by', None)],
+        flag_fields=['is_organizator', 'is_speaker'], fill_fields=['nic_tg'])
+    merge_duplicates(
+        Client, 'user',
+        [(EventRegistration, 'client', 'event_id'), (Question, 'client', None)],
+        flag_fields=['is_registered'],
+        fill_fields=['name', 'contact_phone', 'biography', 'favorite_stack'])
+    merge_duplicates(
+        Speaker, 'user',
+        [(SpeakerSession, 'speaker', None), (Question, 'speaker', None)],
+        fill_fields=['name', 'contact_phone', 'biography'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot_logic', '0012_broadcast'),
+    ]
+
+    operations = [
+        migrations.RunPython(deduplicate_users, migrations.RunPython.noop),
+    ]
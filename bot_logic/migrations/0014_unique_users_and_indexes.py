@@ -0,0 +1,37 @@
+# Generated by Django 5.2.1 on 2026-10-18 09:53
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot_logic', '0013_deduplicate_users'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='client',
+            name='user',
+            field=models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, to='bot_logic.usertg', verbose_name='пользователь'),
+        ),
+        migrations.AlterField(
+            model_name='speaker',
+            name='user',
+            field=models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, to='bot_logic.usertg', verbose_name='пользователь'),
+        ),
+        migrations.AlterField(
+            model_name='usertg',
+            name='tg_id',
+            field=models.BigIntegerField(unique=True, verbose_name='Телеграм id'),
+        ),
+        migrations.AddIndex(
+            model_name='question',
+            index=models.Index(fields=['speaker', 'created_at'], name='bot_logic_q_speaker_6c1b1f_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='speakersession',
+            index=models.Index(fields=['start_session', 'finish_session', 'is_finish'], name='bot_logic_s_start_s_b48c5c_idx'),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.2.1 on 2026-10-18 10:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot_logic', '0014_unique_users_and_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ConversationState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, verbose_name='Диалог')),
+                ('key', models.CharField(max_length=100, verbose_name='Ключ')),
+                ('state', models.JSONField(verbose_name='Состояние')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Обновлено')),
+            ],
+            options={
+                'verbose_name': 'состояние диалога',
+                'verbose_name_plural': 'состояния диалогов',
+                'constraints': [models.UniqueConstraint(fields=('name', 'key'), name='unique_conversation_state')],
+            },
+        ),
+        migrations.CreateModel(
+            name='PersistedData',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('user', 'Данные пользователя'), ('chat', 'Данные чата'), ('bot', 'Данные бота')], max_length=4, verbose_name='Тип')),
+                ('key', models.BigIntegerField(default=0, verbose_name='Телеграм id')),
+                ('data', models.JSONField(default=dict, verbose_name='Данные')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Обновлено')),
+            ],
+            options={
+                'verbose_name': 'сохранённые данные бота',
+                'verbose_name_plural': 'сохранённые данные бота',
+                'constraints': [models.UniqueConstraint(fields=('kind', 'key'), name='unique_persisted_data')],
+            },
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.1 on 2026-10-18 10:33
+
+from django.db import migrations, models
+
+
+def create_program_version(apps, schema_editor):
+    apps.get_model('bot_logic', 'DataVersion').objects.get_or_create(name='program')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot_logic', '0015_persisted_data'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DataVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True, verbose_name='Данные')),
+                ('version', models.BigIntegerField(default=0, verbose_name='Версия')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Обновлено')),
+            ],
+            options={
+                'verbose_name': 'версия данных',
+                'verbose_name_plural': 'версии данных',
+            },
+        ),
+        migrations.RunPython(create_program_version, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.1 on 2026-10-18 10:37
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot_logic', '0016_data_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PairingRequest',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('chat_id', models.BigIntegerField(verbose_name='Телеграм id')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Создана')),
+                ('client', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='pairing_request', to='bot_logic.client', verbose_name='клиент')),
+            ],
+            options={
+                'verbose_name': 'заявка на нетворкинг',
+                'verbose_name_plural': 'заявки на нетворкинг',
+            },
+        ),
+        migrations.CreateModel(
+            name='PairingMatch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Познакомились')),
+                ('first', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='bot_logic.client', verbose_name='первый участник')),
+                ('second', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='bot_logic.client', verbose_name='второй участник')),
+            ],
+            options={
+                'verbose_name': 'пара нетворкинга',
+                'verbose_name_plural': 'пары нетворкинга',
+                'constraints': [models.UniqueConstraint(fields=('first', 'second'), name='unique_pairing_match')],
+            },
+        ),
+    ]
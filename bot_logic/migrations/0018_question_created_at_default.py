@@ -0,0 +1,19 @@
+# Generated by Django 5.2.1 on 2026-10-18 10:40
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot_logic', '0017_pairing_requests'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='question',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.1 on 2026-10-18 10:41
+
+from django.db import migrations, models
+
+
+def mark_existing_expanded(apps, schema_editor):
+    # раньше очередь доставок заполнялась сразу при создании рассылки
+    apps.get_model('bot_logic', 'Broadcast').objects.update(is_expanded=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot_logic', '0018_question_created_at_default'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='broadcast',
+            name='is_expanded',
+            field=models.BooleanField(default=False, verbose_name='Получатели добавлены'),
+        ),
+        migrations.RunPython(mark_existing_expanded, migrations.RunPython.noop),
+    ]
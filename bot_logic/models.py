@@ -1,11 +1,12 @@
 from django.db import models
 
 from django.db import models
+from django.utils import timezone
 from phonenumber_field.modelfields import PhoneNumberField
 
 
 class UserTg(models.Model):
-    tg_id = models.BigIntegerField("Телеграм id")
+    tg_id = models.BigIntegerField("Телеграм id", unique=True)
     nic_tg = models.CharField("Ник", max_length=50, null=True, blank=True)
     is_organizator = models.BooleanField("Организатор", default=False)
     is_speaker = models.BooleanField("Спикер", default=False)
@@ -28,7 +29,7 @@ STACK_CHOICES = [
 class PersonBase(models.Model):
     """Для того, что не дублировать одинаковые поля"""
 
-    user = models.ForeignKey(
+    user = models.OneToOneField(
         UserTg, on_delete=models.CASCADE, verbose_name="пользователь")
     name = models.CharField("Имя", max_length=50, null=True, blank=True)
     contact_phone = PhoneNumberField(
@@ -125,6 +126,7 @@ class SpeakerSession(models.Model):
     class Meta:
         verbose_name = "выступление спикера"
         verbose_name_plural = "выступления спикеров"
+        indexes = [models.Index(fields=["start_session", "finish_session", "is_finish"])]
 
 
 class Question(models.Model):
@@ -135,7 +137,8 @@ class Question(models.Model):
         Client, on_delete=models.CASCADE,
         related_name="questions", verbose_name="клиент")
     text = models.TextField("Вопрос", null=True)
-    created_at = models.DateTimeField(auto_now_add=True)
+    # время отправки гостем, а не записи: вопросы пишутся в базу пачками с задержкой
+    created_at = models.DateTimeField(default=timezone.now)
     event = models.ForeignKey(
         Event, on_delete=models.CASCADE,
         related_name="questions", null=True, blank=True)
@@ -146,3 +149,149 @@ class Question(models.Model):
     class Meta:
         verbose_name = "вопрос"
         verbose_name_plural = "вопросы"
+        indexes = [models.Index(fields=["speaker", "created_at"])]
+
+
+AUDIENCE_CHOICES = [
+    ('clients', 'Все гости'),
+    ('speakers', 'Спикеры'),
+    ('event', 'Участники мероприятия'),
+]
+
+
+class Broadcast(models.Model):
+    text = models.TextField("Текст")
+    audience = models.CharField(
+        "Аудитория", max_length=15, choices=AUDIENCE_CHOICES)
+    event = models.ForeignKey(
+        Event, on_delete=models.SET_NULL, related_name="broadcasts",
+        verbose_name="мероприятие", null=True, blank=True)
+    created_by = models.ForeignKey(
+        UserTg, on_delete=models.SET_NULL, related_name="broadcasts",
+        verbose_name="автор", null=True, blank=True)
+    created_at = models.DateTimeField("Создана", auto_now_add=True)
+    finished_at = models.DateTimeField("Завершена", null=True, blank=True)
+    is_expanded = models.BooleanField("Получатели добавлены", default=False)
+    is_finished = models.BooleanField("Разослана", default=False)
+
+    def __str__(self):
+        return f"Рассылка от {self.created_at:%d.%m.%Y %H:%M}"
+
+    class Meta:
+        verbose_name = "рассылка"
+        verbose_name_plural = "рассылки"
+
+
+DELIVERY_STATUS_CHOICES = [
+    ('pending', 'Ожидает'),
+    ('sent', 'Доставлено'),
+    ('failed', 'Ошибка'),
+]
+
+
+class BroadcastDelivery(models.Model):
+    broadcast = models.ForeignKey(
+        Broadcast, on_delete=models.CASCADE,
+        related_name="deliveries", verbose_name="рассылка")
+    chat_id = models.BigIntegerField("Телеграм id получателя")
+    status = models.CharField(
+        "Статус", max_length=10, choices=DELIVERY_STATUS_CHOICES, default='pending')
+    attempts = models.PositiveSmallIntegerField("Попыток", default=0)
+    sent_at = models.DateTimeField("Отправлено", null=True, blank=True)
+    error = models.TextField("Ошибка", null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.chat_id}"
+
+    class Meta:
+        unique_together = ('broadcast', 'chat_id')
+        indexes = [models.Index(fields=['status', 'broadcast'])]
+        verbose_name = "доставка рассылки"
+        verbose_name_plural = "доставки рассылок"
+
+
+class PairingRequest(models.Model):
+    client = models.OneToOneField(
+        Client, on_delete=models.CASCADE,
+        related_name="pairing_request", verbose_name="клиент")
+    chat_id = models.BigIntegerField("Телеграм id")
+    created_at = models.DateTimeField("Создана", auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.client}"
+
+    class Meta:
+        verbose_name = "заявка на нетворкинг"
+        verbose_name_plural = "заявки на нетворкинг"
+
+
+class PairingMatch(models.Model):
+    first = models.ForeignKey(
+        Client, on_delete=models.CASCADE, related_name="+", verbose_name="первый участник")
+    second = models.ForeignKey(
+        Client, on_delete=models.CASCADE, related_name="+", verbose_name="второй участник")
+    created_at = models.DateTimeField("Познакомились", auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.first} и {self.second}"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['first', 'second'], name='unique_pairing_match'),
+        ]
+        verbose_name = "пара нетворкинга"
+        verbose_name_plural = "пары нетворкинга"
+
+
+PERSISTED_KIND_CHOICES = [
+    ('user', 'Данные пользователя'),
+    ('chat', 'Данные чата'),
+    ('bot', 'Данные бота'),
+]
+
+
+class PersistedData(models.Model):
+    kind = models.CharField("Тип", max_length=4, choices=PERSISTED_KIND_CHOICES)
+    key = models.BigIntegerField("Телеграм id", default=0)
+    data = models.JSONField("Данные", default=dict)
+    updated_at = models.DateTimeField("Обновлено", auto_now=True)
+
+    def __str__(self):
+        return f"{self.kind} {self.key}"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['kind', 'key'], name='unique_persisted_data'),
+        ]
+        verbose_name = "сохранённые данные бота"
+        verbose_name_plural = "сохранённые данные бота"
+
+
+class ConversationState(models.Model):
+    name = models.CharField("Диалог", max_length=50)
+    key = models.CharField("Ключ", max_length=100)
+    state = models.JSONField("Состояние")
+    updated_at = models.DateTimeField("Обновлено", auto_now=True)
+
+    def __str__(self):
+        return f"{self.name} {self.key}"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['name', 'key'], name='unique_conversation_state'),
+        ]
+        verbose_name = "состояние диалога"
+        verbose_name_plural = "состояния диалогов"
+
+
+class DataVersion(models.Model):
+    name = models.CharField("Данные", max_length=50, unique=True)
+    version = models.BigIntegerField("Версия", default=0)
+    updated_at = models.DateTimeField("Обновлено", auto_now=True)
+
+    def __str__(self):
+        return f"{self.name} {self.version}"
+
+    class Meta:
+        verbose_name = "версия данных"
+        verbose_name_plural = "версии данных"
@@ -1,3 +1,1556 @@
-from django.test import TestCase
+import io
+import json
+import multiprocessing
+import os
+import runpy
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import time as day_time, timedelta
+from itertools import chain
+from queue import Queue
+from threading import Event as ThreadEvent, Thread, current_thread
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.db import IntegrityError, connection, connections, transaction
+from django.db.migrations.executor import MigrationExecutor
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from telegram import Bot, Update
+from telegram.error import RetryAfter, Unauthorized
+from telegram.ext import ConversationHandler, Dispatcher, DispatcherHandlerStop, Filters, MessageHandler
+
+import bot_utils
+import handlers
+import user_profiles
+from bot import build_bot, build_dispatcher
+from broadcasts import BroadcastSender, create_broadcast, expand_broadcast
+from fake_bot_api import FakeBotApi
+from flood_control import FloodControl
+from live_questions import LiveQuestionFeed, live_questions
+from live_timeline import live_timeline
+from metrics import dump_metrics, instrument, render_metrics
+from load_testing import ATTENDEE_TG_ID_BASE, STUB_BOT_TOKEN, LoadTest, StubRequest, seed_program, temporary_database
+from notifications import DeliveryQueue, delivery_queue
+from pairing import PairingScheduler, greedy_pairs
+from pagination import parse_page_callback
+from partner_matching import PartnerIndex, partner_index
+from persistence import DjangoPersistence
+from program_version import ProgramVersion, program_version
+from question_buffer import QuestionBuffer, question_buffer
+from question_clusters import TalkClusters, question_clusters
+from screen_cache import screen_cache
+from shard_events import shard_events
+from sharding import ShardedDispatcher, shard_key
+import update_scheduler
+from meetup_bot_config import settings as settings_module
+from update_scheduler import LaneDispatcher, ReleasingJobQueue
+from .models import (
+    UserTg, Client, Speaker, Event, EventRegistration, Session, SpeakerSession, Question,
+    Broadcast, BroadcastDelivery, ConversationState
+)
+
+ORGANIZER_TG_ID = 100
+SPEAKER_TG_ID = 200
+CLIENT_TG_ID = 300
+
+# Сколько запросов к базе разрешено каждому обработчику на холодных кэшах.
+# Экраны со списками не должны зависеть от числа мероприятий и участников.
+QUERY_BUDGETS = {
+    'start': 1,
+    'help': 0,
+    'successful_payment': 0,
+    'precheckout': 0,
+    'donate': 0,
+    'ask': 0,
+    'schedule': 0,
+    'guest_choice': 1,
+    'speaker_choice': 1,
+    'organizer_choice': 0,
+    'organizer_password': 2,
+    'cancel': 0,
+    'speaker_approval': 3,
+    'speaker_events': 3,
+    'start_talk': 3,
+    'view_questions': 5,
+    'finish_talk': 6,
+    'programs_button': 1,
+    'actual_button': 2,
+    'event_details': 1,
+    'ask_question': 2,
+    'question_input': 3,
+    'cancel_question': 0,
+    'timeline': 1,
+    'find_partner': 3,
+    'receive_biography': 4,
+    'show_partner_options': 2,
+    'cancel_partner_search': 0,
+    'register_for_event': 3,
+    'cancel_event_registration': 0,
+    'handle_event_selection': 4,
+    'back_to_programs': 1,
+    'back_to_main': 1,
+    'program_details': 3,
+    'start_registration': 0,
+    'register_name': 0,
+    'register_phone': 0,
+    'register_stack': 12,
+    'cancel_registration': 0,
+    'cancel_conversation': 0,
+    'start_broadcast': 1,
+    'broadcast_text': 1,
+    'broadcast_audience': 3,
+    'cancel_broadcast': 0,
+    'turn_page': 1,
+    'ignore_update': 0,
+    'join_pairing': 2,
+    'all_questions': 4,
+    'toggle_live_questions': 3,
+    'popular_questions': 4,
+}
+
+
+def make_update(tg_id, text='', data=''):
+    update = mock.MagicMock()
+    update.effective_user.id = tg_id
+    update.effective_user.username = f'user{tg_id}'
+    update.effective_user.first_name = f'User {tg_id}'
+    update.effective_chat.id = tg_id
+    update.message.text = text
+    update.callback_query.from_user = update.effective_user
+    update.callback_query.data = data
+    update.callback_query.message.chat_id = tg_id
+    update.pre_checkout_query.from_user.id = tg_id
+    update.pre_checkout_query.invoice_payload = f'meetup_donation_{tg_id}_1'
+    update.message.successful_payment.total_amount = 10000
+    return update
+
+
+def crashing_shard_worker(shard, shards, updates, acks, events, options):
+    """Процесс шарда для тестов: первый запуск падает на первом же обновлении,
+    перезапущенный записывает обновления в журнал и подтверждает их."""
+    marker = f"{options['marker']}.{shard}"
+    first_run = not os.path.exists(marker)
+    open(marker, 'a').close()
+    while True:
+        raw = updates.get()
+        if raw is None:
+            break
+        if first_run:
+            os._exit(1)
+        with open(options['log'], 'a') as file:
+            file.write(f"{shard} {raw['message']['chat']['id']} {raw['update_id']}\n")
+        acks.put((shard, [raw['update_id']]))
+
+
+def event_shard_worker(shard, shards, updates, acks, events, options):
+    """Процесс шарда для тестов: на каждое обновление публикует событие для
+    остальных шардов и записывает в журнал события, пришедшие от них."""
+    while True:
+        item = updates.get()
+        if item is None:
+            break
+        if isinstance(item, dict):
+            events.put((shard, ('profile', (item['update_id'],))))
+            acks.put((shard, [item['update_id']]))
+            continue
+        kind, args = item
+        with open(options['log'], 'a') as file:
+            file.write(f"{shard} {kind} {args[0]}\n")
+
+
+def make_context(user_data=None):
+    context = mock.MagicMock()
+    context.user_data = user_data or {}
+    context.bot_data = {'provider_token': 'token'}
+    context.args = ['вопрос']
+    return context
+
+
+class HandlerQueryBudgetTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        now = timezone.now()
+        UserTg.objects.create(tg_id=ORGANIZER_TG_ID, is_organizator=True)
+        speaker_user = UserTg.objects.create(tg_id=SPEAKER_TG_ID, is_speaker=True)
+        cls.speaker = Speaker.objects.create(user=speaker_user, name='Спикер')
+        client_user = UserTg.objects.create(tg_id=CLIENT_TG_ID, nic_tg='client')
+        cls.client_profile = Client.objects.create(
+            user=client_user, name='Клиент', is_registered=True,
+            favorite_stack='backend', biography='python django')
+
+        for number in range(20):
+            user = UserTg.objects.create(tg_id=1000 + number)
+            Client.objects.create(user=user, name=f'Участник {number}', biography='python')
+
+        cls.event = Event.objects.create(
+            name='Python Meetup', start_event=now - timedelta(hours=1),
+            finish_event=now + timedelta(hours=2))
+        for number in range(10):
+            event = Event.objects.create(
+                name=f'Митап {number}', start_event=now + timedelta(days=number + 1),
+                finish_event=now + timedelta(days=number + 1, hours=3))
+            for talk in range(3):
+                session = Session.objects.create(title=f'Доклад {talk}', event=event)
+                SpeakerSession.objects.create(
+                    session=session, speaker=cls.speaker,
+                    start_session=event.start_event + timedelta(hours=talk),
+                    finish_session=event.start_event + timedelta(hours=talk + 1))
+
+        session = Session.objects.create(title='Текущий доклад', event=cls.event)
+        cls.talk = SpeakerSession.objects.create(
+            session=session, speaker=cls.speaker,
+            start_session=now - timedelta(minutes=30), finish_session=now + timedelta(minutes=30))
+        for number in range(5):
+            Question.objects.create(
+                speaker=cls.speaker, client=cls.client_profile, text=f'Вопрос {number}', event=cls.event)
+
+    def setUp(self):
+        user_profiles._profiles.clear()
+        live_timeline.invalidate()
+        screen_cache.bump()
+        partner_index.build()
+        question_buffer._pending.clear()
+        live_questions.unsubscribe(self.speaker.id)
+        question_clusters.clear()
+
+    def handler_calls(self):
+        new_tg_id = 999
+        return {
+            'start': (make_update(CLIENT_TG_ID), make_context()),
+            'help': (make_update(CLIENT_TG_ID), make_context()),
+            'successful_payment': (make_update(CLIENT_TG_ID), make_context()),
+            'precheckout': (make_update(CLIENT_TG_ID), make_context()),
+            'donate': (make_update(CLIENT_TG_ID), make_context()),
+            'ask': (make_update(CLIENT_TG_ID), make_context()),
+            'schedule': (make_update(CLIENT_TG_ID), make_context()),
+            'guest_choice': (make_update(CLIENT_TG_ID), make_context()),
+            'speaker_choice': (make_update(SPEAKER_TG_ID), make_context()),
+            'organizer_choice': (make_update(ORGANIZER_TG_ID), make_context()),
+            'organizer_password': (make_update(ORGANIZER_TG_ID, text='secret'), make_context()),
+            'cancel': (make_update(CLIENT_TG_ID), make_context()),
+            'speaker_approval': (
+                make_update(ORGANIZER_TG_ID, data=f'approve_speaker_{SPEAKER_TG_ID}'), make_context()),
+            'speaker_events': (make_update(SPEAKER_TG_ID), make_context()),
+            'start_talk': (make_update(SPEAKER_TG_ID), make_context()),
+            'view_questions': (make_update(SPEAKER_TG_ID), make_context()),
+            'finish_talk': (make_update(SPEAKER_TG_ID), make_context()),
+            'programs_button': (make_update(CLIENT_TG_ID), make_context()),
+            'actual_button': (make_update(CLIENT_TG_ID), make_context()),
+            'event_details': (make_update(CLIENT_TG_ID), make_context()),
+            'ask_question': (make_update(CLIENT_TG_ID), make_context()),
+            'question_input': (make_update(CLIENT_TG_ID, text='Когда перерыв?'), make_context(
+                {'speaker_id': self.speaker.id, 'session_id': self.talk.id})),
+            'cancel_question': (make_update(CLIENT_TG_ID), make_context()),
+            'timeline': (make_update(CLIENT_TG_ID), make_context()),
+            'find_partner': (make_update(CLIENT_TG_ID), make_context()),
+            'receive_biography': (make_update(CLIENT_TG_ID, text='go, python'), make_context()),
+            'show_partner_options': (make_update(CLIENT_TG_ID), make_context()),
+            'cancel_partner_search': (make_update(CLIENT_TG_ID), make_context()),
+            'register_for_event': (make_update(CLIENT_TG_ID), make_context()),
+            'cancel_event_registration': (
+                make_update(CLIENT_TG_ID, data='cancel_event_registration'), make_context()),
+            'handle_event_selection': (
+                make_update(CLIENT_TG_ID, data=f'register_event_{self.event.id}'), make_context()),
+            'back_to_programs': (make_update(CLIENT_TG_ID), make_context()),
+            'back_to_main': (make_update(CLIENT_TG_ID), make_context()),
+            'program_details': (make_update(CLIENT_TG_ID), make_context()),
+            'start_registration': (make_update(new_tg_id), make_context()),
+            'register_name': (make_update(new_tg_id, text='Иван Иванов'), make_context()),
+            'register_phone': (make_update(new_tg_id, text='+79161234567'), make_context()),
+            'register_stack': (make_update(new_tg_id, data='stack_backend'), make_context({
+                'full_name': 'Иван Иванов', 'phone': '+79161234567', 'event_id': self.event.id})),
+            'cancel_registration': (make_update(new_tg_id), make_context()),
+            'cancel_conversation': (make_update(new_tg_id), make_context()),
+            'start_broadcast': (make_update(ORGANIZER_TG_ID), make_context()),
+            'broadcast_text': (make_update(ORGANIZER_TG_ID, text='Перерыв!'), make_context()),
+            'broadcast_audience': (make_update(ORGANIZER_TG_ID, data='broadcast_to_clients'), make_context(
+                {'broadcast_text': 'Перерыв!'})),
+            'cancel_broadcast': (make_update(ORGANIZER_TG_ID), make_context()),
+            'turn_page': (make_update(CLIENT_TG_ID, data=handlers.programs_list.callback_data(
+                'n', self.event)), make_context()),
+            'ignore_update': (make_update(CLIENT_TG_ID, text='Что-то своё'), make_context()),
+            'join_pairing': (make_update(CLIENT_TG_ID, data='join_pairing'), make_context()),
+            'all_questions': (make_update(SPEAKER_TG_ID, data='all_questions'), make_context()),
+            'toggle_live_questions': (make_update(SPEAKER_TG_ID), make_context()),
+            'popular_questions': (make_update(SPEAKER_TG_ID, data='popular_questions'), make_context()),
+        }
+
+    def registered_callbacks(self, handlers_list):
+        for handler in handlers_list:
+            if isinstance(handler, ConversationHandler):
+                yield from self.registered_callbacks(handler.entry_points)
+                for state_handlers in handler.states.values():
+                    yield from self.registered_callbacks(state_handlers)
+                yield from self.registered_callbacks(handler.fallbacks)
+            else:
+                yield getattr(handler.callback, '__wrapped__', handler.callback)
+
+    def test_every_handler_has_budget(self):
+        bot = build_bot(STUB_BOT_TOKEN, workers=1, lanes=1, request_class=StubRequest)
+        dispatcher = build_dispatcher(bot, workers=1, lanes=1, flood_control=None)
+        registered = {
+            callback.__name__ for group in dispatcher.handlers.values()
+            for callback in self.registered_callbacks(group)}
+
+        self.assertLessEqual(registered, set(QUERY_BUDGETS))
+        self.assertEqual(set(self.handler_calls()), set(QUERY_BUDGETS))
+
+    @mock.patch.dict(os.environ, {'ORGANIZER_PASSWORD': 'secret'})
+    def test_handlers_stay_within_query_budget(self):
+        for name, (update, context) in self.handler_calls().items():
+            with self.subTest(handler=name):
+                self.setUp()
+                with transaction.atomic():
+                    with CaptureQueriesContext(connection) as queries:
+                        getattr(handlers, name)(update, context)
+                    transaction.set_rollback(True)
+                self.assertLessEqual(
+                    len(queries), QUERY_BUDGETS[name],
+                    '\n'.join(query['sql'] for query in queries.captured_queries))
+
+    def test_program_details_page_does_not_grow_with_events(self):
+        paged_list = handlers.program_details_list
+        with CaptureQueriesContext(connection) as queries:
+            paged_list.render(paged_list.get_queryset(None))
+        self.assertEqual(len(queries), 3)
+
+
+class BroadcastSenderTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.organizer = UserTg.objects.create(tg_id=ORGANIZER_TG_ID, is_organizator=True)
+        for number in range(5):
+            user = UserTg.objects.create(tg_id=1000 + number)
+            Client.objects.create(user=user, name=f'Участник {number}')
+
+    def test_delivers_to_every_recipient_and_reports(self):
+        bot = mock.MagicMock()
+        broadcast, total = create_broadcast('Перерыв!', 'clients', created_by_id=self.organizer.id)
+        BroadcastSender(bot, rate=1000, per_chat_interval=0).send_pending()
+
+        self.assertEqual(total, 5)
+        self.assertEqual(BroadcastDelivery.objects.filter(status='sent').count(), 5)
+        broadcast.refresh_from_db()
+        self.assertTrue(broadcast.is_finished)
+        self.assertEqual(bot.send_message.call_args.kwargs['chat_id'], ORGANIZER_TG_ID)
+
+    def test_creating_broadcast_does_not_insert_recipients(self):
+        with CaptureQueriesContext(connection) as queries:
+            broadcast, total = create_broadcast('Перерыв!', 'clients', created_by_id=self.organizer.id)
+
+        self.assertEqual(total, 5)
+        self.assertEqual(len(queries), 2)
+        self.assertFalse(BroadcastDelivery.objects.exists())
+        self.assertFalse(broadcast.is_expanded)
+
+    @mock.patch('broadcasts.DELIVERY_BATCH_SIZE', 2)
+    def test_audience_is_expanded_in_batches_and_resumed(self):
+        broadcast, _ = create_broadcast('Перерыв!', 'clients')
+        # рассылку прервал перезапуск после первой пачки
+        BroadcastDelivery.objects.bulk_create(
+            [BroadcastDelivery(broadcast=broadcast, chat_id=chat_id) for chat_id in (1000, 1001)])
+
+        with CaptureQueriesContext(connection) as queries:
+            expand_broadcast(broadcast)
+
+        inserts = [query for query in queries.captured_queries if query['sql'].startswith('INSERT')]
+        self.assertEqual(len(inserts), 2)
+        self.assertEqual(
+            sorted(BroadcastDelivery.objects.values_list('chat_id', flat=True)), [1000, 1001, 1002, 1003, 1004])
+        broadcast.refresh_from_db()
+        self.assertTrue(broadcast.is_expanded)
+
+    @mock.patch('broadcasts.sleep')
+    def test_retry_after_keeps_delivery_pending(self, sleep):
+        bot = mock.MagicMock()
+        bot.send_message.side_effect = [RetryAfter(3), Unauthorized('blocked')] + [None] * 10
+        create_broadcast('Перерыв!', 'clients')
+        sender = BroadcastSender(bot, rate=1000, per_chat_interval=0)
+
+        sender.send_pending()
+        sleep.assert_any_call(3)
+        self.assertEqual(BroadcastDelivery.objects.filter(status='pending').count(), 1)
+        self.assertEqual(BroadcastDelivery.objects.filter(status='failed').count(), 1)
+
+        sender.send_pending()
+        self.assertFalse(BroadcastDelivery.objects.filter(status='pending').exists())
+        self.assertTrue(Broadcast.objects.get().is_finished)
+
+
+class SpeakerApplicationFanOutTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        for number in range(10):
+            UserTg.objects.create(tg_id=ORGANIZER_TG_ID + number, is_organizator=True)
+
+    def test_handler_does_not_wait_for_organizer_notifications(self):
+        user_profiles._profiles.clear()
+        context = make_context()
+        context.bot.send_message.side_effect = lambda **kwargs: time.sleep(0.2)
+
+        started = time.perf_counter()
+        handlers.speaker_choice(make_update(SPEAKER_TG_ID), context)
+        handler_time = time.perf_counter() - started
+        delivery_queue.wait()
+
+        self.assertLess(handler_time, 0.2)
+        self.assertEqual(context.bot.send_message.call_count, 10)
+
+
+class DeliveryQueueTest(TestCase):
+
+    def test_round_of_messages_respects_global_rate(self):
+        queue = DeliveryQueue(max_workers=8, rate=20)
+        bot = mock.MagicMock()
+
+        started = time.perf_counter()
+        for chat_id in range(40):
+            queue.send_message(bot, chat_id=chat_id, text='Ваш собеседник')
+        queue.wait()
+        queue.shutdown()
+
+        # 20 сообщений уходят сразу из запаса, остальные 20 — по 20 в секунду
+        self.assertGreaterEqual(time.perf_counter() - started, 0.9)
+        self.assertEqual(bot.send_message.call_count, 40)
+
+    def test_shards_and_main_process_share_one_rate(self):
+        for shards in (2, 4):
+            main_process = DeliveryQueue(max_workers=1, rate=25)
+            main_process.share_rate(shards + 1)
+            workers = [DeliveryQueue(max_workers=1, rate=25) for _ in range(shards)]
+            for worker in workers:
+                worker.share_rate(shards + 1)
+                # повторный вызов не делит лимит ещё раз
+                worker.share_rate(shards + 1)
+            total = main_process.bucket.rate + sum(worker.bucket.rate for worker in workers)
+            self.assertAlmostEqual(total, 25)
+            for queue in [main_process] + workers:
+                queue.shutdown()
+
+    @mock.patch('notifications.sleep')
+    def test_retry_after_is_retried_until_delivered(self, sleep):
+        queue = DeliveryQueue(max_workers=1, rate=1000)
+        bot = mock.MagicMock()
+        bot.send_message.side_effect = [RetryAfter(1), RetryAfter(2), None]
+
+        queue.send_message(bot, chat_id=1, text='Ваш собеседник').result()
+        queue.shutdown()
+
+        self.assertEqual(bot.send_message.call_count, 3)
+        self.assertEqual([call.args for call in sleep.call_args_list], [(1,), (2,)])
+
+
+class KeysetPaginationTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        now = timezone.now()
+        cls.events = [Event.objects.create(name=f'Без даты {number}') for number in range(3)]
+        cls.events += [
+            Event.objects.create(name=f'Митап {number}', start_event=now + timedelta(days=number % 4))
+            for number in range(20)
+        ]
+        cls.events.sort(key=lambda event: (event.start_event is not None, event.start_event, event.pk))
+
+    def walk(self, paged_list, direction, start_page):
+        pages = [start_page]
+        while True:
+            rows, has_prev, has_next = pages[-1]
+            has_more = has_next if direction == 'n' else has_prev
+            if not has_more:
+                return pages
+            edge = rows[-1] if direction == 'n' else rows[0]
+            _, _, key = parse_page_callback(paged_list.callback_data(direction, edge))
+            pages.append(paged_list.fetch(Event.objects.all(), direction, key))
+
+    def test_forward_and_backward_pages_cover_all_rows_in_order(self):
+        paged_list = handlers.programs_list
+        forward = self.walk(paged_list, 'n', paged_list.fetch(Event.objects.all()))
+        forward_rows = [row for rows, _, _ in forward for row in rows]
+        self.assertEqual(forward_rows, self.events)
+
+        backward = self.walk(paged_list, 'p', forward[-1])
+        backward_rows = [row for rows, _, _ in reversed(backward) for row in rows]
+        self.assertEqual(backward_rows, self.events)
+        self.assertFalse(backward[-1][1])
+
+    def walk_program_details(self, arrow, direction=None, key=None):
+        paged_list = handlers.program_details_list
+        texts = []
+        while True:
+            text, reply_markup = paged_list.render(paged_list.get_queryset(None), direction, key)
+            texts.append(text)
+            buttons = [button.callback_data for row in reply_markup.inline_keyboard for button in row
+                       if button.text == arrow]
+            if not buttons:
+                return texts, direction, key
+            _, direction, key = parse_page_callback(buttons[0])
+
+    def test_long_program_is_split_across_pages_not_cut(self):
+        event = self.events[-1]
+        speaker = Speaker.objects.create(user=UserTg.objects.create(tg_id=SPEAKER_TG_ID), name='Спикер')
+        titles = [f'Доклад {number} о том, как мы переписали монолит на микросервисы' for number in range(120)]
+        for title in titles:
+            SpeakerSession.objects.create(
+                session=Session.objects.create(title=title, event=event), speaker=speaker)
+
+        forward, direction, key = self.walk_program_details('▶')
+        backward, _, _ = self.walk_program_details('◀', direction, key)
+
+        for texts in (forward, list(reversed(backward))):
+            self.assertTrue(all(len(text) <= 4096 for text in texts))
+            joined = ''.join(texts)
+            self.assertTrue(all(f'{event.name}\n' in joined for event in self.events))
+            self.assertTrue(all(f'• {title}\n' in joined for title in titles))
+            self.assertIn('────', texts[-1])
+
+    def test_only_first_page_is_cached(self):
+        screen_cache.bump()
+        paged_list = handlers.programs_list
+        paged_list.page(None)
+        for event in self.events:
+            _, direction, key = parse_page_callback(paged_list.callback_data('n', event))
+            paged_list.page(None, direction, key)
+        self.assertEqual(len(screen_cache._screens), 1)
+
+    def test_page_costs_one_query(self):
+        _, _, key = parse_page_callback(handlers.programs_list.callback_data('n', self.events[10]))
+        with CaptureQueriesContext(connection) as queries:
+            handlers.programs_list.render(Event.objects.all(), 'n', key)
+        self.assertEqual(len(queries), 1)
+
+
+class PartnerIndexTest(TestCase):
+
+    def test_most_similar_clients_come_first(self):
+        index = PartnerIndex(dim=256)
+        index.build()
+        index.upsert(1, 'python django backend', 'backend')
+        index.upsert(2, 'react typescript frontend', 'frontend')
+        index.upsert(3, 'django postgres python', 'backend')
+        index.upsert(4, 'python', None)
+
+        self.assertEqual(index.top_k(1, k=2), [3, 4])
+        index.remove(3)
+        self.assertEqual(index.top_k(1, k=3)[0], 4)
+        self.assertNotIn(1, index.top_k(1, k=10))
+
+    def test_saving_biography_updates_index(self):
+        partner_index.build()
+        user = UserTg.objects.create(tg_id=CLIENT_TG_ID)
+        client = Client.objects.create(user=user, biography='golang')
+        other = Client.objects.create(user=UserTg.objects.create(tg_id=1), biography='python')
+        Client.objects.create(user=UserTg.objects.create(tg_id=2), biography='golang kubernetes')
+
+        client.biography = 'python'
+        client.save()
+        self.assertEqual(partner_index.top_k(client.id, k=1), [other.id])
+
+
+class PairingTest(TestCase):
+
+    def test_similar_clients_are_paired(self):
+        vectors = np.array([[1, 0], [0, 1], [0.9, 0.1], [0.1, 0.9]], dtype=np.float32)
+        pairs, unmatched = greedy_pairs([1, 2, 3, 4], vectors)
+
+        self.assertEqual(sorted(map(sorted, pairs)), [[1, 3], [2, 4]])
+        self.assertEqual(unmatched, [])
+
+    def test_thousands_of_opt_ins_pair_quickly(self):
+        rng = np.random.default_rng(0)
+        vectors = rng.standard_normal((3000, 512)).astype(np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+
+        started = time.perf_counter()
+        pairs, unmatched = greedy_pairs(list(range(3000)), vectors)
+
+        self.assertLess(time.perf_counter() - started, 5)
+        self.assertEqual(len(pairs), 1500)
+        self.assertEqual(len(set(chain.from_iterable(pairs))), 3000)
+
+    def test_rounds_do_not_repeat_pairs(self):
+        partner_index.build()
+        clients = [
+            Client.objects.create(user=UserTg.objects.create(tg_id=2000 + number), biography='python')
+            for number in range(4)
+        ]
+        scheduler = PairingScheduler()
+        bot = mock.MagicMock()
+        seen = set()
+        for _ in range(3):
+            for client in clients:
+                scheduler.opt_in(client.id, client.user.tg_id)
+            pairs = scheduler.run_round(bot)
+            rounds_pairs = {frozenset(pair) for pair in pairs}
+            self.assertEqual(len(pairs), 2)
+            self.assertFalse(rounds_pairs & seen)
+            seen |= rounds_pairs
+
+        delivery_queue.wait()
+        self.assertEqual(bot.send_message.call_count, 12)
+        for client in clients:
+            scheduler.opt_in(client.id, client.user.tg_id)
+        self.assertEqual(scheduler.run_round(bot), [])
+        self.assertTrue(scheduler.is_waiting(clients[0].id))
+
+    def test_round_sees_opt_ins_and_biographies_from_other_processes(self):
+        partner_index.build()
+        clients = [
+            Client.objects.create(user=UserTg.objects.create(tg_id=2000 + number), biography='')
+            for number in range(4)
+        ]
+        # анкеты заполнены в другом процессе: индекс этого процесса о них не знает
+        for client, biography in zip(clients, ('python django', 'go grpc', 'python flask', 'go kubernetes')):
+            Client.objects.filter(pk=client.pk).update(biography=biography)
+        for client in clients:
+            PairingScheduler().opt_in(client.id, client.user.tg_id)
+
+        pairs = PairingScheduler().run_round(mock.MagicMock())
+        delivery_queue.wait()
+
+        self.assertEqual(
+            sorted(map(sorted, pairs)),
+            [[clients[0].id, clients[2].id], [clients[1].id, clients[3].id]])
+        self.assertFalse(PairingScheduler().is_waiting(clients[0].id))
+
+
+class ScheduleStoreTest(TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'schedule.json')
+        self.write([
+            {'start_time': '10:00', 'end_time': '11:00', 'talk_title': 'Первый'},
+            {'start_time': '09:00', 'end_time': '12:00', 'talk_title': 'Весь день'},
+            {'start_time': '11:00', 'end_time': '12:00', 'talk_title': 'Второй'},
+        ])
+        self.store = bot_utils.ScheduleStore(self.path)
+
+    def write(self, program):
+        with open(self.path, 'w', encoding='utf-8') as file:
+            json.dump(program, file)
+
+    def test_current_talk_matches_first_entry_in_file(self):
+        self.assertEqual(self.store.current_talk(day_time(10, 30))['talk_title'], 'Первый')
+        self.assertEqual(self.store.current_talk(day_time(9, 30))['talk_title'], 'Весь день')
+        self.assertEqual(self.store.current_talk(day_time(11, 0))['talk_title'], 'Весь день')
+        self.assertIsNone(self.store.current_talk(day_time(12, 0)))
+        self.assertIsNone(self.store.current_talk(day_time(8, 0)))
+
+    def test_file_is_parsed_only_when_it_changes(self):
+        with mock.patch('bot_utils.load_schedule_from_json',
+                        wraps=bot_utils.load_schedule_from_json) as load:
+            for _ in range(5):
+                self.store.snapshot()
+            self.assertEqual(load.call_count, 1)
+
+            self.write([{'start_time': '13:00', 'end_time': '14:00', 'talk_title': 'Новый доклад'}])
+            os.utime(self.path, ns=(0, 0))
+            self.assertEqual(self.store.current_talk(day_time(13, 30))['talk_title'], 'Новый доклад')
+            self.assertEqual(load.call_count, 2)
+
+
+class ImportScheduleTest(TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def import_schedule(self, file_name, content, *args):
+        path = os.path.join(self.directory, file_name)
+        with open(path, 'w', encoding='utf-8') as file:
+            file.write(content)
+        stdout, stderr = io.StringIO(), io.StringIO()
+        call_command('import_schedule', path, *args, stdout=stdout, stderr=stderr)
+        return stdout.getvalue(), stderr.getvalue()
+
+    def test_large_program_is_imported_in_batches(self):
+        lines = [json.dumps({
+            'event': f'Конференция {number % 2}',
+            'talk_title': f'Доклад {number}',
+            'speaker_name': f'Спикер {number % 300}',
+            'speaker_tg_id': 5000 + number % 300,
+            'start_time': f'2025-06-0{1 + number % 2}T{10 + number % 8}:00:00',
+            'end_time': f'2025-06-0{1 + number % 2}T{11 + number % 8}:00:00',
+        }) for number in range(2000)]
+        content = '\n'.join(lines)
+
+        with CaptureQueriesContext(connection) as queries:
+            stdout, stderr = self.import_schedule('program.jsonl', content)
+        self.assertLess(len(queries), 60)
+        self.assertEqual(stderr, '')
+        self.assertIn('Выступления: создано 2000, изменено 0, без изменений 0', stdout)
+        self.assertEqual(Speaker.objects.count(), 300)
+        self.assertEqual(UserTg.objects.filter(is_speaker=True).count(), 300)
+
+        lines[0] = lines[0].replace('T10:00:00', 'T09:30:00')
+        stdout, _ = self.import_schedule('program.jsonl', '\n'.join(lines))
+        self.assertIn('Выступления: создано 0, изменено 1, без изменений 1999', stdout)
+        self.assertIn('Мероприятия: создано 0, изменено 1, без изменений 1', stdout)
+
+    def test_csv_with_times_for_one_day(self):
+        speaker = Speaker.objects.create(user=UserTg.objects.create(tg_id=SPEAKER_TG_ID), name='Анна')
+        content = (
+            'talk_title,speaker_name,start_time,end_time\n'
+            'Асинхронность,Анна,10:00,11:00\n'
+            'Без спикера,Борис,11:00,12:00\n'
+            'Ошибка,Анна,12:00,11:00\n'
+        )
+
+        stdout, stderr = self.import_schedule(
+            'program.csv', content, '--event', 'Python Meetup', '--date', '2025-06-01')
+
+        talk = SpeakerSession.objects.get()
+        self.assertEqual(talk.speaker, speaker)
+        self.assertEqual(talk.session.event.name, 'Python Meetup')
+        self.assertIn('Строка 3: спикер «Борис» не найден', stderr)
+        self.assertIn('Строка 4: доклад заканчивается раньше', stderr)
+
+    def test_dry_run_saves_nothing(self):
+        content = json.dumps([{
+            'event': 'Python Meetup', 'talk_title': 'Доклад', 'speaker_tg_id': 1,
+            'start_time': '2025-06-01T10:00:00', 'end_time': '2025-06-01T11:00:00',
+        }])
+        stdout, _ = self.import_schedule('program.json', content, '--dry-run')
+
+        self.assertIn('Выступления: создано 1', stdout)
+        self.assertFalse(Event.objects.exists())
+
+    def test_import_bumps_program_version(self):
+        version = program_version.current()
+        content = json.dumps([{
+            'event': 'Python Meetup', 'talk_title': 'Доклад', 'speaker_tg_id': 1,
+            'start_time': '2025-06-01T10:00:00', 'end_time': '2025-06-01T11:00:00',
+        }])
+        self.import_schedule('program.json', content)
+
+        self.assertGreater(program_version.current(), version)
+
+    def test_import_drops_cached_profiles(self):
+        UserTg.objects.create(tg_id=SPEAKER_TG_ID)
+        user_profiles._profiles.clear()
+        self.assertFalse(user_profiles.get_user_profile(SPEAKER_TG_ID).is_speaker)
+        events = Queue()
+        shard_events.connect(0, events)
+        self.addCleanup(shard_events.connect, None, None)
+        content = json.dumps([{
+            'event': 'Python Meetup', 'talk_title': 'Доклад', 'speaker_tg_id': SPEAKER_TG_ID,
+            'start_time': '2025-06-01T10:00:00', 'end_time': '2025-06-01T11:00:00',
+        }])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.import_schedule('program.json', content)
+
+        profile = user_profiles.get_user_profile(SPEAKER_TG_ID)
+        self.assertTrue(profile.is_speaker)
+        self.assertIsNotNone(profile.speaker_id)
+        self.assertIn((0, ('profile', (SPEAKER_TG_ID,))), list(events.queue))
+
+
+class UserProfileCacheTest(TestCase):
+
+    def setUp(self):
+        self.user = UserTg.objects.create(tg_id=CLIENT_TG_ID)
+        user_profiles._profiles.clear()
+
+    def test_profile_read_before_change_is_not_cached(self):
+        load = user_profiles.load_user_profile
+
+        def load_then_change(tg_id):
+            profile = load(tg_id)
+            # другой поток сохранил пользователя, пока этот читал профиль
+            UserTg.objects.filter(pk=self.user.pk).update(is_speaker=True)
+            user_profiles.invalidate_user_profile(tg_id)
+            return profile
+
+        with mock.patch.object(user_profiles, 'load_user_profile', side_effect=load_then_change):
+            self.assertFalse(user_profiles.get_user_profile(CLIENT_TG_ID).is_speaker)
+
+        self.assertNotIn(CLIENT_TG_ID, user_profiles._profiles)
+        self.assertTrue(user_profiles.get_user_profile(CLIENT_TG_ID).is_speaker)
+
+
+class ShardEventsTest(TestCase):
+
+    def setUp(self):
+        self.events = Queue()
+        shard_events.connect(0, self.events)
+        self.addCleanup(shard_events.connect, None, None)
+
+    def test_profile_change_is_published_after_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            UserTg.objects.create(tg_id=CLIENT_TG_ID)
+        self.assertEqual(self.events.get_nowait(), (0, ('profile', (CLIENT_TG_ID,))))
+
+    def test_other_shard_drops_cached_profile(self):
+        user = UserTg.objects.create(tg_id=CLIENT_TG_ID)
+        user_profiles._profiles.clear()
+        self.assertFalse(user_profiles.get_user_profile(CLIENT_TG_ID).is_speaker)
+
+        UserTg.objects.filter(pk=user.pk).update(is_speaker=True)
+        shard_events.apply('profile', (CLIENT_TG_ID,))
+
+        self.assertTrue(user_profiles.get_user_profile(CLIENT_TG_ID).is_speaker)
+
+
+class ProgramVersionTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        now = timezone.now()
+        speaker = Speaker.objects.create(user=UserTg.objects.create(tg_id=SPEAKER_TG_ID), name='Спикер')
+        event = Event.objects.create(
+            name='Python Meetup', start_event=now - timedelta(hours=1), finish_event=now + timedelta(hours=2))
+        cls.talk = SpeakerSession.objects.create(
+            session=Session.objects.create(title='Доклад', event=event), speaker=speaker,
+            start_session=now - timedelta(minutes=30), finish_session=now + timedelta(minutes=30))
+
+    def setUp(self):
+        program_version.check()
+        live_timeline.invalidate()
+        screen_cache.bump()
+
+    def test_change_in_other_process_resets_live_timeline(self):
+        self.assertEqual(live_timeline.current_talk(), self.talk)
+
+        # админка или import_schedule в другом процессе: здешние сигналы не срабатывают
+        SpeakerSession.objects.filter(pk=self.talk.pk).update(
+            finish_session=timezone.now() - timedelta(minutes=1))
+        ProgramVersion().bump()
+        self.assertEqual(live_timeline.current_talk(), self.talk)
+
+        self.assertTrue(program_version.check())
+        self.assertIsNone(live_timeline.current_talk())
+
+    def test_change_in_other_process_resets_screen_cache(self):
+        text, _ = handlers.program_details_list.page(None)
+        self.assertIn('Python Meetup', text)
+
+        Event.objects.update(name='Django Meetup')
+        ProgramVersion().bump()
+        program_version.check()
+
+        text, _ = handlers.program_details_list.page(None)
+        self.assertIn('Django Meetup', text)
+
+    def test_own_changes_are_not_reloaded_twice(self):
+        version = program_version.current()
+        self.talk.is_finish = True
+        self.talk.save()
+
+        self.assertEqual(program_version.current(), version + 1)
+        self.assertFalse(program_version.check())
+        self.assertIsNone(live_timeline.current_talk())
+
+
+class DeduplicateUsersMigrationTest(TransactionTestCase):
+    before = [('bot_logic', '0012_broadcast')]
+    after = [('bot_logic', '0014_unique_users_and_indexes')]
+
+    def tearDown(self):
+        MigrationExecutor(connection).migrate(MigrationExecutor(connection).loader.graph.leaf_nodes())
+
+    def test_duplicates_are_merged_before_constraints(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.before)
+        apps = executor.loader.project_state(self.before).apps
+        OldUserTg = apps.get_model('bot_logic', 'UserTg')
+        OldClient = apps.get_model('bot_logic', 'Client')
+        OldEvent = apps.get_model('bot_logic', 'Event')
+        OldRegistration = apps.get_model('bot_logic', 'EventRegistration')
+
+        first = OldUserTg.objects.create(tg_id=CLIENT_TG_ID)
+        second = OldUserTg.objects.create(tg_id=CLIENT_TG_ID, nic_tg='client', is_speaker=True)
+        event = OldEvent.objects.create(name='Python Meetup')
+        kept = OldClient.objects.create(user=first, name='Клиент')
+        copy = OldClient.objects.create(user=second, biography='python', is_registered=True)
+        OldRegistration.objects.create(client=kept, event=event)
+        OldRegistration.objects.create(client=copy, event=event)
+
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(self.after)
+
+        user = UserTg.objects.get(tg_id=CLIENT_TG_ID)
+        self.assertEqual((user.id, user.nic_tg, user.is_speaker), (first.id, 'client', True))
+        client = Client.objects.get(user=user)
+        self.assertEqual((client.id, client.biography, client.is_registered), (kept.id, 'python', True))
+        self.assertEqual(EventRegistration.objects.get().client_id, kept.id)
+        with self.assertRaises(IntegrityError):
+            UserTg.objects.create(tg_id=CLIENT_TG_ID)
+
+    def test_registrations_shared_by_several_copies_are_merged(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.before)
+        apps = executor.loader.project_state(self.before).apps
+        OldUserTg = apps.get_model('bot_logic', 'UserTg')
+        OldClient = apps.get_model('bot_logic', 'Client')
+        OldEvent = apps.get_model('bot_logic', 'Event')
+        OldRegistration = apps.get_model('bot_logic', 'EventRegistration')
+
+        user = OldUserTg.objects.create(tg_id=CLIENT_TG_ID)
+        kept = OldClient.objects.create(user=user, name='Клиент')
+        copies = [OldClient.objects.create(user=user) for _ in range(2)]
+        first_event, second_event = OldEvent.objects.create(name='Python'), OldEvent.objects.create(name='Go')
+        OldRegistration.objects.create(client=kept, event=first_event)
+        for copy in copies:
+            OldRegistration.objects.create(client=copy, event=first_event)
+            OldRegistration.objects.create(client=copy, event=second_event)
+
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(self.after)
+
+        self.assertEqual(Client.objects.get().id, kept.id)
+        self.assertEqual(
+            sorted(EventRegistration.objects.values_list('client_id', 'event_id')),
+            [(kept.id, first_event.id), (kept.id, second_event.id)])
+
+
+class QuestionBufferTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.speaker = Speaker.objects.create(user=UserTg.objects.create(tg_id=SPEAKER_TG_ID))
+        cls.client_profile = Client.objects.create(user=UserTg.objects.create(tg_id=CLIENT_TG_ID))
+
+    def make_question(self, text, speaker_id=-1):
+        speaker_id = self.speaker.id if speaker_id == -1 else speaker_id
+        return Question(speaker_id=speaker_id, client=self.client_profile, text=text)
+
+    def test_burst_is_written_in_few_queries(self):
+        buffer = QuestionBuffer(max_rows=10000)
+        flushed = []
+        buffer.add_flush_listener(flushed.extend)
+        for number in range(1000):
+            buffer.add(self.make_question(f'Вопрос {number}'))
+
+        with CaptureQueriesContext(connection) as queries:
+            buffer.flush()
+        self.assertLess(len(queries), 15)
+        self.assertEqual(Question.objects.count(), 1000)
+        self.assertEqual(len(flushed), 1000)
+
+    def test_stop_writes_everything_left(self):
+        buffer = QuestionBuffer(flush_interval=60)
+        buffer.start()
+        buffer.add(self.make_question('Последний вопрос'))
+        buffer.stop()
+
+        self.assertTrue(Question.objects.filter(text='Последний вопрос').exists())
+
+    def test_late_flush_keeps_submission_time(self):
+        asked_at = timezone.now() - timedelta(minutes=10)
+        buffer = QuestionBuffer()
+        question = self.make_question('Вопрос из задержанной пачки')
+        question.created_at = asked_at
+        buffer.add(question)
+
+        buffer.flush()
+        self.assertEqual(Question.objects.get().created_at, asked_at)
+
+    def test_broken_question_does_not_block_the_batch(self):
+        buffer = QuestionBuffer()
+        buffer.add(self.make_question('Хороший вопрос'))
+        buffer.add(self.make_question('Вопрос без спикера', speaker_id=None))
+
+        saved = buffer.flush()
+
+        self.assertEqual([question.text for question in saved], ['Хороший вопрос'])
+        self.assertEqual(Question.objects.get().text, 'Хороший вопрос')
+
+
+class SpeakerQuestionsTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        now = timezone.now()
+        cls.speaker = Speaker.objects.create(
+            user=UserTg.objects.create(tg_id=SPEAKER_TG_ID, is_speaker=True), name='Спикер')
+        cls.client_profile = Client.objects.create(
+            user=UserTg.objects.create(tg_id=CLIENT_TG_ID), name='Клиент')
+        event = Event.objects.create(
+            name='Python Meetup', start_event=now - timedelta(hours=1), finish_event=now + timedelta(hours=1))
+        cls.talk = SpeakerSession.objects.create(
+            session=Session.objects.create(title='Доклад', event=event), speaker=cls.speaker,
+            start_session=now - timedelta(minutes=30), finish_session=now + timedelta(minutes=30))
+
+    def setUp(self):
+        user_profiles._profiles.clear()
+        live_timeline.invalidate()
+        question_buffer._pending.clear()
+        question_clusters.clear()
+
+    def ask(self, text):
+        Question.objects.create(speaker=self.speaker, client=self.client_profile, text=text)
+
+    def view(self, context):
+        update = make_update(SPEAKER_TG_ID)
+        handlers.view_questions(update, context)
+        return update.message.reply_text.call_args.args[0]
+
+    def test_view_shows_only_questions_since_last_view(self):
+        context = make_context()
+        self.ask('Первый вопрос')
+        self.assertIn('Первый вопрос', self.view(context))
+
+        self.ask('Второй вопрос')
+        text = self.view(context)
+        self.assertIn('Второй вопрос', text)
+        self.assertNotIn('Первый вопрос', text)
+        self.assertEqual(self.view(context), 'Новых вопросов нет.')
+
+    def test_near_duplicates_are_shown_once_with_count(self):
+        self.ask('Когда будет перерыв на обед?')
+        self.ask('когда будет перерыв на обед')
+        self.ask('Когда будет перерыв на обед???')
+        self.ask('Какую базу данных вы используете?')
+
+        text = self.view(make_context())
+
+        self.assertEqual(text.count('перерыв'), 1)
+        self.assertIn('Похожих вопросов: 3', text)
+        self.assertIn('Какую базу данных', text)
+
+    def test_live_feed_coalesces_questions_into_one_message(self):
+        feed = LiveQuestionFeed()
+        feed.subscribe(self.speaker.id, SPEAKER_TG_ID, self.talk.id)
+        buffer = QuestionBuffer()
+        buffer.add_flush_listener(feed.collect)
+        for number in range(5):
+            buffer.add(Question(speaker=self.speaker, client=self.client_profile, text=f'Вопрос {number}'))
+        buffer.flush()
+        bot = mock.MagicMock()
+        user_data = {SPEAKER_TG_ID: {}}
+
+        self.assertEqual(feed.send_pending(bot, user_data), 1)
+        self.assertEqual(feed.send_pending(bot, user_data), 0)
+        delivery_queue.wait()
+
+        bot.send_message.assert_called_once()
+        self.assertIn('Вопрос 4', bot.send_message.call_args.kwargs['text'])
+        context = make_context(user_data[SPEAKER_TG_ID])
+        self.assertEqual(self.view(context), 'Новых вопросов нет.')
+
+
+class TalkClustersTest(TestCase):
+
+    def test_groups_near_duplicates(self):
+        clusters = TalkClusters()
+        texts = [
+            'Какой фреймворк вы используете для бэкенда?',
+            'какой фреймворк вы используете для бэкенда',
+            'Будут ли выложены слайды доклада?',
+            'Какой фреймворк используете для бэкенда?',
+            'Будут ли выложены слайды?',
+        ]
+        for question_id, text in enumerate(texts, start=1):
+            clusters.add(question_id, text)
+
+        self.assertEqual([cluster.count for cluster in clusters.top()], [3, 2])
+        self.assertIs(clusters.cluster_of(1), clusters.cluster_of(4))
+        self.assertIsNot(clusters.cluster_of(1), clusters.cluster_of(3))
+
+    def test_adding_does_not_slow_down_with_stream_size(self):
+        clusters = TalkClusters()
+        words = ['python', 'django', 'база', 'релиз', 'тесты', 'async', 'деплой', 'кэш', 'очередь', 'метрики']
+
+        def add_batch(start):
+            started = time.perf_counter()
+            for question_id in range(start, start + 500):
+                text = ' '.join(words[(question_id * step) % len(words)] for step in (1, 3, 7, 9))
+                clusters.add(question_id, f'{text} {question_id}')
+            return time.perf_counter() - started
+
+        first = add_batch(0)
+        for start in range(500, 5000, 500):
+            add_batch(start)
+        last = add_batch(5000)
+        self.assertLess(last, first * 3 + 0.05)
+
+
+class FloodControlTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        UserTg.objects.create(tg_id=ORGANIZER_TG_ID, is_organizator=True)
+        UserTg.objects.create(tg_id=CLIENT_TG_ID)
+
+    def setUp(self):
+        user_profiles._profiles.clear()
+        self.flood_control = FloodControl(
+            limits={'message': (0.001, 3), 'command': (0.001, 2), 'callback': (0.001, 3)},
+            privileged_factor=4, global_rate=1000, global_burst=1000)
+
+    def make_message(self, tg_id, text='Программы'):
+        update = make_update(tg_id, text=text)
+        update.callback_query = None
+        return update
+
+    def send(self, tg_id, text='Программы'):
+        self.flood_control.check(self.make_message(tg_id, text), make_context())
+
+    def test_excess_messages_are_dropped_with_one_warning(self):
+        for _ in range(3):
+            self.send(CLIENT_TG_ID)
+        first, second = self.make_message(CLIENT_TG_ID), self.make_message(CLIENT_TG_ID)
+        with self.assertRaises(DispatcherHandlerStop):
+            self.flood_control.check(first, make_context())
+        with self.assertRaises(DispatcherHandlerStop):
+            self.flood_control.check(second, make_context())
+
+        first.message.reply_text.assert_called_once()
+        second.message.reply_text.assert_not_called()
+
+    def test_commands_and_other_users_have_separate_buckets(self):
+        for _ in range(3):
+            self.send(CLIENT_TG_ID)
+        self.send(CLIENT_TG_ID, text='/start')
+        self.send(ORGANIZER_TG_ID)
+
+    def test_organizers_get_looser_limits(self):
+        with CaptureQueriesContext(connection) as queries:
+            for _ in range(12):
+                self.send(ORGANIZER_TG_ID)
+        self.assertEqual(len(queries), 1)
+        with self.assertRaises(DispatcherHandlerStop):
+            self.send(ORGANIZER_TG_ID)
+
+    def test_dropped_callback_is_answered(self):
+        update = make_update(CLIENT_TG_ID, data='find_partner')
+        for _ in range(3):
+            self.flood_control.check(update, make_context())
+        with self.assertRaises(DispatcherHandlerStop):
+            self.flood_control.check(update, make_context())
+        update.callback_query.answer.assert_called_once()
+
+    def test_idle_users_are_evicted(self):
+        flood_control = FloodControl(limits={'message': (1, 1)}, idle_ttl=600, max_users=10)
+        for tg_id in range(100):
+            flood_control.allow(tg_id, 'message')
+        self.assertLessEqual(len(flood_control._states), 10)
+
+
+class InstrumentTest(TestCase):
+
+    def calls(self, name, outcome):
+        prefix = f'meetup_bot_handler_calls_total{{handler="{name}",outcome="{outcome}"}} '
+        lines = [line for line in render_metrics().splitlines() if line.startswith(prefix)]
+        return int(lines[0][len(prefix):]) if lines else 0
+
+    def test_calls_are_measured_with_their_outcome(self):
+        def counted(update, context):
+            UserTg.objects.count()
+            UserTg.objects.exists()
+
+        def failing(update, context):
+            raise ValueError('сбой')
+
+        instrument(counted)(make_update(CLIENT_TG_ID), make_context())
+        with self.assertRaises(ValueError):
+            instrument(failing)(make_update(CLIENT_TG_ID), make_context())
+
+        self.assertEqual(self.calls('counted', 'ok'), 1)
+        self.assertEqual(self.calls('failing', 'error'), 1)
+        lines = render_metrics().splitlines()
+        self.assertIn('meetup_bot_handler_db_queries_bucket{handler="counted",le="1"} 0', lines)
+        self.assertIn('meetup_bot_handler_db_queries_bucket{handler="counted",le="2"} 1', lines)
+        self.assertIn('meetup_bot_handler_db_queries_sum{handler="counted"} 2', lines)
+        self.assertIn('meetup_bot_handler_seconds_count{handler="failing"} 1', lines)
+
+    def test_dump_replaces_metrics_file(self):
+        path = os.path.join(tempfile.mkdtemp(), 'metrics.prom')
+        dump_metrics(path)
+        dump_metrics(path)
+
+        self.assertEqual(os.listdir(os.path.dirname(path)), ['metrics.prom'])
+        with open(path, encoding='utf-8') as file:
+            self.assertIn('# TYPE meetup_bot_handler_seconds histogram', file.read().splitlines())
+
+    def test_flood_control_stop_is_counted_as_dropped(self):
+        def stopped(update, context):
+            raise DispatcherHandlerStop()
+
+        with self.assertRaises(DispatcherHandlerStop):
+            instrument(stopped)(make_update(CLIENT_TG_ID), make_context())
+        self.assertEqual(self.calls('stopped', 'dropped'), 1)
+        self.assertEqual(self.calls('stopped', 'error'), 0)
+
+
+class LoadTestHarnessTest(TestCase):
+
+    def test_attendees_go_through_all_flows(self):
+        # потоки гостей пишут в базу одновременно, поэтому прогоняем команду load_test
+        # в отдельном процессе: у неё файловая база, как у бота, а не общая in-memory
+        result = subprocess.run(
+            [sys.executable, 'manage.py', 'load_test', '--attendees', '4', '--concurrency', '2',
+             '--workers', '2', '--lanes', '2', '--seed', '7', '--json'],
+            cwd=settings.BASE_DIR, capture_output=True, text=True, timeout=300)
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertNotIn('OperationalError', result.stdout + result.stderr)
+        report = json.loads(result.stdout.splitlines()[-1])
+
+        self.assertEqual(report['dropped'], 0)
+        self.assertGreaterEqual(report['updates'], 4 * 6)
+        for name in ('start', 'guest_choice', 'actual_button', 'ask_question', 'question_input'):
+            self.assertEqual(report['handlers'][name]['calls'], 4)
+        self.assertEqual({name: stats['errors'] for name, stats in report['handlers'].items() if stats['errors']}, {})
+        self.assertEqual(report['questions'], 4)
+        self.assertLessEqual(report['p50'], report['p95'])
+        self.assertLessEqual(report['p95'], report['p99'])
+
+    def test_plans_are_reproducible_with_seed(self):
+        event = Event(id=1)
+        plans = LoadTest(mock.Mock(), event, attendees=20, seed=3).plans()
+        self.assertEqual(LoadTest(mock.Mock(), event, attendees=20, seed=3).plans(), plans)
+        self.assertNotEqual(LoadTest(mock.Mock(), event, attendees=20, seed=4).plans(), plans)
+
+    def test_temporary_database_on_postgres_is_a_server_database(self):
+        default = connections['default']
+        with mock.patch.object(default, 'vendor', 'postgresql'), \
+                mock.patch.dict(default.settings_dict['TEST']), \
+                mock.patch.object(default.creation, 'create_test_db', return_value='old') as create, \
+                mock.patch.object(default.creation, 'destroy_test_db') as destroy:
+            with temporary_database(prefix='meetup_bench_'):
+                name = default.settings_dict['TEST']['NAME']
+
+        self.assertTrue(name.startswith('meetup_bench_'))
+        self.assertFalse(name.endswith('.sqlite3'))
+        create.assert_called_once()
+        destroy.assert_called_once_with('old', verbosity=0)
+
+
+class BenchmarkCommandTest(TestCase):
+
+    def test_every_scenario_reports_both_variants(self):
+        result = subprocess.run(
+            [sys.executable, 'manage.py', 'benchmark', '--clients', '200', '--users', '500',
+             '--questions', '40', '--threads', '4', '--repeat', '5',
+             '--concurrency', '1,4', '--workers', '2', '--lanes', '2', '--api-latency', '0', '--json'],
+            cwd=settings.BASE_DIR, capture_output=True, text=True, timeout=300)
+        self.assertEqual(result.returncode, 0, result.stderr)
+        report = json.loads(result.stdout.splitlines()[-1])
+
+        self.assertIn('journal_mode=wal', report['database'])
+        variants = {(row['benchmark'], row['variant']): row for row in report['results']}
+        self.assertEqual(set(variants), {
+            ('partners', 'top_k'), ('partners', 'per_pair'), ('lookup', 'tg_id_index'),
+            ('lookup', 'full_scan'), ('questions', 'create_per_row'), ('questions', 'question_buffer'),
+            ('dispatch', 'run_async'), ('dispatch', 'lanes_only')})
+        self.assertEqual(variants['partners', 'top_k']['runs'], 5)
+        self.assertGreater(variants['questions', 'question_buffer']['per_second'], 0)
+        dispatch = [row for row in report['results'] if row['benchmark'] == 'dispatch']
+        self.assertEqual(sorted((row['size'], row['variant']) for row in dispatch), [
+            (1, 'lanes_only'), (1, 'run_async'), (4, 'lanes_only'), (4, 'run_async')])
+        self.assertTrue(all(row['updates'] and not row['dropped'] for row in dispatch))
+
+
+class FakeBotApiTest(TestCase):
+    def setUp(self):
+        self.api = FakeBotApi(port=0, seed=1).start()
+        self.addCleanup(self.api.stop)
+        self.bot = Bot(STUB_BOT_TOKEN, base_url=self.api.base_url)
+
+    def test_calls_are_answered_and_recorded(self):
+        message = self.bot.send_message(chat_id=CLIENT_TG_ID, text='Привет')
+        self.bot.edit_message_text(chat_id=CLIENT_TG_ID, message_id=message.message_id, text='Пока')
+        self.bot.answer_callback_query('1')
+
+        self.assertEqual(message.text, 'Привет')
+        self.assertEqual([call.method for call in self.api.calls],
+                         ['sendMessage', 'editMessageText', 'answerCallbackQuery'])
+        self.assertEqual(self.api.stats()['messages'], 2)
+
+    def test_pushed_updates_are_returned_by_get_updates(self):
+        update_id = self.api.push_update({'message': {
+            'message_id': 1, 'date': 0, 'text': '/start',
+            'chat': {'id': CLIENT_TG_ID, 'type': 'private'}}})
+
+        updates = self.bot.get_updates(timeout=1)
+        self.assertEqual([update.update_id for update in updates], [update_id])
+        self.assertEqual(self.bot.get_updates(offset=update_id + 1, timeout=0), [])
+
+    def test_injected_retry_after_raises(self):
+        self.api.retry_after_rate = 1
+        with self.assertRaises(RetryAfter):
+            self.bot.send_message(chat_id=CLIENT_TG_ID, text='Привет')
+        self.assertEqual(self.api.stats()['statuses'], {429: 1})
+
+    def test_enforced_chat_limit(self):
+        self.api.enforce_limits = True
+        self.bot.send_message(chat_id=CLIENT_TG_ID, text='Первое')
+        with self.assertRaises(RetryAfter):
+            self.bot.send_message(chat_id=CLIENT_TG_ID, text='Второе')
+        self.bot.send_message(chat_id=ORGANIZER_TG_ID, text='В другой чат')
+
+
+class DjangoPersistenceTest(TestCase):
+    def setUp(self):
+        user_profiles._profiles.clear()
+        screen_cache.bump()
+        self.event = seed_program()
+
+    def build_dispatcher(self):
+        persistence = DjangoPersistence()
+        bot = build_bot(STUB_BOT_TOKEN, workers=1, lanes=1, request_class=StubRequest)
+        dispatcher = build_dispatcher(bot, workers=1, lanes=1, flood_control=None, persistence=persistence)
+        return persistence, dispatcher, LoadTest(dispatcher, self.event)
+
+    def test_user_data_is_loaded_lazily_and_written_in_batches(self):
+        persistence = DjangoPersistence()
+        with self.assertNumQueries(0):
+            user_data = persistence.get_user_data()
+        for user_id in range(50):
+            with self.assertNumQueries(1):
+                user_data[user_id]['phone'] = f'+7999{user_id:07d}'
+            persistence.update_user_data(user_id, user_data[user_id])
+            persistence.update_user_data(user_id, user_data[user_id])
+        persistence.update_conversation('event_registration', (1, 1), 2)
+
+        with self.assertNumQueries(4):
+            self.assertEqual(persistence.write(), 51)
+        self.assertEqual(persistence.write(), 0)
+
+        restarted = DjangoPersistence()
+        with self.assertNumQueries(0):
+            user_data = restarted.get_user_data()
+        self.assertEqual(user_data[7], {'phone': '+79990000007'})
+        self.assertEqual(restarted.get_conversations('event_registration'), {(1, 1): 2})
+
+    def test_registration_survives_restart(self):
+        tg_id = ATTENDEE_TG_ID_BASE + 1
+        persistence, dispatcher, updates = self.build_dispatcher()
+        for update in [
+            updates.message_update(tg_id, '/start'),
+            updates.callback_update(tg_id, 'role_guest'),
+            updates.callback_update(tg_id, 'register_for_event'),
+            updates.callback_update(tg_id, f'register_event_{self.event.id}'),
+            updates.message_update(tg_id, 'Иван Петров'),
+        ]:
+            Dispatcher.process_update(dispatcher, update)
+        persistence.write()
+
+        persistence, dispatcher, updates = self.build_dispatcher()
+        Dispatcher.process_update(dispatcher, updates.message_update(tg_id, '+79991234567'))
+        Dispatcher.process_update(dispatcher, updates.callback_update(tg_id, 'stack_backend'))
+        persistence.write()
+
+        client = Client.objects.get(user__tg_id=tg_id)
+        self.assertEqual((client.name, str(client.contact_phone)), ('Иван Петров', '+79991234567'))
+        self.assertTrue(EventRegistration.objects.filter(client=client, event=self.event).exists())
+        self.assertFalse(ConversationState.objects.filter(name='event_registration').exists())
+
+
+def message_update(bot, update_id, chat_id, text):
+    return Update.de_json({'update_id': update_id, 'message': {
+        'message_id': update_id, 'date': 0, 'text': text,
+        'chat': {'id': chat_id, 'type': 'private'},
+        'from': {'id': chat_id, 'is_bot': False, 'first_name': 'Гость'}}}, bot)
+
+
+class LaneDispatcherTest(TestCase):
+    def setUp(self):
+        self.bot = Bot(STUB_BOT_TOKEN, request=StubRequest())
+        self.dispatcher = LaneDispatcher(self.bot, Queue(), workers=2, lanes=2)
+
+    def run_updates(self, updates):
+        ready = ThreadEvent()
+        thread = Thread(target=self.dispatcher.start, args=(ready,), daemon=True)
+        thread.start()
+        ready.wait(10)
+        for update in updates:
+            self.dispatcher.update_queue.put(update)
+        self.dispatcher.stop()
+        thread.join()
+
+    def test_updates_of_one_chat_are_processed_in_order(self):
+        handled = []
+        delays = iter([0.002 * (number % 3) for number in range(100)])
+
+        def handle(update, context):
+            time.sleep(next(delays))
+            handled.append((update.effective_chat.id, update.update_id, current_thread().name))
+
+        self.dispatcher.add_handler(MessageHandler(Filters.text, handle))
+        chats = [10, 11, 12, 13, 14]
+        self.run_updates([message_update(self.bot, update_id, chats[update_id % len(chats)], 'Программы')
+                          for update_id in range(1, 51)])
+
+        self.assertEqual(len(handled), 50)
+        self.assertEqual({thread for _, _, thread in handled}, {'lane_0', 'lane_1'})
+        for chat_id in chats:
+            chat_updates = [update_id for chat, update_id, _ in handled if chat == chat_id]
+            self.assertEqual(chat_updates, sorted(chat_updates))
+            self.assertEqual(len({thread for chat, _, thread in handled if chat == chat_id}), 1)
+
+    def test_connections_are_released_after_updates_and_jobs(self):
+        handler_threads, released_threads = set(), set()
+
+        def handle(update, context):
+            handler_threads.add(current_thread().name)
+
+        self.dispatcher.add_handler(MessageHandler(Filters.text('sync'), handle))
+        self.dispatcher.add_handler(MessageHandler(Filters.text('async'), handle, run_async=True))
+        job_queue = ReleasingJobQueue()
+        job_queue.set_dispatcher(self.dispatcher)
+        job = job_queue.run_repeating(lambda context: handle(None, context), interval=60)
+        with mock.patch.object(update_scheduler, 'close_old_connections',
+                               side_effect=lambda: released_threads.add(current_thread().name)):
+            self.run_updates([message_update(self.bot, 1, 10, 'sync'), message_update(self.bot, 2, 11, 'async')])
+            job.callback(make_context())
+
+        self.assertEqual(len(handler_threads), 3)
+        self.assertLessEqual(handler_threads, released_threads)
+
+
+class SettingsTest(TestCase):
+    def load_settings(self, **environ):
+        environ = {key: value for key, value in os.environ.items()
+                   if not key.startswith(('DB_', 'BOT_'))} | environ
+        with mock.patch.dict(os.environ, environ, clear=True):
+            return runpy.run_path(settings_module.__file__)['DATABASES']['default']
+
+    def test_sqlite_by_default(self):
+        database = self.load_settings()
+        self.assertEqual(database['ENGINE'], 'django.db.backends.sqlite3')
+        self.assertEqual(database['OPTIONS']['transaction_mode'], 'IMMEDIATE')
+        self.assertIn('journal_mode=WAL', database['OPTIONS']['init_command'])
+
+    def test_postgres_pool_is_sized_from_bot_threads(self):
+        database = self.load_settings(DB_ENGINE='postgres', BOT_WORKERS='8', BOT_LANES='2')
+        self.assertEqual(database['ENGINE'], 'django.db.backends.postgresql')
+        self.assertEqual(database['OPTIONS']['pool']['max_size'], 8 + 2 + 10 + 4)
+        self.assertNotIn('CONN_MAX_AGE', database)
+
+        database = self.load_settings(DB_ENGINE='postgres', DB_POOL_SIZE='50')
+        self.assertEqual(database['OPTIONS']['pool']['max_size'], 50)
+
+    def test_postgres_without_pool_keeps_persistent_connections(self):
+        database = self.load_settings(DB_ENGINE='postgres', DB_POOL_SIZE='0', DB_CONN_MAX_AGE='60')
+        self.assertNotIn('OPTIONS', database)
+        self.assertEqual(database['CONN_MAX_AGE'], 60)
+        self.assertTrue(database['CONN_HEALTH_CHECKS'])
+
+    def test_unknown_engine_is_rejected(self):
+        with self.assertRaises(ImproperlyConfigured):
+            self.load_settings(DB_ENGINE='mysql')
+
+
+class ShardedDispatcherTest(TestCase):
+    def message(self, update_id, chat_id):
+        return {'update_id': update_id, 'message': {
+            'message_id': update_id, 'date': 0, 'text': 'Программы',
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': {'id': chat_id, 'is_bot': False, 'first_name': 'Гость'}}}
+
+    def test_shard_key_is_chat_or_user(self):
+        self.assertEqual(shard_key(self.message(1, 42)), 42)
+        self.assertEqual(shard_key({'update_id': 2, 'callback_query': {
+            'id': '1', 'from': {'id': 7}, 'message': {'chat': {'id': 42}}}}), 42)
+        self.assertEqual(shard_key({'update_id': 3, 'pre_checkout_query': {'id': '1', 'from': {'id': 7}}}), 7)
+
+    def test_every_lane_is_used_inside_a_shard(self):
+        bot = Bot(STUB_BOT_TOKEN, request=StubRequest())
+        shards = lanes = 4
+        dispatcher = LaneDispatcher(bot, Queue(), workers=1, lanes=lanes, shards=shards)
+        # все чаты, которые достаются шарду 1
+        chat_ids = range(1, 400, shards)
+
+        used = {dispatcher.lane_for(Update.de_json(self.message(chat_id, chat_id), bot)) for chat_id in chat_ids}
+        self.assertEqual(used, set(range(lanes)))
+
+    def test_metrics_of_all_shards_are_summed(self):
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, 'metrics.prom')
+        for shard, calls in enumerate((2, 3)):
+            with open(f'{path}.{shard}', 'w', encoding='utf-8') as file:
+                file.write(
+                    '# HELP meetup_bot_handler_calls_total Вызовы обработчиков по исходу\n'
+                    '# TYPE meetup_bot_handler_calls_total counter\n'
+                    f'meetup_bot_handler_calls_total{{handler="start",outcome="ok"}} {calls}\n'
+                    f'meetup_bot_handler_calls_total{{handler="help{shard}",outcome="ok"}} 1\n')
+
+        with override_settings(BOT_METRICS_FILE=path):
+            response = self.client.get('/metrics/')
+
+        self.assertEqual(response.status_code, 200)
+        lines = response.content.decode().splitlines()
+        self.assertEqual(lines.count('# TYPE meetup_bot_handler_calls_total counter'), 1)
+        self.assertIn('meetup_bot_handler_calls_total{handler="start",outcome="ok"} 5', lines)
+        self.assertIn('meetup_bot_handler_calls_total{handler="help1",outcome="ok"} 1', lines)
+
+    def test_cache_events_reach_other_shards(self):
+        directory = tempfile.mkdtemp()
+        log = os.path.join(directory, 'log')
+        bot = Bot(STUB_BOT_TOKEN, request=StubRequest())
+        dispatcher = ShardedDispatcher(
+            bot, Queue(), shards=2, worker_target=event_shard_worker, worker_options={'log': log},
+            mp_context=multiprocessing.get_context('fork'))
+        ready = ThreadEvent()
+        thread = Thread(target=dispatcher.start, args=(ready,), daemon=True)
+        thread.start()
+        ready.wait(10)
+
+        for update_id, chat_id in ((1, 10), (2, 11)):
+            dispatcher.update_queue.put(Update.de_json(self.message(update_id, chat_id), bot))
+        dispatcher.update_queue.join()
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            if os.path.exists(log):
+                with open(log) as file:
+                    if len(file.readlines()) == 2:
+                        break
+            time.sleep(0.05)
+        dispatcher.stop()
+        thread.join()
+
+        with open(log) as file:
+            self.assertEqual(sorted(file.read().splitlines()), ['0 profile 2', '1 profile 1'])
+
+    def test_crashed_worker_gets_unacknowledged_updates_in_order(self):
+        directory = tempfile.mkdtemp()
+        log = os.path.join(directory, 'log')
+        bot = Bot(STUB_BOT_TOKEN, request=StubRequest())
+        dispatcher = ShardedDispatcher(
+            bot, Queue(), shards=2, worker_target=crashing_shard_worker,
+            worker_options={'marker': os.path.join(directory, 'started'), 'log': log},
+            mp_context=multiprocessing.get_context('fork'))
+        ready = ThreadEvent()
+        thread = Thread(target=dispatcher.start, args=(ready,), daemon=True)
+        thread.start()
+        ready.wait(10)
+
+        chats = [10, 11, 12, 13]
+        update_ids = range(1, 25)
+        for update_id in update_ids:
+            dispatcher.update_queue.put(
+                Update.de_json(self.message(update_id, chats[update_id % len(chats)]), bot))
+        dispatcher.update_queue.join()
+        deadline = time.monotonic() + 30
+        while any(stats['pending'] for stats in dispatcher.shard_stats()) and time.monotonic() < deadline:
+            time.sleep(0.05)
+        dispatcher.stop()
+        thread.join()
+
+        with open(log) as file:
+            handled = [tuple(map(int, line.split())) for line in file]
+        self.assertEqual(sorted(update_id for _, _, update_id in handled), list(update_ids))
+        for shard, chat_id, _ in handled:
+            self.assertEqual(shard, chat_id % 2)
+        for chat_id in chats:
+            chat_updates = [update_id for _, chat, update_id in handled if chat == chat_id]
+            self.assertEqual(chat_updates, sorted(chat_updates))
+        self.assertEqual([stats['restarts'] for stats in dispatcher.shard_stats()], [1, 1])
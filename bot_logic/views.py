@@ -1,3 +1,20 @@
-from django.shortcuts import render
+from django.conf import settings
+from django.http import HttpResponse
 
-# Create your views here.
+from metrics import merge_metrics, metrics_files
+
+
+def metrics(request):
+    """Метрики обработчиков бота в текстовом формате Prometheus.
+
+    При BOT_SHARDS > 1 каждый процесс-обработчик пишет свой файл, здесь они складываются."""
+    texts = []
+    for path in metrics_files(settings.BOT_METRICS_FILE):
+        try:
+            with open(path, encoding='utf-8') as file:
+                texts.append(file.read())
+        except FileNotFoundError:
+            continue
+    if not texts:
+        return HttpResponse('метрики ещё не записаны\n', status=503, content_type='text/plain')
+    return HttpResponse(merge_metrics(texts), content_type='text/plain; version=0.0.4; charset=utf-8')
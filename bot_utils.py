@@ -1,4 +1,8 @@
 import json
+import os
+from bisect import bisect_right
+from collections import namedtuple
+from threading import Lock
 
 from datetime import datetime
 from telegram import BotCommand
@@ -33,25 +37,17 @@ def load_schedule_from_json(file_path='dummy_schedule.json'):
         return []
 
 
-def get_full_schedule():
-    """Возвращает полное расписание мероприятия."""
-    program_content = load_schedule_from_json()
-
-    return program_content
-
+ScheduleSnapshot = namedtuple('ScheduleSnapshot', ['program', 'starts', 'talks', 'max_ends'])
+EMPTY_SCHEDULE = ScheduleSnapshot((), (), (), ())
 
-def get_current_talk_details():
-    """Определяет текущий активный доклад на основе системного времени.
-     Возвращает словарь с деталями доклада или None, если активного доклада нет."""
 
-    full_program = get_full_schedule()
+def parse_schedule(program_records):
+    """Разбирает время докладов один раз и сортирует их по началу.
 
-    if not full_program:
-        return None
-
-    current_time_obj = datetime.now().time()
-
-    for talk_entry in full_program:
+    Для каждой позиции хранится максимальное время окончания среди докладов
+    слева, чтобы поиск текущего доклада не просматривал уже закончившиеся."""
+    talks = []
+    for position, talk_entry in enumerate(program_records):
         start_time_str = talk_entry.get('start_time')
         end_time_str = talk_entry.get('end_time')
 
@@ -64,12 +60,76 @@ def get_current_talk_details():
         try:
             talk_start_time = datetime.strptime(start_time_str, '%H:%M').time()
             talk_end_time = datetime.strptime(end_time_str, '%H:%M').time()
-
-            if talk_start_time <= current_time_obj < talk_end_time:
-                return talk_entry
         except ValueError:
             print(f'Ошибка парсинга времени для доклада: \"{talk_entry.get("talk_title", "N/A")}\". '
                   f'Ожидался формат ЧЧ:ММ, получено: start=\"{start_time_str}\", end=\"{end_time_str}\".')
             continue
+        talks.append((talk_start_time, talk_end_time, position, talk_entry))
+
+    talks.sort(key=lambda talk: (talk[0], talk[2]))
+    max_ends = []
+    for _, talk_end_time, _, _ in talks:
+        max_ends.append(max(max_ends[-1], talk_end_time) if max_ends else talk_end_time)
+    return ScheduleSnapshot(
+        program=tuple(program_records),
+        starts=tuple(talk[0] for talk in talks),
+        talks=tuple(talks),
+        max_ends=tuple(max_ends),
+    )
+
+
+class ScheduleStore:
+    """Расписание из JSON-файла, которое перечитывается только при изменении файла.
 
-    return None
+    Изменение определяется по mtime и размеру, а разобранный снимок общий для
+    всех обработчиков."""
+
+    def __init__(self, file_path='dummy_schedule.json'):
+        self.file_path = file_path
+        self._lock = Lock()
+        self._signature = ()
+        self._snapshot = EMPTY_SCHEDULE
+
+    def _file_signature(self):
+        try:
+            stat = os.stat(self.file_path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def snapshot(self):
+        signature = self._file_signature()
+        if signature == self._signature:
+            return self._snapshot
+        with self._lock:
+            if signature != self._signature:
+                self._snapshot = parse_schedule(load_schedule_from_json(self.file_path))
+                self._signature = signature
+            return self._snapshot
+
+    def current_talk(self, moment=None):
+        """Доклад, который идёт в момент moment (по умолчанию сейчас), или None."""
+        snapshot = self.snapshot()
+        moment = moment or datetime.now().time()
+        found = None
+        position = bisect_right(snapshot.starts, moment) - 1
+        while position >= 0 and snapshot.max_ends[position] > moment:
+            _, talk_end_time, order, talk_entry = snapshot.talks[position]
+            if talk_end_time > moment and (found is None or order < found[0]):
+                found = order, talk_entry
+            position -= 1
+        return found[1] if found else None
+
+
+schedule_store = ScheduleStore()
+
+
+def get_full_schedule():
+    """Возвращает полное расписание мероприятия."""
+    return schedule_store.snapshot().program
+
+
+def get_current_talk_details():
+    """Определяет текущий активный доклад на основе системного времени.
+     Возвращает словарь с деталями доклада или None, если активного доклада нет."""
+    return schedule_store.current_talk()
@@ -0,0 +1,153 @@
+from threading import Event as ThreadEvent, Thread
+from time import sleep
+
+from cachetools import TTLCache
+from django.db import close_old_connections
+from django.db.models import Count, Max, Q
+from django.utils import timezone
+from telegram.error import BadRequest, RetryAfter, TelegramError, Unauthorized
+
+from bot_logic.models import Broadcast, BroadcastDelivery, UserTg
+from rate_limits import TokenBucket
+
+DELIVERY_BATCH_SIZE = 500
+MAX_ATTEMPTS = 5
+
+
+def get_audience_chat_ids(audience, event_id=None):
+    """Telegram id получателей по возрастанию, без повторов."""
+    if audience == 'clients':
+        users = UserTg.objects.filter(client__isnull=False)
+    elif audience == 'speakers':
+        users = UserTg.objects.filter(is_speaker=True, speaker__isnull=False)
+    elif audience == 'event':
+        users = UserTg.objects.filter(client__registrations__event_id=event_id)
+    else:
+        raise ValueError(f'Неизвестная аудитория рассылки: {audience}')
+    return users.values_list('tg_id', flat=True).distinct().order_by('tg_id')
+
+
+def create_broadcast(text, audience, event_id=None, created_by_id=None):
+    """Создаёт рассылку. Возвращает рассылку и число получателей.
+
+    Очередь доставок здесь не заполняется: её пачками строит BroadcastSender,
+    чтобы обработчик организатора не держал блокировку записи на всю аудиторию."""
+    total = get_audience_chat_ids(audience, event_id).count()
+    broadcast = Broadcast.objects.create(
+        text=text, audience=audience, event_id=event_id, created_by_id=created_by_id)
+    return broadcast, total
+
+
+def expand_broadcast(broadcast):
+    """Добавляет получателей рассылки в очередь доставок пачками по
+    DELIVERY_BATCH_SIZE, каждая пачка в своей короткой транзакции. После
+    перезапуска продолжает с последнего добавленного получателя."""
+    chat_ids = get_audience_chat_ids(broadcast.audience, broadcast.event_id)
+    last_chat_id = BroadcastDelivery.objects.filter(broadcast=broadcast).aggregate(last=Max('chat_id'))['last']
+    while True:
+        batch = chat_ids if last_chat_id is None else chat_ids.filter(tg_id__gt=last_chat_id)
+        batch = list(batch[:DELIVERY_BATCH_SIZE])
+        BroadcastDelivery.objects.bulk_create(
+            [BroadcastDelivery(broadcast=broadcast, chat_id=chat_id) for chat_id in batch],
+            ignore_conflicts=True)
+        if len(batch) < DELIVERY_BATCH_SIZE:
+            break
+        last_chat_id = batch[-1]
+    Broadcast.objects.filter(pk=broadcast.pk).update(is_expanded=True)
+
+
+class BroadcastSender(Thread):
+    """Фоновая отправка рассылок с соблюдением лимитов Telegram.
+
+    Прогресс хранится в BroadcastDelivery, поэтому после перезапуска бота
+    отправка продолжается с первой недоставленной записи."""
+
+    def __init__(self, bot, rate=25, per_chat_interval=1, poll_interval=5, shared_bucket=None):
+        super().__init__(name='broadcast_sender', daemon=True)
+        self.bot = bot
+        self.bucket = TokenBucket(rate)
+        # лимит, общий с другими отправками процесса, например delivery_queue.bucket
+        self.shared_bucket = shared_bucket
+        self.per_chat_interval = per_chat_interval
+        self.poll_interval = poll_interval
+        self._recent_chats = TTLCache(maxsize=100000, ttl=per_chat_interval)
+        self._wakeup = ThreadEvent()
+        self._stopped = ThreadEvent()
+
+    def notify(self):
+        self._wakeup.set()
+
+    def stop(self):
+        self._stopped.set()
+        self._wakeup.set()
+        self.join()
+
+    def run(self):
+        while not self._stopped.is_set():
+            try:
+                has_sent = self.send_pending()
+            except Exception as e:
+                print(f'Ошибка при отправке рассылки: {e}')
+                has_sent = False
+            finally:
+                close_old_connections()
+            if not has_sent:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+
+    def send_pending(self):
+        for broadcast in Broadcast.objects.filter(is_expanded=False, is_finished=False).order_by('id'):
+            expand_broadcast(broadcast)
+        deliveries = list(BroadcastDelivery.objects.filter(
+            status='pending', broadcast__is_finished=False
+        ).select_related('broadcast').order_by('id')[:DELIVERY_BATCH_SIZE])
+        for delivery in deliveries:
+            if self._stopped.is_set():
+                break
+            self.deliver(delivery)
+        self.finish_broadcasts()
+        return bool(deliveries)
+
+    def deliver(self, delivery):
+        if delivery.chat_id in self._recent_chats:
+            sleep(self.per_chat_interval)
+        self.bucket.consume()
+        if self.shared_bucket:
+            self.shared_bucket.consume()
+        try:
+            self.bot.send_message(chat_id=delivery.chat_id, text=delivery.broadcast.text)
+        except RetryAfter as e:
+            # запись остаётся в очереди и уйдёт на следующем проходе
+            sleep(e.retry_after)
+            return
+        except (Unauthorized, BadRequest) as e:
+            self._save(delivery, status='failed', attempts=delivery.attempts + 1, error=str(e))
+            return
+        except TelegramError as e:
+            attempts = delivery.attempts + 1
+            status = 'failed' if attempts >= MAX_ATTEMPTS else 'pending'
+            self._save(delivery, status=status, attempts=attempts, error=str(e))
+            return
+        self._recent_chats[delivery.chat_id] = True
+        self._save(delivery, status='sent', attempts=delivery.attempts + 1, sent_at=timezone.now())
+
+    def _save(self, delivery, **fields):
+        BroadcastDelivery.objects.filter(pk=delivery.pk).update(**fields)
+
+    def finish_broadcasts(self):
+        finished = Broadcast.objects.filter(is_finished=False, is_expanded=True).annotate(
+            pending=Count('deliveries', filter=Q(deliveries__status='pending')),
+            sent=Count('deliveries', filter=Q(deliveries__status='sent')),
+            failed=Count('deliveries', filter=Q(deliveries__status='failed')),
+        ).filter(pending=0).select_related('created_by')
+        for broadcast in finished:
+            Broadcast.objects.filter(pk=broadcast.pk).update(
+                is_finished=True, finished_at=timezone.now())
+            if not broadcast.created_by:
+                continue
+            try:
+                self.bot.send_message(
+                    chat_id=broadcast.created_by.tg_id,
+                    text=f"Рассылка завершена.\nДоставлено: {broadcast.sent}\nНе доставлено: {broadcast.failed}")
+            except TelegramError as e:
+                print(e)
@@ -0,0 +1,280 @@
+import json
+import random
+import re
+from collections import defaultdict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from itertools import count
+from threading import Condition, Lock, Thread
+from time import monotonic, sleep, time
+from urllib.parse import parse_qsl, urlsplit
+from urllib.request import Request as UrlRequest, urlopen
+
+PATH_RE = re.compile(r'^/bot(?P<token>[^/]+)/(?P<method>\w+)$')
+MESSAGE_METHODS = {'sendMessage', 'editMessageText', 'sendInvoice', 'sendPhoto', 'sendDocument', 'copyMessage'}
+# остальные методы (getMe, setWebhook, setMyCommands) нужны боту для запуска и не сбоят
+FAULT_METHODS = MESSAGE_METHODS | {'answerCallbackQuery', 'getUpdates'}
+MAX_LONG_POLL = 50
+
+
+class ApiCall:
+    __slots__ = ('moment', 'method', 'params', 'status')
+
+    def __init__(self, moment, method, params, status):
+        self.moment = moment
+        self.method = method
+        self.params = params
+        self.status = status
+
+    @property
+    def chat_id(self):
+        return self.params.get('chat_id')
+
+
+class FakeBotApi:
+    """Локальная замена Telegram Bot API для сквозных замеров.
+
+    Отвечает на методы бота так же, как Telegram, только без сети: getUpdates
+    с long polling, setWebhook/deleteWebhook, sendMessage, editMessageText,
+    answerCallbackQuery, sendInvoice и остальные методы отправки. Умеет
+    отвечать с задержкой, случайными 429 RetryAfter и 500, а с
+    enforce_limits — отвечать 429, как Telegram, когда бот превышает
+    global_limit сообщений в секунду или chat_limit сообщений в секунду в
+    один чат. Каждый вызов записывается, чтобы потом посчитать сообщения в
+    секунду и нарушения лимитов."""
+
+    def __init__(self, host='127.0.0.1', port=8081, latency=0, jitter=0, retry_after_rate=0,
+                 retry_after=1, error_rate=0, enforce_limits=False, global_limit=30, chat_limit=1, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.retry_after_rate = retry_after_rate
+        self.retry_after = retry_after
+        self.error_rate = error_rate
+        self.enforce_limits = enforce_limits
+        self.global_limit = global_limit
+        self.chat_limit = chat_limit
+        self.random = random.Random(seed)
+        self.calls = []
+        self.webhook_url = ''
+        self._lock = Lock()
+        self._updates = deque()
+        self._has_updates = Condition(self._lock)
+        self._update_ids = count(1)
+        self._message_ids = count(1)
+        self._recent = deque()
+        self._recent_by_chat = defaultdict(deque)
+        self.server = ThreadingHTTPServer((host, port), self._handler_class())
+        self.server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}/bot'
+
+    def start(self):
+        self._thread = Thread(target=self.server.serve_forever, name='fake_bot_api', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        with self._lock:
+            self._has_updates.notify_all()
+
+    def push_update(self, update):
+        """Ставит обновление (dict в формате Bot API) боту: через webhook, если он
+        установлен, иначе в очередь getUpdates."""
+        update = dict(update)
+        with self._lock:
+            update.setdefault('update_id', next(self._update_ids))
+            webhook_url = self.webhook_url
+            if not webhook_url:
+                self._updates.append(update)
+                self._has_updates.notify_all()
+        if webhook_url:
+            Thread(target=self._post_webhook, args=(webhook_url, update), daemon=True).start()
+        return update['update_id']
+
+    def _post_webhook(self, webhook_url, update):
+        request = UrlRequest(webhook_url, data=json.dumps(update).encode(),
+                             headers={'Content-Type': 'application/json'})
+        try:
+            urlopen(request, timeout=10).close()
+        except OSError as e:
+            print(f'Webhook не принял обновление {update["update_id"]}: {e}')
+
+    def _get_updates(self, params):
+        offset = int(params.get('offset') or 0)
+        limit = int(params.get('limit') or 100)
+        deadline = monotonic() + min(float(params.get('timeout') or 0), MAX_LONG_POLL)
+        with self._lock:
+            while self._updates and self._updates[0]['update_id'] < offset:
+                self._updates.popleft()
+            while not self._updates and monotonic() < deadline:
+                self._has_updates.wait(deadline - monotonic())
+            return [update for update, _ in zip(list(self._updates), range(limit))]
+
+    def _over_limit(self, chat_id, now):
+        """Скользящее окно в секунду: общий лимит и лимит на чат, как у Telegram."""
+        while self._recent and now - self._recent[0] >= 1:
+            self._recent.popleft()
+        chat_recent = self._recent_by_chat[chat_id]
+        while chat_recent and now - chat_recent[0] >= 1:
+            chat_recent.popleft()
+        if len(self._recent) >= self.global_limit or len(chat_recent) >= self.chat_limit:
+            return True
+        self._recent.append(now)
+        chat_recent.append(now)
+        return False
+
+    def call(self, method, params):
+        """Возвращает (HTTP-статус, ответ) на вызов метода Bot API."""
+        if self.latency or self.jitter:
+            sleep(self.latency + self.random.uniform(0, self.jitter))
+
+        with self._lock:
+            roll = self.random.random() if method in FAULT_METHODS else 1
+            now = monotonic()
+            if roll < self.retry_after_rate:
+                status = 429
+            elif roll < self.retry_after_rate + self.error_rate:
+                status = 500
+            elif self.enforce_limits and method in MESSAGE_METHODS and self._over_limit(params.get('chat_id'), now):
+                status = 429
+            else:
+                status = 200
+            self.calls.append(ApiCall(time(), method, params, status))
+            if status == 200 and method == 'setWebhook':
+                self.webhook_url = params.get('url') or ''
+            elif status == 200 and method == 'deleteWebhook':
+                self.webhook_url = ''
+            message_id = next(self._message_ids)
+
+        if status == 429:
+            return status, {
+                'ok': False, 'error_code': 429,
+                'description': f'Too Many Requests: retry after {self.retry_after}',
+                'parameters': {'retry_after': self.retry_after},
+            }
+        if status == 500:
+            return status, {'ok': False, 'error_code': 500, 'description': 'Internal Server Error'}
+        if method == 'getUpdates':
+            return status, {'ok': True, 'result': self._get_updates(params)}
+        return status, {'ok': True, 'result': self._result(method, params, message_id)}
+
+    def _result(self, method, params, message_id):
+        if method == 'getMe':
+            return {'id': 1, 'is_bot': True, 'first_name': 'Meetup', 'username': 'meetup_bot'}
+        if method == 'getWebhookInfo':
+            return {'url': self.webhook_url, 'has_custom_certificate': False, 'pending_update_count': len(self._updates)}
+        if method not in MESSAGE_METHODS:
+            return True
+        chat_id = int(params.get('chat_id') or 0)
+        result = {
+            'message_id': int(params.get('message_id') or message_id), 'date': int(time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+        }
+        if 'text' in params:
+            result['text'] = params['text']
+        if method == 'sendInvoice':
+            result['invoice'] = {
+                'title': params.get('title', ''), 'description': params.get('description', ''),
+                'start_parameter': params.get('start_parameter', ''), 'currency': params.get('currency', ''),
+                'total_amount': sum(price.get('amount', 0) for price in params.get('prices') or []),
+            }
+        return result
+
+    def stats(self):
+        """Сводка по записанным вызовам: сколько каких методов, сообщения в секунду
+        и сколько раз бот превысил бы лимиты Telegram."""
+        with self._lock:
+            calls = list(self.calls)
+        methods = defaultdict(int)
+        statuses = defaultdict(int)
+        for call in calls:
+            methods[call.method] += 1
+            statuses[call.status] += 1
+        sent = [call for call in calls if call.method in MESSAGE_METHODS and call.status == 200]
+        seconds = sent[-1].moment - sent[0].moment if len(sent) > 1 else 0
+        return {
+            'calls': len(calls),
+            'methods': dict(methods),
+            'statuses': dict(statuses),
+            'messages': len(sent),
+            'messages_per_second': len(sent) / seconds if seconds else 0,
+            'global_violations': count_violations(sent, self.global_limit),
+            'chat_violations': sum(
+                count_violations(chat_calls, self.chat_limit)
+                for chat_calls in group_by_chat(sent).values()),
+        }
+
+    def _handler_class(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, status, payload):
+                body = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _params(self):
+                url = urlsplit(self.path)
+                params = dict(parse_qsl(url.query))
+                length = int(self.headers.get('Content-Length') or 0)
+                body = self.rfile.read(length) if length else b''
+                content_type = self.headers.get('Content-Type', '')
+                if body and content_type.startswith('application/json'):
+                    payload = json.loads(body)
+                    if isinstance(payload, list):
+                        return url.path, payload
+                    params.update(payload)
+                elif body and content_type.startswith('application/x-www-form-urlencoded'):
+                    params.update(parse_qsl(body.decode()))
+                return url.path, params
+
+            def do_GET(self):
+                self.do_POST()
+
+            def do_POST(self):
+                path, params = self._params()
+                if path == '/fake/updates':
+                    updates = params if isinstance(params, list) else params.get('updates', [params])
+                    self._reply(200, {'ok': True, 'result': [api.push_update(update) for update in updates]})
+                    return
+                if path == '/fake/stats':
+                    self._reply(200, {'ok': True, 'result': api.stats()})
+                    return
+                match = PATH_RE.match(path)
+                if not match:
+                    self._reply(404, {'ok': False, 'error_code': 404, 'description': 'Not Found'})
+                    return
+                self._reply(*api.call(match['method'], params))
+
+        return Handler
+
+
+def group_by_chat(calls):
+    by_chat = defaultdict(list)
+    for call in calls:
+        by_chat[call.chat_id].append(call)
+    return by_chat
+
+
+def count_violations(calls, limit):
+    """Сколько вызовов пришлось на секунду, где их уже было limit или больше."""
+    violations = 0
+    window = deque()
+    for call in calls:
+        while window and call.moment - window[0] >= 1:
+            window.popleft()
+        if len(window) >= limit:
+            violations += 1
+        window.append(call.moment)
+    return violations
@@ -0,0 +1,119 @@
+from threading import Lock
+from time import monotonic
+
+from cachetools import TTLCache
+from environs import Env
+from telegram import Update
+from telegram.error import TelegramError
+from telegram.ext import CallbackContext, DispatcherHandlerStop
+
+from metrics import flood_dropped
+from rate_limits import TokenBucket
+from user_profiles import get_user_profile
+
+env = Env()
+env.read_env()
+
+WARNING_INTERVAL = 10
+FLOOD_WARNING = "Слишком много запросов, подождите немного."
+
+
+def update_kind(update):
+    """К какому классу лимитов относится обновление. None — не ограничивается."""
+    if update.callback_query:
+        return 'callback'
+    if update.message and update.message.text:
+        return 'command' if update.message.text.startswith('/') else 'message'
+    return None
+
+
+class FloodControl:
+    """Ограничение частоты обновлений от одного пользователя и от всех вместе.
+
+    Для каждого пользователя и класса обновлений хранится маленький token
+    bucket `[токены, время, множитель, время предупреждения]`. Состояния лежат
+    в TTLCache, так что давно молчавшие пользователи вытесняются сами.
+    Спикеры и организаторы получают лимиты в `privileged_factor` раз больше;
+    роль проверяется, только когда обычный лимит уже исчерпан."""
+
+    def __init__(self, limits, privileged_factor=5, global_rate=100, global_burst=300,
+                 idle_ttl=600, max_users=100000):
+        self.limits = limits
+        self.privileged_factor = privileged_factor
+        self.global_bucket = TokenBucket(global_rate, global_burst)
+        self._lock = Lock()
+        self._states = TTLCache(maxsize=max_users, ttl=idle_ttl)
+
+    def _factor(self, user_id):
+        profile = get_user_profile(user_id)
+        if profile and (profile.is_organizator or profile.is_speaker):
+            return self.privileged_factor
+        return 1
+
+    def allow(self, user_id, kind):
+        """True, если обновление можно обрабатывать; иначе токены не списываются."""
+        rate, burst = self.limits[kind]
+        now = monotonic()
+        with self._lock:
+            state = self._states.get((user_id, kind)) or [burst, now, None, 0]
+            factor = state[2] or 1
+            state[0] = min(burst * factor, state[0] + (now - state[1]) * rate * factor)
+            state[1] = now
+            self._states[(user_id, kind)] = state
+            if state[0] >= 1:
+                state[0] -= 1
+                return True
+            if state[2] is not None:
+                return False
+
+        factor = self._factor(user_id)
+        with self._lock:
+            state[2] = factor
+            if factor > 1:
+                state[0] += burst * (factor - 1)
+            if state[0] >= 1:
+                state[0] -= 1
+                return True
+            return False
+
+    def should_warn(self, user_id, kind):
+        now = monotonic()
+        with self._lock:
+            state = self._states.get((user_id, kind))
+            if state is None or now - state[3] < WARNING_INTERVAL:
+                return False
+            state[3] = now
+            return True
+
+    def check(self, update: Update, context: CallbackContext):
+        """Обработчик группы -1: отбрасывает лишние обновления до основных обработчиков."""
+        kind = update_kind(update)
+        user = update.effective_user
+        if kind is None or user is None:
+            return
+        if self.allow(user.id, kind) and not self.global_bucket.try_consume():
+            return
+
+        flood_dropped.inc((kind,))
+        try:
+            if update.callback_query:
+                update.callback_query.answer(FLOOD_WARNING)
+            elif self.should_warn(user.id, kind):
+                update.message.reply_text(FLOOD_WARNING)
+        except TelegramError as e:
+            print(e)
+        raise DispatcherHandlerStop()
+
+
+flood_control = FloodControl(
+    limits={
+        'message': (env.float('FLOOD_MESSAGE_RATE', 1), env.int('FLOOD_MESSAGE_BURST', 5)),
+        'command': (env.float('FLOOD_COMMAND_RATE', 0.5), env.int('FLOOD_COMMAND_BURST', 3)),
+        'callback': (env.float('FLOOD_CALLBACK_RATE', 2), env.int('FLOOD_CALLBACK_BURST', 8)),
+    },
+    privileged_factor=env.int('FLOOD_PRIVILEGED_FACTOR', 5),
+    global_rate=env.float('FLOOD_GLOBAL_RATE', 100),
+    global_burst=env.int('FLOOD_GLOBAL_BURST', 300),
+    idle_ttl=env.int('FLOOD_IDLE_TTL', 600),
+    max_users=env.int('FLOOD_MAX_USERS', 100000),
+)
@@ -1,5 +1,5 @@
 from telegram.error import TelegramError
-from django.db.models import Q
+from django.db.models import Q, Prefetch
 from datetime import datetime
 from django.utils import timezone
 from environs import Env
@@ -7,14 +7,25 @@ from telegram import Update, LabeledPrice, InlineKeyboardButton, InlineKeyboardM
 from telegram.ext import CallbackContext, ConversationHandler
 from telegram import ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMarkup, InlineKeyboardButton
 from phonenumber_field.modelfields import PhoneNumberField
-from bot_utils import get_current_talk_details, get_full_schedule, load_schedule_from_json
+from bot_utils import get_current_talk_details, get_full_schedule
 from keyboards import (
     get_client_main_keyboard, get_speaker_main_keyboard, get_organizator_main_keyboard,
     get_favorite_keyboard, get_actual_section_details_keyboard, get_speaker_in_process_keyboard,
     get_programs_section_details_keyboard, get_programs_section_details_second_keyboard,
-    get_actual_section_details_keyboard, get_client_initial_keyboard
+    get_actual_section_details_keyboard, get_client_initial_keyboard, get_broadcast_audience_keyboard,
+    get_partner_options_keyboard
 )
 from bot_logic.models import UserTg, Client, Speaker, Question, Event, Session, SpeakerSession, EventRegistration
+from user_profiles import get_user_profile, get_or_create_user_profile
+from live_timeline import live_timeline
+from broadcasts import create_broadcast
+from notifications import delivery_queue
+from pagination import KeysetList, parse_page_callback
+from partner_matching import partner_index
+from pairing import pairing_scheduler
+from question_buffer import question_buffer
+from live_questions import live_questions
+from question_clusters import question_clusters
 
 registered_users = set()
 CHOOSE_ROLE, TYPING_ORGANIZER_PASSWORD = range(2)
@@ -26,15 +37,18 @@ QUESTION_INPUT = 7
 BIO_INPUT = 8
 PARTNER_CHOICE = 9
 EVENT_SELECTION = 10
+PARTNERS_TOP_K = 10
+NEW_QUESTIONS_LIMIT = 20
+POPULAR_QUESTIONS_LIMIT = 20
+BROADCAST_TEXT, BROADCAST_AUDIENCE = range(11, 13)
 
 
 def start(update: Update, context: CallbackContext):
     user = update.effective_user
-    user_tg, created = UserTg.objects.get_or_create(
-        tg_id=user.id, defaults={'nic_tg': user.username})
-    is_client = Client.objects.filter(user=user_tg).exists()
-    is_speaker = user_tg.is_speaker
-    is_organizer = user_tg.is_organizator
+    profile = get_or_create_user_profile(user)
+    is_client = profile.client_id is not None
+    is_speaker = profile.is_speaker
+    is_organizer = profile.is_organizator
 
     determined_role = "Организатор" if is_organizer else "Спикер" if is_speaker else "Гость" if is_client else None
 
@@ -62,12 +76,9 @@ def show_main_interface(update: Update, context: CallbackContext, role_name: str
     text = greeting_message or f'С возвращением, {user.first_name}! Ваша роль: {role_name}.'
 
     if role_name == "Гость":
-        try:
-            user_tg = UserTg.objects.get(tg_id=user.id)
-            reply_markup = get_client_main_keyboard() if Client.objects.filter(
-                user=user_tg, is_registered=True).exists() else get_client_initial_keyboard()
-        except UserTg.DoesNotExist:
-            reply_markup = get_client_initial_keyboard()
+        profile = get_user_profile(user.id)
+        reply_markup = get_client_main_keyboard() if profile and profile.is_registered \
+            else get_client_initial_keyboard()
     elif role_name == "Спикер":
         reply_markup = get_speaker_main_keyboard()
     else:
@@ -137,7 +148,7 @@ def donate(update: Update, context: CallbackContext):
 
 
 def get_current_speaker():
-    program = load_schedule_from_json()
+    program = get_full_schedule()
     return program[0].get('speaker_name', 'Неизвестный Спикер') if program else 'Неизвестный Спикер'
 
 
@@ -180,9 +191,10 @@ def guest_choice(update: Update, context: CallbackContext):
     query = update.callback_query
     query.answer()
     user = query.from_user
-    user_tg = UserTg.objects.get(tg_id=user.id)
-    client, created = Client.objects.get_or_create(
-        user=user_tg, defaults={'name': user.first_name})
+    profile = get_or_create_user_profile(user)
+    if profile.client_id is None:
+        Client.objects.get_or_create(
+            user_id=profile.user_id, defaults={'name': user.first_name})
     query.edit_message_text("Вы выбрали: Я Гость. Добро пожаловать!")
     show_main_interface(update, context, "Гость",
                         f"Добро пожаловать, {user.first_name}!")
@@ -193,36 +205,34 @@ def speaker_choice(update: Update, context: CallbackContext):
     query = update.callback_query
     query.answer()
     user = query.from_user
-    user_tg = UserTg.objects.get(tg_id=user.id)
+    profile = get_or_create_user_profile(user)
 
-    if user_tg.is_speaker:
+    if profile.is_speaker:
         query.edit_message_text(
             "Вы уже подтвержденный спикер. Добро пожаловать!")
         show_main_interface(update, context, "Спикер",
                             f"Добро пожаловать, {user.first_name}!")
         return ConversationHandler.END
 
-    if Speaker.objects.filter(user=user_tg).exists():
+    if profile.speaker_id is not None:
         query.edit_message_text(
             "Ваша заявка на роль спикера ожидает подтверждения.")
         return ConversationHandler.END
 
-    Speaker.objects.create(user=user_tg, name=user.first_name)
-    for organizer in UserTg.objects.filter(is_organizator=True):
-        try:
-            keyboard = [[
-                InlineKeyboardButton(
-                    "Принять", callback_data=f"approve_speaker_{user.id}"),
-                InlineKeyboardButton(
-                    "Отказать", callback_data=f"reject_speaker_{user.id}")
-            ]]
-            context.bot.send_message(
-                chat_id=organizer.tg_id,
-                text=f"Пользователь {user.first_name} хочет стать спикером. Подтвердить?",
-                reply_markup=InlineKeyboardMarkup(keyboard)
-            )
-        except Exception as e:
-            print(e)
+    Speaker.objects.create(user_id=profile.user_id, name=user.first_name)
+    keyboard = InlineKeyboardMarkup([[
+        InlineKeyboardButton(
+            "Принять", callback_data=f"approve_speaker_{user.id}"),
+        InlineKeyboardButton(
+            "Отказать", callback_data=f"reject_speaker_{user.id}")
+    ]])
+    for organizer_tg_id in UserTg.objects.filter(is_organizator=True).values_list('tg_id', flat=True):
+        delivery_queue.send_message(
+            context.bot,
+            chat_id=organizer_tg_id,
+            text=f"Пользователь {user.first_name} хочет стать спикером. Подтвердить?",
+            reply_markup=keyboard
+        )
 
     query.edit_message_text(
         "Заявка на роль спикера отправлена на подтверждение.")
@@ -283,7 +293,8 @@ def speaker_approval(update: Update, context: CallbackContext):
         if action == "approve":
             speaker_user.is_speaker = True
             speaker_user.save()
-            context.bot.send_message(
+            delivery_queue.send_message(
+                context.bot,
                 chat_id=speaker_id,
                 text="Ваша заявка на роль спикера одобрена!",
                 reply_markup=get_speaker_main_keyboard()
@@ -292,7 +303,8 @@ def speaker_approval(update: Update, context: CallbackContext):
                 f"Вы одобрили заявку пользователя {speaker_user.nic_tg}.")
         elif action == "reject":
             speaker_profile.delete()
-            context.bot.send_message(
+            delivery_queue.send_message(
+                context.bot,
                 chat_id=speaker_id,
                 text="Ваша заявка на роль спикера отклонена."
             )
@@ -305,9 +317,9 @@ def speaker_approval(update: Update, context: CallbackContext):
 
 def speaker_events(update: Update, context: CallbackContext):
     user = update.effective_user
-    user_tg = UserTg.objects.get(tg_id=user.id)
-    now = timezone.now()
-    sessions = SpeakerSession.objects.filter(speaker__user=user_tg).select_related(
+    profile = get_user_profile(user.id)
+    speaker_id = profile.speaker_id if profile else None
+    sessions = SpeakerSession.objects.filter(speaker_id=speaker_id).select_related(
         'session__event').order_by('start_session')
 
     if not sessions.exists():
@@ -333,18 +345,17 @@ def speaker_events(update: Update, context: CallbackContext):
 
 def start_talk(update: Update, context: CallbackContext):
     user = update.effective_user
-    user_tg = UserTg.objects.get(tg_id=user.id)
-    now = timezone.now()
-    current_session = SpeakerSession.objects.filter(
-        speaker__user=user_tg, start_session__lte=now, finish_session__gte=now, is_finish=False
-    ).select_related('session__event').first()
+    profile = get_user_profile(user.id)
+    current_session = None
+    if profile and profile.speaker_id is not None:
+        current_session = live_timeline.current_talk(speaker_id=profile.speaker_id)
 
     if not current_session:
         update.message.reply_text(
             "Нет запланированного выступления.", reply_markup=get_speaker_main_keyboard())
         return
 
-    if SpeakerSession.objects.filter(session__event=current_session.session.event, finish_session__lt=current_session.start_session, is_finish=False).exists():
+    if live_timeline.has_unfinished_before(current_session.session.event_id, current_session.start_session):
         update.message.reply_text(
             "Предыдущий спикер еще выступает.", reply_markup=get_speaker_main_keyboard())
         return
@@ -356,52 +367,148 @@ def start_talk(update: Update, context: CallbackContext):
     )
 
 
+def get_speaker_talk(update: Update):
+    profile = get_user_profile(update.effective_user.id)
+    if not profile or profile.speaker_id is None:
+        return None
+    return live_timeline.current_talk(speaker_id=profile.speaker_id)
+
+
+def talk_questions(talk):
+    # спикер должен видеть и вопросы, которые ещё ждут записи в буфере
+    question_buffer.flush()
+    return Question.objects.filter(
+        speaker_id=talk.speaker_id,
+        created_at__gte=talk.start_session,
+        created_at__lte=talk.finish_session
+    ).select_related('client')
+
+
+def get_talk_questions(update: Update):
+    current_session = get_speaker_talk(update)
+    if not current_session:
+        return None
+    return talk_questions(current_session)
+
+
+def render_question(question):
+    return (
+        f"❓ {question.text}\n"
+        f"   👤 {question.client.name if question.client.name else 'Аноним'}\n"
+        f"   ⏱ {question.created_at.strftime('%H:%M')}\n"
+        "────────────────────"
+    )
+
+
+questions_list = KeysetList(
+    'questions', get_talk_questions, render_question,
+    header="❓ Вопросы к вашему выступлению:\n",
+    empty_text="Пока нет вопросов.",
+    unavailable_text="Нет активного выступления.",
+)
+
+
 def view_questions(update: Update, context: CallbackContext):
-    user = update.effective_user
-    user_tg = UserTg.objects.get(tg_id=user.id)
-    now = timezone.now()
-    current_session = SpeakerSession.objects.filter(
-        speaker__user=user_tg, start_session__lte=now, finish_session__gte=now, is_finish=False
-    ).first()
+    """Показывает только вопросы, пришедшие после последнего просмотра.
 
+    Похожие вопросы схлопываются в один с числом повторов."""
+    current_session = get_speaker_talk(update)
     if not current_session:
         update.message.reply_text(
             "Нет активного выступления.", reply_markup=get_speaker_in_process_keyboard())
         return
 
-    questions = Question.objects.filter(
-        speaker=current_session.speaker,
-        created_at__gte=current_session.start_session,
-        created_at__lte=current_session.finish_session
-    ).select_related('client').order_by('created_at')
+    cursor_talk_id, last_id = context.user_data.get('questions_cursor', (None, 0))
+    if cursor_talk_id != current_session.id:
+        last_id = 0
+    questions = talk_questions(current_session)
+    clusters = question_clusters.for_talk(current_session.id, questions)
+    questions = list(questions.filter(id__gt=last_id).order_by('id')[:NEW_QUESTIONS_LIMIT + 1])
+    has_more = len(questions) > NEW_QUESTIONS_LIMIT
+    questions = questions[:NEW_QUESTIONS_LIMIT]
+
+    reply_markup = InlineKeyboardMarkup([
+        [InlineKeyboardButton("Все вопросы", callback_data="all_questions")],
+        [InlineKeyboardButton("Популярные вопросы", callback_data="popular_questions")],
+    ])
+    if not questions:
+        update.message.reply_text("Новых вопросов нет.", reply_markup=reply_markup)
+        return
+
+    context.user_data['questions_cursor'] = (current_session.id, questions[-1].id)
+    message = ["❓ Новые вопросы:\n"]
+    shown_clusters = set()
+    for question in questions:
+        cluster = clusters.cluster_of(question.id)
+        text = render_question(question)
+        if cluster is not None:
+            if id(cluster) in shown_clusters:
+                continue
+            shown_clusters.add(id(cluster))
+            if cluster.count > 1:
+                text += f"\n   🔁 Похожих вопросов: {cluster.count}"
+        message.append(text)
+    if has_more:
+        message.append("Есть ещё новые вопросы, нажмите «ГЛЯНУТЬ ВОПРОСЫ» ещё раз.")
+    update.message.reply_text("\n".join(message)[:4096], reply_markup=reply_markup)
+
+
+def all_questions(update: Update, context: CallbackContext):
+    query = update.callback_query
+    query.answer()
+    text, reply_markup = questions_list.page(update)
+    query.edit_message_text(text, reply_markup=reply_markup)
+
+
+def popular_questions(update: Update, context: CallbackContext):
+    """Группы похожих вопросов выступления, самые частые сверху."""
+    query = update.callback_query
+    query.answer()
+    current_session = get_speaker_talk(update)
+    if not current_session:
+        query.edit_message_text("Нет активного выступления.")
+        return
+
+    clusters = question_clusters.for_talk(current_session.id, talk_questions(current_session))
+    top = clusters.top(POPULAR_QUESTIONS_LIMIT)
+    if not top:
+        query.edit_message_text("Пока нет вопросов.")
+        return
+    message = ["🔥 Популярные вопросы:\n"]
+    message.extend(
+        f"❓ {cluster.text}\n   🔁 Похожих вопросов: {cluster.count}\n────────────────────" for cluster in top)
+    query.edit_message_text("\n".join(message)[:4096])
+
 
-    if not questions.exists():
+def toggle_live_questions(update: Update, context: CallbackContext):
+    """Включает и выключает автоматическую присылку новых вопросов спикеру."""
+    profile = get_user_profile(update.effective_user.id)
+    if not profile or profile.speaker_id is None:
+        return
+    if live_questions.is_subscribed(profile.speaker_id):
+        live_questions.unsubscribe(profile.speaker_id)
         update.message.reply_text(
-            "Пока нет вопросов.", reply_markup=get_speaker_in_process_keyboard())
+            "Поток вопросов выключен.", reply_markup=get_speaker_in_process_keyboard())
         return
 
-    message = ["❓ Вопросы к вашему выступлению:\n"]
-    for i, question in enumerate(questions, 1):
-        message.append(
-            f"{i}. {question.text}\n"
-            f"   👤 {question.client.name if question.client.name else 'Аноним'}\n"
-            f"   ⏱ {question.created_at.strftime('%H:%M')}\n"
-            "────────────────────"
-        )
+    current_session = live_timeline.current_talk(speaker_id=profile.speaker_id)
+    if not current_session:
+        update.message.reply_text(
+            "Нет активного выступления.", reply_markup=get_speaker_main_keyboard())
+        return
+    live_questions.subscribe(profile.speaker_id, update.effective_chat.id, current_session.id)
     update.message.reply_text(
-        "\n".join(message), reply_markup=get_speaker_in_process_keyboard())
+        "Поток вопросов включён: новые вопросы будут приходить сами, "
+        "не чаще одного сообщения в несколько секунд.",
+        reply_markup=get_speaker_in_process_keyboard())
 
 
 def finish_talk(update: Update, context: CallbackContext):
     user = update.effective_user
-    user_tg = UserTg.objects.get(tg_id=user.id)
-    now = timezone.now()
-    current_session = SpeakerSession.objects.filter(
-        speaker__user=user_tg,
-        start_session__lte=now,
-        finish_session__gte=now,
-        is_finish=False
-    ).first()
+    profile = get_user_profile(user.id)
+    current_session = None
+    if profile and profile.speaker_id is not None:
+        current_session = live_timeline.current_talk(speaker_id=profile.speaker_id)
 
     if not current_session:
         update.message.reply_text(
@@ -409,52 +516,53 @@ def finish_talk(update: Update, context: CallbackContext):
         return
 
     current_session.is_finish = True
-    current_session.save()
+    current_session.save(update_fields=['is_finish'])
+    live_questions.unsubscribe(profile.speaker_id)
     update.message.reply_text(
         "Выступление завершено! Спасибо за участие!", reply_markup=get_speaker_main_keyboard())
 
 
-def programs_button(update: Update, context: CallbackContext):
-    now = timezone.now()
-    events = Event.objects.all().order_by('start_event')
-    if not events.exists():
-        message = update.message or update.callback_query.message
-        message.reply_text("Нет запланированных мероприятий.",
-                           reply_markup=get_programs_section_details_keyboard())
-        return
+def render_program(event):
+    start_time = event.start_event.strftime(
+        "%d.%m.%Y %H:%M") if event.start_event else "дата уточняется"
+    return (
+        f"🔹 {event.name}\n"
+        f"📌 {event.address or 'уточняется'}\n"
+        f"🕒 {start_time}\n"
+        "────────────────────"
+    )
 
-    message = ["📅 Все предстоящие мероприятия:\n"]
-    for event in events:
-        start_time = event.start_event.strftime(
-            "%d.%m.%Y %H:%M") if event.start_event else "дата уточняется"
-        message.append(
-            f"🔹 {event.name}\n"
-            f"📌 {event.address or 'уточняется'}\n"
-            f"🕒 {start_time}\n"
-            "────────────────────"
-        )
-    reply_markup = get_programs_section_details_keyboard()
+
+programs_list = KeysetList(
+    'programs', lambda update: Event.objects.all(), render_program,
+    header="📅 Все предстоящие мероприятия:\n",
+    empty_text="Нет запланированных мероприятий.",
+    order_field='start_event',
+    extra_keyboard=lambda: get_programs_section_details_keyboard().inline_keyboard,
+    cacheable=True,
+)
+
+
+def programs_button(update: Update, context: CallbackContext):
+    text, reply_markup = programs_list.page(update)
     if update.message:
-        update.message.reply_text(
-            "\n".join(message), reply_markup=reply_markup)
+        update.message.reply_text(text, reply_markup=reply_markup)
     elif update.callback_query:
         update.callback_query.message.edit_text(
-            text="\n".join(message), reply_markup=reply_markup)
+            text=text, reply_markup=reply_markup)
 
 
 def actual_button(update: Update, context: CallbackContext):
     now = timezone.now()
-    current_event = Event.objects.filter(
-        start_event__lte=now, finish_event__gte=now).first()
+    current_event = live_timeline.current_event(now)
     if not current_event:
         message = update.message or update.callback_query.message
         message.reply_text("Нет активных мероприятий.",
                            reply_markup=get_actual_section_details_keyboard())
         return
 
-    current_speaker_session = SpeakerSession.objects.filter(
-        session__event=current_event, start_session__lte=now, finish_session__gte=now
-    ).select_related('session', 'speaker').first()
+    current_speaker_session = live_timeline.current_talk(
+        now, event_id=current_event.id, include_finished=True)
 
     message = [
         "🎤 Сейчас в эфире:\n",
@@ -481,28 +589,33 @@ def actual_button(update: Update, context: CallbackContext):
             text="\n".join(message), reply_markup=reply_markup)
 
 
-def event_details(update: Update, context: CallbackContext):
-    events = Event.objects.all()
-    if not events.exists():
-        update.message.reply_text("Нет запланированных мероприятий.",
-                                  reply_markup=get_programs_section_details_keyboard())
-        return
+def render_event_details(event):
+    start_time = event.start_event.strftime(
+        "%d.%m.%Y %H:%M") if event.start_event else "время уточняется"
+    end_time = event.finish_event.strftime(
+        "%H:%M") if event.finish_event else "время уточняется"
+    return (
+        f"📅 {event.name}\n"
+        f"📌 {event.address or 'место уточняется'}\n"
+        f"🕒 {start_time} - {end_time}\n"
+        f"ℹ️ {event.description or 'описание отсутствует'}\n"
+        "────────────────────"
+    )
+
+
+event_details_list = KeysetList(
+    'event_details', lambda update: Event.objects.all(), render_event_details,
+    header="Актуальные мероприятия:\n",
+    empty_text="Нет запланированных мероприятий.",
+    page_size=5,
+    extra_keyboard=lambda: get_programs_section_details_keyboard().inline_keyboard,
+    cacheable=True,
+)
 
-    message = ["Актуальные мероприятия:\n"]
-    for event in events:
-        start_time = event.start_event.strftime(
-            "%d.%m.%Y %H:%M") if event.start_event else "время уточняется"
-        end_time = event.finish_event.strftime(
-            "%H:%M") if event.finish_event else "время уточняется"
-        message.append(
-            f"📅 {event.name}\n"
-            f"📌 {event.address or 'место уточняется'}\n"
-            f"🕒 {start_time} - {end_time}\n"
-            f"ℹ️ {event.description or 'описание отсутствует'}\n"
-            "────────────────────"
-        )
-    update.message.reply_text(
-        "\n".join(message), reply_markup=get_programs_section_details_keyboard())
+
+def event_details(update: Update, context: CallbackContext):
+    text, reply_markup = event_details_list.page(update)
+    update.message.reply_text(text, reply_markup=reply_markup)
 
 
 def ask_question(update: Update, context: CallbackContext):
@@ -512,10 +625,7 @@ def ask_question(update: Update, context: CallbackContext):
     now = timezone.now()
 
     try:
-        current_session = SpeakerSession.objects.filter(
-            is_finish=False,
-            start_session__lte=now,
-            finish_session__gte=now).select_related('speaker', 'session__event').first()
+        current_session = live_timeline.current_talk(now)
         if not current_session:
             query.edit_message_text(
                 "Нет активных выступлений.", reply_markup=get_client_main_keyboard())
@@ -548,24 +658,24 @@ def question_input(update: Update, context: CallbackContext):
         if 'speaker_id' not in context.user_data or 'session_id' not in context.user_data:
             return ConversationHandler.END
 
-        speaker = Speaker.objects.get(id=context.user_data['speaker_id'])
-        session = SpeakerSession.objects.get(
-            id=context.user_data['session_id'])
+        session = live_timeline.talk(context.user_data['session_id'])
         now = timezone.now()
 
-        if session.is_finish or now < session.start_session or now > session.finish_session:
+        if not session or session.is_finish or now < session.start_session or now > session.finish_session:
             update.message.reply_text(
                 "Выступление завершено или еще не началось.", reply_markup=get_client_main_keyboard())
             return ConversationHandler.END
 
-        user_tg, _ = UserTg.objects.get_or_create(
-            tg_id=user.id, defaults={'nic_tg': user.username})
-        client, _ = Client.objects.get_or_create(
-            user=user_tg, defaults={'name': user.first_name})
-        Question.objects.create(speaker=speaker, client=client, text=question_text.strip(
-        ), event=session.session.event, created_at=now)
+        profile = get_or_create_user_profile(user)
+        client_id = profile.client_id
+        if client_id is None:
+            client, _ = Client.objects.get_or_create(
+                user_id=profile.user_id, defaults={'name': user.first_name})
+            client_id = client.id
+        question_buffer.add(Question(speaker_id=session.speaker_id, client_id=client_id, text=question_text.strip(
+        ), event_id=session.session.event_id, created_at=now))
         update.message.reply_text(
-            f"✅ Вопрос отправлен спикеру {speaker.name}!", reply_markup=get_client_main_keyboard())
+            f"✅ Вопрос отправлен спикеру {session.speaker.name}!", reply_markup=get_client_main_keyboard())
     except Exception as e:
         print(e)
 
@@ -582,24 +692,29 @@ def cancel_question(update: Update, context: CallbackContext):
     return ConversationHandler.END
 
 
+def render_timeline_event(event):
+    return (
+        f"📅 {event.name}\n"
+        f"🕒 {event.start_event.strftime('%d.%m.%Y %H:%M') if event.start_event else 'Дата уточняется'}\n"
+        f"📍 {event.address or 'Место уточняется'}\n"
+        "────────────────────"
+    )
+
+
+timeline_list = KeysetList(
+    'timeline', lambda update: Event.objects.all(), render_timeline_event,
+    header="⏳ Все мероприятия:\n",
+    empty_text="Нет информации о мероприятиях.",
+    order_field='start_event',
+    cacheable=True,
+)
+
+
 def timeline(update: Update, context: CallbackContext):
     query = update.callback_query
     query.answer()
-    events = Event.objects.all().order_by('start_event')
-
-    if not events.exists():
-        query.edit_message_text("Нет информации о мероприятиях.")
-        return ConversationHandler.END
-
-    message = ["⏳ Все мероприятия:\n"]
-    for event in events:
-        message.append(
-            f"📅 {event.name}\n"
-            f"🕒 {event.start_event.strftime('%d.%m.%Y %H:%M') if event.start_event else 'Дата уточняется'}\n"
-            f"📍 {event.address or 'Место уточняется'}\n"
-            "────────────────────"
-        )
-    query.edit_message_text("\n".join(message))
+    text, reply_markup = timeline_list.page(update)
+    query.edit_message_text(text, reply_markup=reply_markup)
     return ConversationHandler.END
 
 
@@ -607,9 +722,8 @@ def find_partner(update: Update, context: CallbackContext):
     query = update.callback_query
     query.answer()
     user = update.effective_user
-    user_tg, _ = UserTg.objects.get_or_create(
-        tg_id=user.id, defaults={'nic_tg': user.username})
-    client, _ = Client.objects.get_or_create(user=user_tg)
+    profile = get_or_create_user_profile(user)
+    client, _ = Client.objects.get_or_create(user_id=profile.user_id)
 
     if not client.biography:
         query.edit_message_text(
@@ -624,8 +738,7 @@ def find_partner(update: Update, context: CallbackContext):
 def receive_biography(update: Update, context: CallbackContext):
     user = update.effective_user
     biography = update.message.text
-    user_tg = UserTg.objects.get(tg_id=user.id)
-    client = Client.objects.get(user=user_tg)
+    client = Client.objects.get(user__tg_id=user.id)
     client.biography = biography
     client.save()
     update.message.reply_text(
@@ -633,35 +746,70 @@ def receive_biography(update: Update, context: CallbackContext):
     return show_partner_options(update, context)
 
 
+def render_partner(client):
+    biography = client.biography or 'Не указано'
+    return (
+        f"👤 {client.name or 'Без имени'}\n"
+        f"   Стек: {client.get_favorite_stack_display() or 'Не указан'}\n"
+        f"   О себе: {biography[:300]}\n"
+        f"   Телеграм: {'@' + str(client.user.nic_tg) if client.user.nic_tg else str(client.contact_phone)}\n"
+        "────────────────────"
+    )
+
+
 def show_partner_options(update: Update, context: CallbackContext):
     user = update.effective_user
-    user_tg = UserTg.objects.get(tg_id=user.id)
-    other_clients = Client.objects.exclude(user=user_tg).select_related('user')
+    profile = get_user_profile(user.id)
+    client_id = profile.client_id if profile else None
+    partner_ids = partner_index.top_k(client_id, k=PARTNERS_TOP_K)
+    partners = Client.objects.filter(id__in=partner_ids).select_related('user').in_bulk()
 
-    if not other_clients.exists():
+    if not partners:
         reply_text = "Пока нет других участников для общения."
     else:
-        message = ["Доступные собеседники:\n"]
-        for i, client in enumerate(other_clients, 1):
-            message.append(
-                f"{i}. {client.name or 'Без имени'}\n"
-                f"   Стек: {client.get_favorite_stack_display() or 'Не указан'}\n"
-                f"   О себе: {client.biography or 'Не указано'}\n"
-                f"   Телеграм: {'@' + str(client.user.nic_tg) if client.user.nic_tg else str(client.contact_phone)}\n"
-                "────────────────────"
-            )
+        message = ["Подходящие собеседники:\n"]
+        message.extend(render_partner(partners[partner_id])
+                       for partner_id in partner_ids if partner_id in partners)
         reply_text = "\n".join(message)
 
+    reply_markup = get_partner_options_keyboard() if client_id is not None else None
     if update.message:
-        update.message.reply_text(reply_text)
+        update.message.reply_text(reply_text, reply_markup=reply_markup)
     elif update.callback_query:
         update.callback_query.edit_message_text(
-            text=reply_text, reply_markup=None)
+            text=reply_text, reply_markup=reply_markup)
     else:
-        context.bot.send_message(chat_id=user.id, text=reply_text)
+        context.bot.send_message(chat_id=user.id, text=reply_text, reply_markup=reply_markup)
     return ConversationHandler.END
 
 
+def join_pairing(update: Update, context: CallbackContext):
+    """Записывает гостя в ближайший раунд нетворкинга."""
+    query = update.callback_query
+    query.answer()
+    user = update.effective_user
+    profile = get_user_profile(user.id)
+    if not profile or profile.client_id is None:
+        query.edit_message_text("Сначала расскажите о себе через «Найти собеседника».")
+        return
+    pairing_scheduler.opt_in(profile.client_id, user.id)
+    query.edit_message_text(
+        "Вы участвуете в ближайшем раунде нетворкинга. "
+        "Когда подберём пару, пришлём контакты собеседника.")
+
+
+def turn_page(update: Update, context: CallbackContext):
+    """Листает любой постраничный список: курсор приходит в callback_data."""
+    query = update.callback_query
+    query.answer()
+    try:
+        paged_list, direction, key = parse_page_callback(query.data)
+    except (KeyError, ValueError):
+        return
+    text, reply_markup = paged_list.page(update, direction, key)
+    query.edit_message_text(text, reply_markup=reply_markup)
+
+
 def cancel_partner_search(update: Update, context: CallbackContext):
     query = update.callback_query
     query.answer()
@@ -670,14 +818,20 @@ def cancel_partner_search(update: Update, context: CallbackContext):
     return ConversationHandler.END
 
 
+def cancel_event_registration(update: Update, context: CallbackContext):
+    query = update.callback_query
+    query.answer()
+    query.edit_message_text("Регистрация отменена.",
+                            reply_markup=get_client_main_keyboard())
+    return ConversationHandler.END
+
+
 def register_for_event(update: Update, context: CallbackContext):
     query = update.callback_query
     query.answer()
     user = update.effective_user
-    try:
-        user_tg = UserTg.objects.get(tg_id=user.id)
-        client = Client.objects.get(user=user_tg)
-    except (UserTg.DoesNotExist, Client.DoesNotExist):
+    profile = get_user_profile(user.id)
+    if not profile or profile.client_id is None:
         query.edit_message_text(
             "Сначала нужно зарегистрироваться в системе.",
             reply_markup=get_client_initial_keyboard()
@@ -732,12 +886,9 @@ def handle_event_selection(update: Update, context: CallbackContext):
         event = Event.objects.get(id=event_id)
 
         user = update.effective_user
-        user_tg, _ = UserTg.objects.get_or_create(
-            tg_id=user.id, defaults={'nic_tg': user.username}
-        )
-        client, created = Client.objects.get_or_create(user=user_tg)
+        profile = get_or_create_user_profile(user)
 
-        if created or not client.is_registered:
+        if not profile.is_registered:
             context.bot.send_message(
                 chat_id=query.message.chat_id,
                 text="Введите ваше ФИО:",
@@ -746,14 +897,14 @@ def handle_event_selection(update: Update, context: CallbackContext):
             )
             return REGISTER_NAME
         else:
-            if EventRegistration.objects.filter(client=client, event=event).exists():
+            if EventRegistration.objects.filter(client_id=profile.client_id, event=event).exists():
                 context.bot.send_message(
                     chat_id=query.message.chat_id,
                     text=f"Вы уже зарегистрированы на мероприятие: {event.name}",
                     reply_markup=get_client_main_keyboard()  # Reply keyboard
                 )
                 return ConversationHandler.END
-            EventRegistration.objects.create(client=client, event=event)
+            EventRegistration.objects.create(client_id=profile.client_id, event=event)
             event_date = event.start_event.strftime(
                 '%d.%m.%Y %H:%M') if event.start_event else 'дата уточняется'
             confirmation_message = (
@@ -789,48 +940,67 @@ def back_to_main(update: Update, context: CallbackContext):
     return ConversationHandler.END
 
 
+def render_event_program(event):
+    start_time = event.start_event.strftime(
+        "%d.%m.%Y %H:%M") if event.start_event else "дата уточняется"
+    end_time = event.finish_event.strftime(
+        "%H:%M") if event.finish_event else "время уточняется"
+    message = [
+        f"🔹 {event.name}\n"
+        f"📌 {event.address or 'уточняется'}\n"
+        f"🕒 {start_time} - {end_time}\n"
+        f"ℹ️ {event.description or 'нет описания'}\n"
+    ]
+    speaker_sessions = sorted(
+        (ss for session in event.sessions.all() for ss in session.speaker_sessions.all()),
+        key=lambda ss: ss.pk)
+    if speaker_sessions:
+        message.append("📢 Программа мероприятия:")
+        for ss in speaker_sessions:
+            session_start = ss.start_session.strftime(
+                "%H:%M") if ss.start_session else "время уточняется"
+            session_end = ss.finish_session.strftime(
+                "%H:%M") if ss.finish_session else "время уточняется"
+            message.append(
+                f"  • {ss.session.title if ss.session else 'Без названия'}\n"
+                f"    👤 {ss.speaker.name if ss.speaker else 'Спикер уточняется'}\n"
+                f"    🕒 {session_start} - {session_end}\n"
+            )
+    else:
+        message.append("ℹ️ Программа мероприятия пока не опубликована\n")
+    message.append("────────────────────")
+    return "\n".join(message)
+
+
+# самый большой экран: по несколько мероприятий на страницу, чтобы не упереться в 4096 символов
+program_details_list = KeysetList(
+    'program_details',
+    lambda update: Event.objects.prefetch_related(Prefetch(
+        'sessions', queryset=Session.objects.prefetch_related(Prefetch(
+            'speaker_sessions', queryset=SpeakerSession.objects.select_related('speaker'))))),
+    render_event_program,
+    header="📅 Подробная информация о предстоящих мероприятиях:\n",
+    empty_text="Нет запланированных мероприятий.",
+    order_field='start_event',
+    page_size=3,
+    extra_keyboard=lambda: get_programs_section_details_second_keyboard().inline_keyboard,
+    cacheable=True,
+)
+
+
 def program_details(update: Update, context: CallbackContext):
     query = update.callback_query
     query.answer()
-    now = timezone.now()
-    events = Event.objects.all()
+    text, reply_markup = program_details_list.page(update)
+    query.edit_message_text(text, reply_markup=reply_markup)
 
-    if not events.exists():
-        query.edit_message_text("Нет запланированных мероприятий.",
-                                reply_markup=get_programs_section_details_second_keyboard())
-        return
 
-    message = ["📅 Подробная информация о предстоящих мероприятиях:\n"]
-    for event in events:
-        start_time = event.start_event.strftime(
-            "%d.%m.%Y %H:%M") if event.start_event else "дата уточняется"
-        end_time = event.finish_event.strftime(
-            "%H:%M") if event.finish_event else "время уточняется"
-        message.append(
-            f"🔹 {event.name}\n"
-            f"📌 {event.address or 'уточняется'}\n"
-            f"🕒 {start_time} - {end_time}\n"
-            f"ℹ️ {event.description or 'нет описания'}\n"
-        )
-        speaker_sessions = SpeakerSession.objects.filter(
-            session__event=event).select_related('session', 'speaker')
-        if speaker_sessions.exists():
-            message.append("📢 Программа мероприятия:")
-            for ss in speaker_sessions:
-                session_start = ss.start_session.strftime(
-                    "%H:%M") if ss.start_session else "время уточняется"
-                session_end = ss.finish_session.strftime(
-                    "%H:%M") if ss.finish_session else "время уточняется"
-                message.append(
-                    f"  • {ss.session.title if ss.session else 'Без названия'}\n"
-                    f"    👤 {ss.speaker.name if ss.speaker else 'Спикер уточняется'}\n"
-                    f"    🕒 {session_start} - {session_end}\n"
-                )
-        else:
-            message.append("ℹ️ Программа мероприятия пока не опубликована\n")
-        message.append("────────────────────")
-    query.edit_message_text("\n".join(
-        message), reply_markup=get_programs_section_details_second_keyboard())
+def warm_up_screens():
+    """Заранее рендерит экраны с программой, чтобы первые нажатия не ждали базу."""
+    programs_list.page(None)
+    event_details_list.page(None)
+    timeline_list.page(None)
+    program_details_list.page(None)
 
 
 def start_registration(update: Update, context: CallbackContext):
@@ -933,6 +1103,10 @@ def register_stack(update: Update, context: CallbackContext):
     return ConversationHandler.END
 
 
+def ignore_update(update: Update, context: CallbackContext):
+    """Обновления, которые не подошли ни одному обработчику."""
+
+
 def cancel_registration(update: Update, context: CallbackContext):
     update.message.reply_text(
         "Регистрация отменена.", reply_markup=get_programs_section_details_keyboard())
@@ -954,3 +1128,66 @@ def cancel_conversation(update: Update, context: CallbackContext):
     print(f"Пользователь {user.id} отменил диалог.")
 
     return ConversationHandler.END
+
+
+def start_broadcast(update: Update, context: CallbackContext):
+    profile = get_user_profile(update.effective_user.id)
+    if not profile or not profile.is_organizator:
+        update.message.reply_text("Рассылки доступны только организаторам.")
+        return ConversationHandler.END
+
+    update.message.reply_text(
+        "Введите текст рассылки:",
+        reply_markup=InlineKeyboardMarkup(
+            [[InlineKeyboardButton("Отмена", callback_data="cancel_broadcast")]])
+    )
+    return BROADCAST_TEXT
+
+
+def broadcast_text(update: Update, context: CallbackContext):
+    context.user_data['broadcast_text'] = update.message.text
+    upcoming_events = Event.objects.filter(
+        finish_event__gte=timezone.now()).order_by('start_event')
+    update.message.reply_text(
+        "Кому отправить рассылку?",
+        reply_markup=get_broadcast_audience_keyboard(upcoming_events)
+    )
+    return BROADCAST_AUDIENCE
+
+
+def broadcast_audience(update: Update, context: CallbackContext):
+    query = update.callback_query
+    query.answer()
+    text = context.user_data.pop('broadcast_text', None)
+    if not text:
+        query.edit_message_text("Текст рассылки не найден, начните заново.")
+        return ConversationHandler.END
+
+    parts = query.data.split('_')
+    audience = parts[2]
+    event_id = int(parts[3]) if audience == 'event' else None
+    profile = get_user_profile(update.effective_user.id)
+    try:
+        _, total = create_broadcast(
+            text, audience, event_id, profile.user_id if profile else None)
+    except Exception as e:
+        print(e)
+        query.edit_message_text("Не удалось создать рассылку. Попробуйте позже.")
+        return ConversationHandler.END
+
+    sender = context.bot_data.get('broadcast_sender')
+    if sender:
+        sender.notify()
+    query.edit_message_text(
+        f"Рассылка запущена, получателей: {total}. Пришлю отчёт, когда она закончится.")
+    return ConversationHandler.END
+
+
+def cancel_broadcast(update: Update, context: CallbackContext):
+    context.user_data.pop('broadcast_text', None)
+    if update.callback_query:
+        update.callback_query.answer()
+        update.callback_query.edit_message_text("Рассылка отменена.")
+    else:
+        update.message.reply_text("Рассылка отменена.")
+    return ConversationHandler.END
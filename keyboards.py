@@ -73,6 +73,14 @@ def get_actual_section_details_keyboard():
     return InlineKeyboardMarkup(keyboard)
 
 
+def get_partner_options_keyboard():
+    keyboard = [
+        [InlineKeyboardButton("Участвовать в нетворкинге",
+                              callback_data="join_pairing")]
+    ]
+    return InlineKeyboardMarkup(keyboard)
+
+
 def get_programs_section_details_second_keyboard():
     keyboard = [
         [InlineKeyboardButton(
@@ -101,7 +109,8 @@ def get_speaker_main_keyboard():
 def get_speaker_in_process_keyboard():
     keyboard_layout = [
         [KeyboardButton('ГЛЯНУТЬ ВОПРОСЫ'),
-         KeyboardButton('ЗАВЕРШИТЬ ВЫСТУПЛЕНИЕ')]
+         KeyboardButton('ЗАВЕРШИТЬ ВЫСТУПЛЕНИЕ')],
+        [KeyboardButton('ПОТОК ВОПРОСОВ')]
     ]
 
     return ReplyKeyboardMarkup(
@@ -128,6 +137,18 @@ def get_organizator_main_keyboard():
         one_time_keyboard=False
     )
 
+
+def get_broadcast_audience_keyboard(events):
+    keyboard = [
+        [InlineKeyboardButton("Всем гостям", callback_data="broadcast_to_clients")],
+        [InlineKeyboardButton("Спикерам", callback_data="broadcast_to_speakers")],
+    ]
+    for event in events:
+        keyboard.append([InlineKeyboardButton(
+            f"Участникам: {event.name}", callback_data=f"broadcast_to_event_{event.id}")])
+    keyboard.append([InlineKeyboardButton("Отмена", callback_data="cancel_broadcast")])
+    return InlineKeyboardMarkup(keyboard)
+
 # ======================================================================
 # ===============================ЮТИЛСЫ============================
 # ======================================================================
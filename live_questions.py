@@ -0,0 +1,115 @@
+from threading import Lock
+
+from django.db import close_old_connections
+
+from bot_logic.models import Client, Question
+from notifications import delivery_queue
+
+MESSAGE_LIMIT = 4096
+
+
+def render_live_question(question, client_name):
+    return (
+        f"❓ {question.text}\n"
+        f"   👤 {client_name or 'Аноним'}\n"
+        f"   ⏱ {question.created_at.strftime('%H:%M')}\n"
+        "────────────────────"
+    )
+
+
+class LiveQuestionFeed:
+    """Поток новых вопросов спикеру во время доклада.
+
+    Записанные буфером вопросы копятся по спикерам, а задача JobQueue раз в
+    интервал отправляет каждому подписанному спикеру одно сообщение со всеми
+    накопившимися вопросами. Заодно сдвигается курсор «ГЛЯНУТЬ ВОПРОСЫ»,
+    чтобы уже присланные вопросы не показывались повторно.
+
+    С poll_database вопросы берутся не у буфера своего процесса, а из базы:
+    при шардировании гость и спикер могут обслуживаться разными процессами."""
+
+    def __init__(self, poll_database=False):
+        self.poll_database = poll_database
+        self._lock = Lock()
+        self._subscribers = {}
+        self._pending = {}
+        self._last_id = None
+
+    def subscribe(self, speaker_id, chat_id, talk_id):
+        with self._lock:
+            self._subscribers[speaker_id] = (chat_id, talk_id)
+
+    def unsubscribe(self, speaker_id):
+        with self._lock:
+            self._subscribers.pop(speaker_id, None)
+            self._pending.pop(speaker_id, None)
+
+    def is_subscribed(self, speaker_id):
+        with self._lock:
+            return speaker_id in self._subscribers
+
+    def collect(self, questions):
+        """Слушатель question_buffer: запоминает вопросы подписанных спикеров."""
+        with self._lock:
+            for question in questions:
+                if question.speaker_id in self._subscribers:
+                    self._pending.setdefault(question.speaker_id, []).append(question)
+
+    def collect_from_database(self):
+        """Забирает из базы вопросы подписанных спикеров, записанные после прошлого вызова."""
+        with self._lock:
+            speaker_ids = list(self._subscribers)
+            last_id = self._last_id
+        if last_id is None or not speaker_ids:
+            # без подписчиков (и при старте процесса) просто запоминаем, докуда вопросы уже старые
+            self._last_id = Question.objects.order_by('-id').values_list('id', flat=True).first() or 0
+            return
+        questions = list(Question.objects.filter(speaker_id__in=speaker_ids, id__gt=last_id).order_by('id'))
+        if questions:
+            self._last_id = questions[-1].id
+            self.collect(questions)
+
+    def send_pending(self, bot, user_data=None):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            subscribers = dict(self._subscribers)
+        pending = {
+            speaker_id: questions for speaker_id, questions in pending.items()
+            if speaker_id in subscribers
+        }
+        if not pending:
+            return 0
+
+        client_ids = {question.client_id for questions in pending.values() for question in questions}
+        client_names = dict(Client.objects.filter(id__in=client_ids).values_list('id', 'name'))
+        sent = 0
+        for speaker_id, questions in pending.items():
+            chat_id, talk_id = subscribers[speaker_id]
+            if user_data is not None:
+                # то, что спикер уже увидел через «ГЛЯНУТЬ ВОПРОСЫ», не повторяем
+                cursor_talk_id, last_id = user_data[chat_id].get('questions_cursor', (None, 0))
+                if cursor_talk_id == talk_id:
+                    questions = [question for question in questions if question.id > last_id]
+            if not questions:
+                continue
+            lines = ["❓ Новые вопросы:\n"]
+            lines.extend(render_live_question(question, client_names.get(question.client_id))
+                         for question in questions)
+            delivery_queue.send_message(bot, chat_id=chat_id, text='\n'.join(lines)[:MESSAGE_LIMIT])
+            if user_data is not None:
+                user_data[chat_id]['questions_cursor'] = (talk_id, max(question.id for question in questions))
+            sent += 1
+        return sent
+
+    def job(self, context):
+        try:
+            if self.poll_database:
+                self.collect_from_database()
+            self.send_pending(context.bot, context.dispatcher.user_data)
+        except Exception as e:
+            print(f'Ошибка при отправке вопросов спикеру: {e}')
+        finally:
+            close_old_connections()
+
+
+live_questions = LiveQuestionFeed()
@@ -0,0 +1,193 @@
+from bisect import bisect_right, insort
+from datetime import datetime, time, timedelta
+from threading import RLock
+
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from bot_logic.models import Event, Session, Speaker, SpeakerSession
+from program_version import program_version
+
+
+class IntervalIndex:
+    """Отсортированные по началу интервалы с бинарным поиском.
+
+    Для каждой позиции хранится максимальное время окончания среди интервалов
+    слева, поэтому поиск «что идёт в момент t» останавливается, как только
+    левее уже ничего не может пересекать t."""
+
+    def __init__(self, start_field, finish_field):
+        self.start_field = start_field
+        self.finish_field = finish_field
+        self._keys = []
+        self._items = []
+        self._max_finish = []
+
+    def _key(self, item):
+        return getattr(item, self.start_field), item.pk
+
+    def rebuild(self, items):
+        items = [item for item in items if self._is_valid(item)]
+        items.sort(key=self._key)
+        self._items = items
+        self._keys = [self._key(item) for item in items]
+        self._update_max_finish()
+
+    def upsert(self, item):
+        self.remove(item.pk)
+        if not self._is_valid(item):
+            return
+        key = self._key(item)
+        position = bisect_right(self._keys, key)
+        insort(self._keys, key)
+        self._items.insert(position, item)
+        self._update_max_finish()
+
+    def remove(self, pk):
+        for position, item in enumerate(self._items):
+            if item.pk == pk:
+                del self._items[position]
+                del self._keys[position]
+                self._update_max_finish()
+                return
+
+    def get(self, pk):
+        return next((item for item in self._items if item.pk == pk), None)
+
+    def at(self, moment):
+        """Интервалы, которые идут в момент moment, в порядке начала."""
+        found = []
+        position = bisect_right(self._keys, (moment, float('inf'))) - 1
+        while position >= 0 and self._max_finish[position] >= moment:
+            item = self._items[position]
+            if getattr(item, self.finish_field) >= moment:
+                found.append(item)
+            position -= 1
+        found.reverse()
+        return found
+
+    def __iter__(self):
+        return iter(list(self._items))
+
+    def _is_valid(self, item):
+        return getattr(item, self.start_field) is not None and getattr(item, self.finish_field) is not None
+
+    def _update_max_finish(self):
+        self._max_finish = []
+        latest = None
+        for item in self._items:
+            finish = getattr(item, self.finish_field)
+            latest = finish if latest is None or finish > latest else latest
+            self._max_finish.append(latest)
+
+
+class LiveTimeline:
+    """Мероприятия и выступления текущего дня в памяти процесса.
+
+    Отвечает на вопросы «какое мероприятие/доклад идёт сейчас» без запросов
+    к базе. Индекс обновляется сигналами моделей, перестраивается при смене дня
+    и когда программу поменяли в другом процессе (админка, import_schedule)."""
+
+    def __init__(self):
+        self._lock = RLock()
+        self._day = None
+        self._events = IntervalIndex('start_event', 'finish_event')
+        self._talks = IntervalIndex('start_session', 'finish_session')
+
+    def _day_bounds(self, day):
+        day_start = timezone.make_aware(datetime.combine(day, time.min))
+        return day_start, day_start + timedelta(days=1)
+
+    def _talks_queryset(self):
+        return SpeakerSession.objects.select_related('session__event', 'speaker__user')
+
+    def reload(self):
+        with self._lock:
+            self._day = timezone.localdate()
+            day_start, day_end = self._day_bounds(self._day)
+            self._events.rebuild(list(Event.objects.filter(
+                start_event__lt=day_end, finish_event__gte=day_start)))
+            self._talks.rebuild(list(self._talks_queryset().filter(
+                start_session__lt=day_end, finish_session__gte=day_start)))
+
+    def invalidate(self):
+        with self._lock:
+            self._day = None
+
+    def _ensure_loaded(self):
+        if self._day != timezone.localdate():
+            self.reload()
+
+    def current_event(self, now=None):
+        with self._lock:
+            self._ensure_loaded()
+            events = self._events.at(now or timezone.now())
+        return events[0] if events else None
+
+    def current_talk(self, now=None, event_id=None, speaker_id=None, include_finished=False):
+        with self._lock:
+            self._ensure_loaded()
+            talks = self._talks.at(now or timezone.now())
+        for talk in talks:
+            if event_id is not None and talk.session.event_id != event_id:
+                continue
+            if speaker_id is not None and talk.speaker_id != speaker_id:
+                continue
+            if talk.is_finish and not include_finished:
+                continue
+            return talk
+        return None
+
+    def talk(self, pk):
+        """Выступление текущего дня по id или None."""
+        with self._lock:
+            self._ensure_loaded()
+            return self._talks.get(pk)
+
+    def has_unfinished_before(self, event_id, moment):
+        """Есть ли в мероприятии незавершённое выступление, закончившееся до moment."""
+        with self._lock:
+            self._ensure_loaded()
+            return any(
+                talk.session.event_id == event_id and talk.finish_session < moment and not talk.is_finish
+                for talk in self._talks
+            )
+
+    def talk_changed(self, pk, deleted=False):
+        with self._lock:
+            if self._day is None:
+                return
+            if deleted:
+                self._talks.remove(pk)
+                return
+            day_start, day_end = self._day_bounds(self._day)
+            talk = self._talks_queryset().filter(
+                pk=pk, start_session__lt=day_end, finish_session__gte=day_start).first()
+            if talk:
+                self._talks.upsert(talk)
+            else:
+                self._talks.remove(pk)
+
+
+live_timeline = LiveTimeline()
+program_version.add_listener(live_timeline.invalidate)
+
+
+@receiver(post_save, sender=SpeakerSession)
+def _speaker_session_saved(sender, instance, **kwargs):
+    live_timeline.talk_changed(instance.pk)
+
+
+@receiver(post_delete, sender=SpeakerSession)
+def _speaker_session_deleted(sender, instance, **kwargs):
+    live_timeline.talk_changed(instance.pk, deleted=True)
+
+
+@receiver([post_save, post_delete], sender=Event)
+@receiver([post_save, post_delete], sender=Session)
+@receiver([post_save, post_delete], sender=Speaker)
+def _program_changed(sender, instance, **kwargs):
+    # в выступлениях закэшированы связанные мероприятие, доклад и спикер,
+    # поэтому проще перечитать день целиком при следующем обращении
+    live_timeline.invalidate()
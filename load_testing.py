@@ -0,0 +1,324 @@
+import json
+import os
+import random
+import tempfile
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import timedelta
+from itertools import count
+from queue import Empty, Queue
+from threading import Event as ThreadEvent, Lock, Thread
+from time import perf_counter, sleep, time
+from uuid import uuid4
+
+from django.db import connection
+from django.utils import timezone
+from telegram import CallbackQuery, Chat, Message, MessageEntity, Update, User
+from telegram.ext import ConversationHandler, TypeHandler
+
+from bot_logic.models import Event, Session, Speaker, SpeakerSession, UserTg
+from metrics import InstrumentedRequest, add_handler_observer
+
+ATTENDEE_TG_ID_BASE = 10 ** 9
+STUB_BOT_TOKEN = '123456:LOAD-TEST'
+UPDATE_TIMEOUT = 10
+BIOGRAPHIES = [
+    'python django backend', 'react typescript frontend', 'go kubernetes devops',
+    'data science pandas numpy', 'java spring микросервисы', 'тестирование и автоматизация',
+]
+QUESTIONS = [
+    'Когда будет перерыв?', 'Где посмотреть слайды?', 'Какую базу данных вы используете?',
+    'Как вы тестируете асинхронный код?', 'Сколько стоит такое решение в продакшене?',
+]
+
+
+class StubRequest(InstrumentedRequest):
+    """Request без сети: на любой метод Bot API сразу отвечает правдоподобным результатом.
+
+    latency — искусственная задержка ответа в секундах, чтобы приблизить
+    поведение к настоящему Telegram."""
+
+    __slots__ = ('latency', 'calls', '_message_ids', '_lock')
+
+    def __init__(self, *args, latency=0, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.latency = latency
+        self.calls = defaultdict(int)
+        self._message_ids = count(1)
+        self._lock = Lock()
+
+    def _request_wrapper(self, method, url, *args, **kwargs):
+        api_method = url.rsplit('/', 1)[-1]
+        body = kwargs.get('body')
+        data = json.loads(body) if body else dict(kwargs.get('fields') or {})
+        with self._lock:
+            self.calls[api_method] += 1
+            message_id = next(self._message_ids)
+        if self.latency:
+            sleep(self.latency)
+        return json.dumps({'ok': True, 'result': self._result(api_method, data, message_id)}).encode()
+
+    def _result(self, api_method, data, message_id):
+        if api_method == 'getMe':
+            return {'id': 1, 'is_bot': True, 'first_name': 'Meetup', 'username': 'meetup_bot'}
+        if api_method.startswith(('answer', 'set', 'delete')):
+            return True
+        chat_id = int(data.get('chat_id') or 0)
+        return {
+            'message_id': message_id, 'date': int(time()), 'text': data.get('text', ''),
+            'chat': {'id': chat_id, 'type': 'private'},
+        }
+
+
+def disable_run_async(handlers):
+    """Выключает run_async у обработчиков диспетчера: всё выполняется прямо в
+    дорожках, без пула потоков. Так замеряют, что даёт пул."""
+    for handler in handlers:
+        handler.run_async = False
+        if isinstance(handler, ConversationHandler):
+            disable_run_async(handler.entry_points)
+            for state_handlers in handler.states.values():
+                disable_run_async(state_handlers)
+            disable_run_async(handler.fallbacks)
+
+
+@contextmanager
+def temporary_database(prefix='meetup_load_'):
+    """Временная база с применёнными миграциями на том же движке, что и бот
+    (DB_ENGINE), удаляется после прогона.
+
+    Гости и потоки пишут в базу одновременно, поэтому для SQLite нужна
+    файловая база с настройками бота (WAL, IMMEDIATE), а не in-memory. Для
+    PostgreSQL создаётся отдельная база на том же сервере, с тем же пулом
+    соединений."""
+    paths = []
+    if connection.vendor == 'sqlite':
+        test_db = tempfile.NamedTemporaryFile(prefix=prefix, suffix='.sqlite3', delete=False)
+        test_db.close()
+        name = test_db.name
+        paths = [name, f'{name}-wal', f'{name}-shm']
+    else:
+        name = f'{prefix}{os.getpid()}_{uuid4().hex[:8]}'
+    connection.settings_dict['TEST']['NAME'] = name
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        for path in paths:
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def seed_program():
+    """Текущее мероприятие с идущим докладом, чтобы работали «Актуалочка» и вопросы."""
+    now = timezone.now()
+    speaker_user, _ = UserTg.objects.get_or_create(tg_id=ATTENDEE_TG_ID_BASE - 1, defaults={'is_speaker': True})
+    speaker, _ = Speaker.objects.get_or_create(user=speaker_user, defaults={'name': 'Нагрузочный спикер'})
+    event = Event.objects.create(
+        name='Нагрузочный митап', start_event=now - timedelta(hours=1), finish_event=now + timedelta(hours=3))
+    SpeakerSession.objects.create(
+        session=Session.objects.create(title='Доклад под нагрузкой', event=event), speaker=speaker,
+        start_session=now - timedelta(minutes=30), finish_session=now + timedelta(hours=2))
+    return event
+
+
+class LoadTest:
+    """Синтетические гости, которые проходят типичные сценарии через настоящий диспетчер.
+
+    Каждый гость отправляет следующее обновление только после того, как бот
+    обработал предыдущее, как живой человек, ждущий ответа. Обновление, на
+    которое бот не ответил за timeout секунд (например, отброшенное
+    флуд-контролем), считается потерянным. Порядок гостей, их сценарии и
+    тексты определяются seed, поэтому прогоны воспроизводимы."""
+
+    def __init__(self, dispatcher, event, attendees=100, concurrency=20, seed=1, timeout=UPDATE_TIMEOUT,
+                 first_attendee=0):
+        self.dispatcher = dispatcher
+        self.bot = dispatcher.bot
+        self.event = event
+        self.attendees = attendees
+        # номер первого гостя: несколько прогонов в одной базе не пересекаются по гостям
+        self.first_attendee = first_attendee
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.random = random.Random(seed)
+        self._update_ids = count(1)
+        self._done = {}
+        self._lock = Lock()
+        self.handler_seconds = defaultdict(list)
+        self.handler_errors = defaultdict(int)
+        self.update_seconds = []
+        self.dropped = 0
+        add_handler_observer(self._observe)
+        # обработчики с run_async заканчивают работу позже, чем диспетчер
+        # разберёт обновление, поэтому их тоже ждём
+        self._dispatcher_run_async = dispatcher.run_async
+        dispatcher.run_async = self._run_async
+        dispatcher.add_handler(TypeHandler(Update, self._mark_dispatched), group=100)
+
+    def _observe(self, name, seconds, outcome):
+        with self._lock:
+            self.handler_seconds[name].append(seconds)
+            if outcome == 'error':
+                self.handler_errors[name] += 1
+
+    def _finish(self, update_id, dispatched=False):
+        with self._lock:
+            state = self._done.get(update_id)
+            if state is None:
+                return
+            if dispatched:
+                state['dispatched'] = True
+            else:
+                state['in_flight'] -= 1
+            if state['dispatched'] and not state['in_flight']:
+                state['event'].set()
+
+    def _mark_dispatched(self, update, context):
+        self._finish(update.update_id, dispatched=True)
+
+    def _run_async(self, func, *args, update=None, **kwargs):
+        update_id = getattr(update, 'update_id', None)
+        with self._lock:
+            state = self._done.get(update_id)
+            if state is not None:
+                state['in_flight'] += 1
+        if state is None:
+            return self._dispatcher_run_async(func, *args, update=update, **kwargs)
+
+        def tracked(*func_args, **func_kwargs):
+            try:
+                return func(*func_args, **func_kwargs)
+            finally:
+                self._finish(update_id)
+
+        return self._dispatcher_run_async(tracked, *args, update=update, **kwargs)
+
+    def _user(self, tg_id):
+        return User(id=tg_id, first_name=f'Гость {tg_id - ATTENDEE_TG_ID_BASE}', is_bot=False,
+                    username=f'guest{tg_id}')
+
+    def _message(self, tg_id, text):
+        entities = [MessageEntity(MessageEntity.BOT_COMMAND, 0, len(text.split()[0]))] \
+            if text.startswith('/') else []
+        return Message(
+            message_id=next(self._update_ids), date=timezone.now(), chat=Chat(tg_id, Chat.PRIVATE),
+            from_user=self._user(tg_id), text=text, entities=entities, bot=self.bot)
+
+    def message_update(self, tg_id, text):
+        return Update(next(self._update_ids), message=self._message(tg_id, text))
+
+    def callback_update(self, tg_id, data):
+        query = CallbackQuery(
+            id=str(next(self._update_ids)), from_user=self._user(tg_id), chat_instance=str(tg_id),
+            data=data, message=self._message(tg_id, 'Сообщение бота'), bot=self.bot)
+        return Update(next(self._update_ids), callback_query=query)
+
+    def send(self, update):
+        done = ThreadEvent()
+        with self._lock:
+            self._done[update.update_id] = {'event': done, 'dispatched': False, 'in_flight': 0}
+        started = perf_counter()
+        self.dispatcher.update_queue.put(update)
+        handled = done.wait(self.timeout)
+        with self._lock:
+            del self._done[update.update_id]
+            if handled:
+                self.update_seconds.append(perf_counter() - started)
+            else:
+                self.dropped += 1
+
+    def plan(self, number):
+        """Сценарии одного гостя: список обновлений, которые он отправит по очереди."""
+        tg_id = ATTENDEE_TG_ID_BASE + number
+        steps = [
+            ('message', '/start'),
+            ('callback', 'role_guest'),
+            ('message', 'Актуалочка'),
+            ('callback', 'ask_question'),
+            ('message', self.random.choice(QUESTIONS)),
+            ('message', 'Программы'),
+        ]
+        if self.random.random() < 0.5:
+            steps += [
+                ('callback', 'register_for_event'),
+                ('callback', f'register_event_{self.event.id}'),
+                ('message', f'Гость {number}'),
+                ('message', f'+7999{number:07d}'),
+                ('callback', self.random.choice(['stack_backend', 'stack_frontend', 'stack_full_stack'])),
+            ]
+        if self.random.random() < 0.5:
+            steps += [
+                ('callback', 'find_partner'),
+                ('message', self.random.choice(BIOGRAPHIES)),
+            ]
+        return tg_id, steps
+
+    def _attendee_worker(self, plans):
+        try:
+            while True:
+                try:
+                    tg_id, steps = plans.get_nowait()
+                except Empty:
+                    return
+                for kind, payload in steps:
+                    if kind == 'message':
+                        self.send(self.message_update(tg_id, payload))
+                    else:
+                        self.send(self.callback_update(tg_id, payload))
+        finally:
+            connection.close()
+
+    def plans(self):
+        numbers = range(self.first_attendee, self.first_attendee + self.attendees)
+        return [self.plan(number) for number in self.random.sample(numbers, self.attendees)]
+
+    def run(self):
+        plans = Queue()
+        for plan in self.plans():
+            plans.put(plan)
+
+        dispatcher_thread = Thread(target=self.dispatcher.start, name='dispatcher', daemon=True)
+        dispatcher_thread.start()
+        while not self.dispatcher.running:
+            sleep(0.01)
+
+        started = perf_counter()
+        attendees = [Thread(target=self._attendee_worker, args=(plans,), daemon=True)
+                     for _ in range(self.concurrency)]
+        for attendee in attendees:
+            attendee.start()
+        for attendee in attendees:
+            attendee.join()
+        self.dispatcher.stop()
+        dispatcher_thread.join()
+        self.seconds = perf_counter() - started
+        return self.report()
+
+    def report(self):
+        handlers = {}
+        for name, samples in sorted(self.handler_seconds.items()):
+            handlers[name] = {
+                'calls': len(samples),
+                'errors': self.handler_errors[name],
+                'p50': percentile(samples, 0.5),
+                'p95': percentile(samples, 0.95),
+                'p99': percentile(samples, 0.99),
+            }
+        updates = len(self.update_seconds)
+        return {
+            'updates': updates,
+            'dropped': self.dropped,
+            'seconds': self.seconds,
+            'throughput': updates / self.seconds if self.seconds else 0,
+            'p50': percentile(self.update_seconds, 0.5) if updates else 0,
+            'p95': percentile(self.update_seconds, 0.95) if updates else 0,
+            'p99': percentile(self.update_seconds, 0.99) if updates else 0,
+            'handlers': handlers,
+        }
@@ -1,6 +1,9 @@
-from environs import Env, EnvError
+import os
 from pathlib import Path
 
+from django.core.exceptions import ImproperlyConfigured
+from environs import Env, EnvError
+
 BASE_DIR = Path(__file__).resolve().parent.parent
 
 env = Env()
@@ -64,12 +67,57 @@ WSGI_APPLICATION = 'meetup_bot_config.wsgi.application'
 
 # Database
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+DB_ENGINE = env.str('DB_ENGINE', 'sqlite')
+# потоки APScheduler у JobQueue (по умолчанию 10) и фоновые потоки бота
+JOB_QUEUE_THREADS = 10
+BACKGROUND_THREADS = 4
+
+if DB_ENGINE == 'postgres':
+    # по соединению на каждый поток бота, который ходит в базу: воркеры run_async,
+    # дорожки, потоки JobQueue и фоновые потоки (рассылки, буфер вопросов,
+    # persistence, главный поток). Поток отдаёт соединение в пул после каждого
+    # обновления и каждой задачи, так что больше соединений не понадобится
+    DB_POOL_SIZE = env.int(
+        'DB_POOL_SIZE',
+        env.int('BOT_WORKERS', 16) + env.int('BOT_LANES', os.cpu_count() or 4)
+        + JOB_QUEUE_THREADS + BACKGROUND_THREADS)
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': env.str('DB_NAME', 'meetup'),
+            'USER': env.str('DB_USER', 'meetup'),
+            'PASSWORD': env.str('DB_PASSWORD', ''),
+            'HOST': env.str('DB_HOST', 'localhost'),
+            'PORT': env.int('DB_PORT', 5432),
+        }
+    }
+    if DB_POOL_SIZE:
+        # пул psycopg несовместим с CONN_MAX_AGE: соединения держит сам пул
+        DATABASES['default']['OPTIONS'] = {
+            'pool': {'min_size': 2, 'max_size': DB_POOL_SIZE, 'timeout': env.float('DB_POOL_TIMEOUT', 10)},
+        }
+    else:
+        DATABASES['default']['CONN_MAX_AGE'] = env.int('DB_CONN_MAX_AGE', 600)
+        DATABASES['default']['CONN_HEALTH_CHECKS'] = True
+elif DB_ENGINE == 'sqlite':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': env.str('DB_NAME', str(BASE_DIR / 'db.sqlite3')),
+            'OPTIONS': {
+                # WAL: чтение не ждёт записи; IMMEDIATE: пишущая транзакция сразу берёт
+                # блокировку и ждёт её timeout секунд, а не падает с «database is locked»
+                'init_command': (
+                    'PRAGMA journal_mode=WAL;'
+                    f"PRAGMA synchronous={env.str('DB_SQLITE_SYNCHRONOUS', 'NORMAL')};"
+                ),
+                'transaction_mode': 'IMMEDIATE',
+                'timeout': env.float('DB_SQLITE_TIMEOUT', 20),
+            },
+        }
     }
-}
+else:
+    raise ImproperlyConfigured(f'Неизвестный DB_ENGINE: {DB_ENGINE}. Используйте sqlite или postgres')
 
 
 # Password validation
@@ -107,6 +155,11 @@ STATIC_ROOT = BASE_DIR / 'staticfiles'
 STATIC_URL = 'static/'
 
 
+# Метрики бота: процесс бота периодически пишет их в файл, а /metrics/ отдаёт
+
+BOT_METRICS_FILE = env.str('BOT_METRICS_FILE', str(BASE_DIR / 'metrics.prom'))
+
+
 # Default primary key field type
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
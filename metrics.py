@@ -0,0 +1,242 @@
+import glob
+import os
+from bisect import bisect_left
+from functools import wraps
+from threading import Lock, local
+from time import perf_counter
+
+from django.db import connection
+from telegram.ext import ConversationHandler, DispatcherHandlerStop
+from telegram.utils.request import Request
+
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34)
+
+_current = local()
+
+
+class Histogram:
+    def __init__(self, name, help_text, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self._lock = Lock()
+        self._series = {}
+
+    def observe(self, label, value):
+        with self._lock:
+            counts, total = self._series.get(label, ([0] * (len(self.buckets) + 1), 0))
+            counts[bisect_left(self.buckets, value)] += 1
+            self._series[label] = (counts, total + value)
+
+    def render(self, label_name):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = {label: (list(counts), total) for label, (counts, total) in self._series.items()}
+        for label, (counts, total) in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{label_name}="{label}",le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_sum{{{label_name}="{label}"}} {total}')
+            lines.append(f'{self.name}_count{{{label_name}="{label}"}} {cumulative}')
+        return lines
+
+
+class Counter:
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help_text = help_text
+        self._lock = Lock()
+        self._values = {}
+
+    def inc(self, labels, value=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + value
+
+    def render(self, label_names):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} counter']
+        with self._lock:
+            values = dict(self._values)
+        for labels, value in sorted(values.items()):
+            rendered = ','.join(f'{name}="{label}"' for name, label in zip(label_names, labels))
+            lines.append(f'{self.name}{{{rendered}}} {value}')
+        return lines
+
+
+handler_seconds = Histogram(
+    'meetup_bot_handler_seconds', 'Время работы обработчика', SECONDS_BUCKETS)
+handler_db_queries = Histogram(
+    'meetup_bot_handler_db_queries', 'Запросов к базе за вызов обработчика', COUNT_BUCKETS)
+handler_db_seconds = Histogram(
+    'meetup_bot_handler_db_seconds', 'Время запросов к базе за вызов обработчика', SECONDS_BUCKETS)
+handler_api_calls = Histogram(
+    'meetup_bot_handler_api_calls', 'Запросов к Telegram API за вызов обработчика', COUNT_BUCKETS)
+handler_api_seconds = Histogram(
+    'meetup_bot_handler_api_seconds', 'Время запросов к Telegram API за вызов обработчика', SECONDS_BUCKETS)
+handler_calls = Counter('meetup_bot_handler_calls_total', 'Вызовы обработчиков по исходу')
+flood_dropped = Counter('meetup_bot_flood_dropped_total', 'Отброшенные флуд-контролем обновления')
+
+_gauges = {}
+_handler_observers = []
+
+
+def register_gauge(name, help_text, collect):
+    """collect() возвращает список пар (подписи метки, значение)."""
+    _gauges[name] = (help_text, collect)
+
+
+def add_handler_observer(observer):
+    """observer(имя обработчика, секунды, исход) вызывается после каждого вызова."""
+    _handler_observers.append(observer)
+
+
+class InstrumentedRequest(Request):
+    """Request, который считает запросы к Telegram API внутри обработчика."""
+
+    def post(self, *args, **kwargs):
+        start = perf_counter()
+        try:
+            return super().post(*args, **kwargs)
+        finally:
+            _record_api_call(perf_counter() - start)
+
+    def retrieve(self, *args, **kwargs):
+        start = perf_counter()
+        try:
+            return super().retrieve(*args, **kwargs)
+        finally:
+            _record_api_call(perf_counter() - start)
+
+
+def _record_api_call(duration):
+    stats = getattr(_current, 'stats', None)
+    if stats is not None:
+        stats['api_calls'] += 1
+        stats['api_seconds'] += duration
+
+
+def _record_query(execute, sql, params, many, context):
+    start = perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats = getattr(_current, 'stats', None)
+        if stats is not None:
+            stats['db_queries'] += 1
+            stats['db_seconds'] += perf_counter() - start
+
+
+def instrument(callback, name=None):
+    name = name or getattr(callback, '__name__', 'unknown')
+
+    @wraps(callback)
+    def wrapper(update, context):
+        outer_stats = getattr(_current, 'stats', None)
+        stats = _current.stats = {'db_queries': 0, 'db_seconds': 0.0, 'api_calls': 0, 'api_seconds': 0.0}
+        outcome = 'ok'
+        start = perf_counter()
+        try:
+            with connection.execute_wrapper(_record_query):
+                return callback(update, context)
+        except DispatcherHandlerStop:
+            # так флуд-контроль останавливает разбор обновления, это не сбой обработчика
+            outcome = 'dropped'
+            raise
+        except Exception:
+            outcome = 'error'
+            raise
+        finally:
+            _current.stats = outer_stats
+            elapsed = perf_counter() - start
+            handler_seconds.observe(name, elapsed)
+            handler_db_queries.observe(name, stats['db_queries'])
+            handler_db_seconds.observe(name, stats['db_seconds'])
+            handler_api_calls.observe(name, stats['api_calls'])
+            handler_api_seconds.observe(name, stats['api_seconds'])
+            handler_calls.inc((name, outcome))
+            for observer in _handler_observers:
+                observer(name, elapsed, outcome)
+
+    return wrapper
+
+
+def _instrument_handlers(handlers):
+    for handler in handlers:
+        if isinstance(handler, ConversationHandler):
+            _instrument_handlers(handler.entry_points)
+            for state_handlers in handler.states.values():
+                _instrument_handlers(state_handlers)
+            _instrument_handlers(handler.fallbacks)
+        elif not getattr(handler.callback, '__wrapped__', None):
+            handler.callback = instrument(handler.callback)
+
+
+def instrument_dispatcher(dispatcher):
+    """Оборачивает все зарегистрированные обработчики, включая шаги диалогов."""
+    for handlers in dispatcher.handlers.values():
+        _instrument_handlers(handlers)
+
+
+def render_metrics():
+    lines = []
+    for histogram in (handler_seconds, handler_db_queries, handler_db_seconds,
+                      handler_api_calls, handler_api_seconds):
+        lines.extend(histogram.render('handler'))
+    lines.extend(handler_calls.render(('handler', 'outcome')))
+    lines.extend(flood_dropped.render(('kind',)))
+    for name, (help_text, collect) in _gauges.items():
+        lines.extend([f'# HELP {name} {help_text}', f'# TYPE {name} gauge'])
+        for labels, value in collect():
+            rendered = ','.join(f'{key}="{label}"' for key, label in labels.items())
+            lines.append(f'{name}{{{rendered}}} {value}')
+    return '\n'.join(lines) + '\n'
+
+
+def dump_metrics(path):
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as file:
+        file.write(render_metrics())
+    os.replace(tmp_path, path)
+
+
+def metrics_files(path):
+    """Файл метрик бота и файлы процессов-обработчиков path.<номер> при BOT_SHARDS > 1."""
+    shard_files = [name for name in glob.glob(f'{glob.escape(path)}.*') if name[len(path) + 1:].isdigit()]
+    shard_files.sort(key=lambda name: int(name[len(path) + 1:]))
+    return ([path] if os.path.exists(path) else []) + shard_files
+
+
+def remove_metrics_files(path):
+    """Удаляет метрики прошлого запуска, чтобы после смены BOT_SHARDS не складывать старые файлы."""
+    for name in metrics_files(path):
+        try:
+            os.remove(name)
+        except FileNotFoundError:
+            pass
+
+
+def merge_metrics(texts):
+    """Складывает одинаковые ряды из метрик нескольких процессов: гистограммы,
+    счётчики и размеры очередей при сложении остаются осмысленными."""
+    families = {}
+    for text in texts:
+        family = None
+        for line in text.splitlines():
+            if not line:
+                continue
+            if line.startswith('#'):
+                family = line.split()[2]
+                comments = families.setdefault(family, ([], {}))[0]
+                if line not in comments:
+                    comments.append(line)
+                continue
+            series, value = line.rsplit(' ', 1)
+            samples = families.setdefault(family, ([], {}))[1]
+            samples[series] = samples.get(series, 0) + float(value)
+    lines = []
+    for comments, samples in families.values():
+        lines.extend(comments)
+        for series, value in samples.items():
+            lines.append(f'{series} {int(value) if value.is_integer() else value}')
+    return '\n'.join(lines) + '\n'
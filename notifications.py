@@ -0,0 +1,70 @@
+from concurrent.futures import ThreadPoolExecutor, wait
+from threading import Lock
+from time import sleep
+
+from environs import Env
+from telegram.error import RetryAfter, TelegramError
+
+from rate_limits import TokenBucket
+
+env = Env()
+env.read_env()
+
+MAX_ATTEMPTS = 5
+
+
+class DeliveryQueue:
+    """Фоновая отправка уведомлений с ограниченным числом параллельных запросов.
+
+    Обработчик ставит сообщения в очередь и сразу отвечает пользователю,
+    не дожидаясь, пока Telegram примет каждое уведомление. Все отправки
+    процесса проходят через общий bucket, так что даже раунд нетворкинга на
+    тысячи сообщений не превышает лимит Telegram."""
+
+    def __init__(self, max_workers=8, rate=25):
+        self.rate = rate
+        self.bucket = TokenBucket(rate)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='delivery')
+        self._pending = set()
+        self._lock = Lock()
+
+    def share_rate(self, processes):
+        """Оставляет процессу его долю общего лимита, если отправляют несколько процессов."""
+        self.bucket = TokenBucket(self.rate / processes)
+
+    def send_message(self, bot, **kwargs):
+        future = self._executor.submit(self._send, bot, kwargs)
+        with self._lock:
+            self._pending.add(future)
+        future.add_done_callback(self._forget)
+        return future
+
+    def _forget(self, future):
+        with self._lock:
+            self._pending.discard(future)
+
+    def _send(self, bot, kwargs):
+        for attempt in range(1, MAX_ATTEMPTS + 1):
+            self.bucket.consume()
+            try:
+                return bot.send_message(**kwargs)
+            except RetryAfter as e:
+                if attempt == MAX_ATTEMPTS:
+                    error = e
+                    break
+                sleep(e.retry_after)
+            except TelegramError as e:
+                error = e
+                break
+        print(f'Не удалось отправить уведомление в чат {kwargs.get("chat_id")}: {error}')
+
+    def wait(self, timeout=None):
+        with self._lock:
+            pending = list(self._pending)
+        wait(pending, timeout=timeout)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
+
+delivery_queue = DeliveryQueue(env.int('DELIVERY_WORKERS', 8), env.float('DELIVERY_RATE', 25))
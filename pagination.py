@@ -0,0 +1,216 @@
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.db.models import F, Q
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+from screen_cache import screen_cache
+
+PAGE_CALLBACK_PREFIX = 'pg'
+MESSAGE_LIMIT = 4096
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+DIGITS = '0123456789abcdefghijklmnopqrstuvwxyz'
+
+paged_lists = {}
+
+
+def to_base36(number):
+    digits = []
+    while True:
+        number, remainder = divmod(number, 36)
+        digits.append(DIGITS[remainder])
+        if not number:
+            return ''.join(reversed(digits))
+
+
+def encode_key(value, pk, part=None):
+    """Курсор в callback_data: значение поля сортировки, pk и, для записи,
+    которая не влезает в одно сообщение, номер её части — всё в base36."""
+    if value is None:
+        encoded_value = '-'
+    else:
+        encoded_value = to_base36((value - EPOCH) // timedelta(microseconds=1))
+    token = f'{encoded_value}.{to_base36(pk)}'
+    return token if part is None else f'{token}.{to_base36(part)}'
+
+
+def decode_key(token):
+    encoded_value, encoded_pk, *encoded_part = token.split('.')
+    if len(encoded_part) > 1:
+        raise ValueError(f'Неверный курсор: {token}')
+    value = None if encoded_value == '-' else EPOCH + timedelta(microseconds=int(encoded_value, 36))
+    key = (value, int(encoded_pk, 36))
+    return key + (int(encoded_part[0], 36),) if encoded_part else key
+
+
+class KeysetList:
+    """Постраничный список с кнопками «◀ / ▶» и keyset-запросами.
+
+    Страница всегда выбирается одним запросом `WHERE (поле, pk) > курсор LIMIT n`,
+    а курсор целиком лежит в callback_data кнопки, на сервере ничего не хранится.
+    Поле сортировки может быть пустым (NULL) — такие записи идут первыми.
+
+    На страницу попадают только записи, которые целиком влезают в сообщение,
+    остальные уходят на соседнюю страницу. Запись длиннее сообщения
+    показывается одна, по частям (направление 'c' с номером части в курсоре)."""
+
+    def __init__(self, name, get_queryset, render_item, header, empty_text,
+                 order_field=None, page_size=10, extra_keyboard=None,
+                 unavailable_text=None, cacheable=False):
+        self.name = name
+        self.get_queryset = get_queryset
+        self.render_item = render_item
+        self.header = header
+        self.empty_text = empty_text
+        self.order_field = order_field
+        self.page_size = page_size
+        self.extra_keyboard = extra_keyboard
+        self.unavailable_text = unavailable_text or empty_text
+        self.cacheable = cacheable
+        paged_lists[name] = self
+
+    def _after(self, value, pk):
+        if not self.order_field:
+            return Q(pk__gt=pk)
+        field = self.order_field
+        if value is None:
+            return Q(**{f'{field}__isnull': True, 'pk__gt': pk}) | Q(**{f'{field}__isnull': False})
+        return Q(**{f'{field}__gt': value}) | Q(**{field: value, 'pk__gt': pk})
+
+    def _before(self, value, pk):
+        if not self.order_field:
+            return Q(pk__lt=pk)
+        field = self.order_field
+        if value is None:
+            return Q(**{f'{field}__isnull': True, 'pk__lt': pk})
+        return Q(**{f'{field}__isnull': True}) | Q(**{f'{field}__lt': value}) \
+            | Q(**{field: value, 'pk__lt': pk})
+
+    def _ordering(self, backwards):
+        if not self.order_field:
+            return ['-pk' if backwards else 'pk']
+        if backwards:
+            return [F(self.order_field).desc(nulls_last=True), '-pk']
+        return [F(self.order_field).asc(nulls_first=True), 'pk']
+
+    def fetch(self, queryset, direction=None, key=None):
+        backwards = direction == 'p'
+        if key:
+            value, pk = key[:2]
+            queryset = queryset.filter(self._before(value, pk) if backwards else self._after(value, pk))
+        rows = list(queryset.order_by(*self._ordering(backwards))[:self.page_size + 1])
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if backwards:
+            rows.reverse()
+            return rows, has_more, True
+        return rows, direction == 'n', has_more
+
+    def callback_data(self, direction, row, part=None):
+        value = getattr(row, self.order_field) if self.order_field else None
+        return f'{PAGE_CALLBACK_PREFIX}:{self.name}:{direction}:{encode_key(value, row.pk, part)}'
+
+    def keyboard(self, navigation):
+        rows = [navigation] if navigation else []
+        if self.extra_keyboard:
+            rows.extend(self.extra_keyboard())
+        return InlineKeyboardMarkup(rows) if rows else None
+
+    def split(self, text):
+        """Делит текст записи на части по строкам так, чтобы каждая с заголовком
+        влезала в сообщение; слишком длинная строка режется на куски."""
+        budget = MESSAGE_LIMIT - len(self.header) - 1
+        parts, current = [], None
+        for line in text.split('\n'):
+            while len(line) > budget:
+                if current is not None:
+                    parts.append(current)
+                    current = None
+                parts.append(line[:budget])
+                line = line[budget:]
+            if current is None:
+                current = line
+            elif len(current) + 1 + len(line) > budget:
+                parts.append(current)
+                current = line
+            else:
+                current = f'{current}\n{line}'
+        if current is not None:
+            parts.append(current)
+        return parts
+
+    def render_part(self, queryset, row, parts, part, has_prev=None, has_next=None):
+        """Одна часть записи, которая не влезает в сообщение целиком."""
+        value = getattr(row, self.order_field) if self.order_field else None
+        if part == 0 and has_prev is None:
+            has_prev = queryset.filter(self._before(value, row.pk)).exists()
+        if part == len(parts) - 1 and has_next is None:
+            has_next = queryset.filter(self._after(value, row.pk)).exists()
+        navigation = []
+        if part > 0:
+            navigation.append(InlineKeyboardButton('◀', callback_data=self.callback_data('c', row, part - 1)))
+        elif has_prev:
+            navigation.append(InlineKeyboardButton('◀', callback_data=self.callback_data('p', row)))
+        if part < len(parts) - 1:
+            navigation.append(InlineKeyboardButton('▶', callback_data=self.callback_data('c', row, part + 1)))
+        elif has_next:
+            navigation.append(InlineKeyboardButton('▶', callback_data=self.callback_data('n', row)))
+        return '\n'.join([self.header, parts[part]]), self.keyboard(navigation)
+
+    def render(self, queryset, direction=None, key=None):
+        if queryset is None:
+            return self.unavailable_text, None
+        if direction == 'c':
+            row = queryset.filter(pk=key[1]).first() if key and len(key) == 3 else None
+            if row is None:
+                return self.empty_text, self.keyboard([])
+            parts = self.split(self.render_item(row))
+            return self.render_part(queryset, row, parts, min(key[2], len(parts) - 1))
+
+        rows, has_prev, has_next = self.fetch(queryset, direction, key)
+        if not rows:
+            return self.empty_text, self.keyboard([])
+
+        # набираем записи от курсора, пока они целиком влезают в сообщение
+        backwards = direction == 'p'
+        items = [self.render_item(row) for row in rows]
+        positions = range(len(rows) - 1, -1, -1) if backwards else range(len(rows))
+        kept, length = [], len(self.header)
+        for position in positions:
+            length += 1 + len(items[position])
+            if length > MESSAGE_LIMIT:
+                break
+            kept.append(position)
+        if not kept:
+            position = positions[0]
+            parts = self.split(items[position])
+            part = len(parts) - 1 if backwards else 0
+            return self.render_part(
+                queryset, rows[position], parts, part,
+                has_prev=has_prev or position > 0, has_next=has_next or position < len(rows) - 1)
+        kept.sort()
+        has_prev = has_prev or kept[0] > 0
+        has_next = has_next or kept[-1] < len(rows) - 1
+        rows = [rows[position] for position in kept]
+
+        text = '\n'.join([self.header] + [items[position] for position in kept])
+        navigation = []
+        if has_prev:
+            navigation.append(InlineKeyboardButton('◀', callback_data=self.callback_data('p', rows[0])))
+        if has_next:
+            navigation.append(InlineKeyboardButton('▶', callback_data=self.callback_data('n', rows[-1])))
+        return text, self.keyboard(navigation)
+
+    def page(self, update, direction=None, key=None):
+        """Текст и клавиатура страницы. Первая страница общих для всех списков
+        берётся из screen_cache; остальные не кэшируем: курсор приходит от
+        клиента, и поддельные курсоры раздували бы кэш."""
+        if self.cacheable and direction is None and key is None:
+            return screen_cache.get(
+                self.name, lambda: self.render(self.get_queryset(update)))
+        return self.render(self.get_queryset(update), direction, key)
+
+
+def parse_page_callback(data):
+    """Разбирает callback_data кнопки листания: (список, направление, курсор)."""
+    _, name, direction, token = data.split(':')
+    return paged_lists[name], direction, decode_key(token)
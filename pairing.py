@@ -0,0 +1,144 @@
+import numpy as np
+from django.db import close_old_connections, transaction
+from environs import Env
+
+from bot_logic.models import PairingMatch, PairingRequest
+from notifications import delivery_queue
+from partner_matching import partner_index
+
+env = Env()
+env.read_env()
+
+SCORE_CHUNK_SIZE = 1024
+BATCH_SIZE = 500
+
+
+def pair_key(first_id, second_id):
+    return (first_id, second_id) if first_id < second_id else (second_id, first_id)
+
+
+def greedy_pairs(client_ids, vectors, excluded=frozenset(), candidates=20):
+    """Жадное паросочетание максимального веса по косинусной похожести.
+
+    Для каждого участника берутся только `candidates` самых похожих, рёбра
+    сортируются по убыванию веса и занимаются по очереди. Тех, кому не хватило
+    пары среди кандидатов, добирают между собой в порядке очереди.
+    Пары из `excluded` не назначаются никогда."""
+    count = len(client_ids)
+    if count < 2:
+        return [], list(client_ids)
+
+    candidates = min(candidates, count - 1)
+    edge_rows, edge_cols, edge_scores = [], [], []
+    for start in range(0, count, SCORE_CHUNK_SIZE):
+        stop = min(start + SCORE_CHUNK_SIZE, count)
+        scores = vectors[start:stop] @ vectors.T
+        scores[np.arange(stop - start), np.arange(start, stop)] = -np.inf
+        best = np.argpartition(-scores, candidates - 1, axis=1)[:, :candidates]
+        edge_rows.append(np.repeat(np.arange(start, stop), candidates))
+        edge_cols.append(best.ravel())
+        edge_scores.append(np.take_along_axis(scores, best, axis=1).ravel())
+
+    rows = np.concatenate(edge_rows)
+    cols = np.concatenate(edge_cols)
+    order = np.argsort(-np.concatenate(edge_scores), kind='stable')
+
+    matched = [False] * count
+    pairs = []
+    for row, col in zip(rows[order].tolist(), cols[order].tolist()):
+        if matched[row] or matched[col]:
+            continue
+        if pair_key(client_ids[row], client_ids[col]) in excluded:
+            continue
+        matched[row] = matched[col] = True
+        pairs.append((client_ids[row], client_ids[col]))
+
+    leftovers = [position for position in range(count) if not matched[position]]
+    unmatched = []
+    while leftovers:
+        row = leftovers.pop(0)
+        for index, col in enumerate(leftovers):
+            if pair_key(client_ids[row], client_ids[col]) not in excluded:
+                pairs.append((client_ids[row], client_ids[leftovers.pop(index)]))
+                break
+        else:
+            unmatched.append(client_ids[row])
+    return pairs, unmatched
+
+
+def render_pair_message(partner):
+    contact = f'@{partner.user.nic_tg}' if partner.user.nic_tg else str(partner.contact_phone or '')
+    return (
+        "Ваш собеседник на нетворкинге:\n"
+        f"👤 {partner.name or 'Без имени'}\n"
+        f"   Стек: {partner.get_favorite_stack_display() or 'Не указан'}\n"
+        f"   О себе: {(partner.biography or 'Не указано')[:300]}\n"
+        f"   Телеграм: {contact}"
+    )
+
+
+class PairingScheduler:
+    """Раунды нетворкинга: копит заявки и раз в интервал разбивает всех на пары.
+
+    Заявки и состоявшиеся пары хранятся в базе, поэтому их видят все процессы
+    бота, а раунды проводит один главный процесс. Уже встречавшиеся пары в
+    следующих раундах не повторяются, а оставшиеся без пары переходят в
+    следующий раунд."""
+
+    def __init__(self, candidates=20):
+        self.candidates = candidates
+
+    def opt_in(self, client_id, chat_id):
+        PairingRequest.objects.bulk_create(
+            [PairingRequest(client_id=client_id, chat_id=chat_id)],
+            update_conflicts=True, unique_fields=['client'], update_fields=['chat_id'])
+
+    def opt_out(self, client_id):
+        PairingRequest.objects.filter(client_id=client_id).delete()
+
+    def is_waiting(self, client_id):
+        return PairingRequest.objects.filter(client_id=client_id).exists()
+
+    def run_round(self, bot):
+        requests = list(PairingRequest.objects.select_related('client__user').order_by('created_at', 'id'))
+        clients = {request.client_id: request.client for request in requests}
+        waiting = {request.client_id: request.chat_id for request in requests}
+        met = frozenset(PairingMatch.objects.filter(
+            first__pairing_request__isnull=False, second__pairing_request__isnull=False,
+        ).values_list('first_id', 'second_id'))
+
+        # векторы считаются заново по анкетам из базы: индекс этого процесса
+        # может не знать об анкетах, сохранённых в других процессах
+        client_ids = list(waiting)
+        vectors = np.zeros((len(client_ids), partner_index.dim), dtype=np.float32)
+        for position, client_id in enumerate(client_ids):
+            client = clients[client_id]
+            vectors[position] = partner_index.vectorize(client.biography, client.favorite_stack)
+        pairs, unmatched = greedy_pairs(client_ids, vectors, met, self.candidates)
+
+        unmatched = set(unmatched)
+        request_ids = [request.pk for request in requests if request.client_id not in unmatched]
+        with transaction.atomic():
+            PairingMatch.objects.bulk_create(
+                [PairingMatch(first_id=first_id, second_id=second_id)
+                 for first_id, second_id in (pair_key(*pair) for pair in pairs)],
+                batch_size=BATCH_SIZE, ignore_conflicts=True)
+            for start in range(0, len(request_ids), BATCH_SIZE):
+                PairingRequest.objects.filter(pk__in=request_ids[start:start + BATCH_SIZE]).delete()
+
+        for first_id, second_id in pairs:
+            for client_id, partner_id in ((first_id, second_id), (second_id, first_id)):
+                delivery_queue.send_message(
+                    bot, chat_id=waiting[client_id], text=render_pair_message(clients[partner_id]))
+        return pairs
+
+    def job(self, context):
+        try:
+            self.run_round(context.bot)
+        except Exception as e:
+            print(f'Ошибка при подборе пар: {e}')
+        finally:
+            close_old_connections()
+
+
+pairing_scheduler = PairingScheduler(env.int('PAIRING_CANDIDATES', 20))
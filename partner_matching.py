@@ -0,0 +1,170 @@
+import re
+import zlib
+from threading import Lock
+
+import numpy as np
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from environs import Env
+
+from bot_logic.models import Client
+from shard_events import shard_events
+
+env = Env()
+env.read_env()
+
+WORD_RE = re.compile(r'\w+')
+STACK_WEIGHT = 3
+
+
+def tokenize(biography, favorite_stack):
+    tokens = WORD_RE.findall((biography or '').lower())
+    if favorite_stack:
+        tokens.extend([f'stack:{favorite_stack}'] * STACK_WEIGHT)
+    return tokens
+
+
+class PartnerIndex:
+    """Матрица хэшированных «мешков слов» по биографиям и стэкам клиентов.
+
+    Каждая строка — нормированный вектор клиента, поэтому похожесть со всеми
+    участниками считается одним умножением матрицы на вектор. Строки
+    обновляются по одной при сохранении клиента."""
+
+    def __init__(self, dim=512):
+        self.dim = dim
+        self._lock = Lock()
+        self._matrix = np.zeros((0, dim), dtype=np.float32)
+        self._client_ids = np.zeros(0, dtype=np.int64)
+        self._rows = {}
+        self._free_rows = []
+        self._size = 0
+        self.is_built = False
+
+    def vectorize(self, biography, favorite_stack):
+        vector = np.zeros(self.dim, dtype=np.float32)
+        tokens = tokenize(biography, favorite_stack)
+        if not tokens:
+            return vector
+        hashes = np.fromiter((zlib.crc32(token.encode()) for token in tokens),
+                             dtype=np.int64, count=len(tokens))
+        signs = np.where((hashes // self.dim) % 2, -1.0, 1.0).astype(np.float32)
+        np.add.at(vector, hashes % self.dim, signs)
+        vector = np.sign(vector) * np.log1p(np.abs(vector))
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def build(self):
+        clients = Client.objects.values_list('id', 'biography', 'favorite_stack').iterator(chunk_size=2000)
+        rows = [(client_id, self.vectorize(biography, stack)) for client_id, biography, stack in clients]
+        with self._lock:
+            self._size = len(rows)
+            capacity = max(self._size * 2, 64)
+            self._matrix = np.zeros((capacity, self.dim), dtype=np.float32)
+            self._client_ids = np.full(capacity, -1, dtype=np.int64)
+            self._rows = {}
+            self._free_rows = []
+            for row, (client_id, vector) in enumerate(rows):
+                self._matrix[row] = vector
+                self._client_ids[row] = client_id
+                self._rows[client_id] = row
+            self.is_built = True
+
+    def ensure_built(self):
+        if not self.is_built:
+            self.build()
+
+    def _grow(self):
+        capacity = max(len(self._matrix) * 2, 64)
+        matrix = np.zeros((capacity, self.dim), dtype=np.float32)
+        matrix[:len(self._matrix)] = self._matrix
+        client_ids = np.full(capacity, -1, dtype=np.int64)
+        client_ids[:len(self._client_ids)] = self._client_ids
+        self._matrix, self._client_ids = matrix, client_ids
+
+    def upsert(self, client_id, biography, favorite_stack):
+        vector = self.vectorize(biography, favorite_stack)
+        with self._lock:
+            if not self.is_built:
+                return
+            row = self._rows.get(client_id)
+            if row is None:
+                if self._free_rows:
+                    row = self._free_rows.pop()
+                else:
+                    if self._size == len(self._matrix):
+                        self._grow()
+                    row = self._size
+                    self._size += 1
+                self._rows[client_id] = row
+                self._client_ids[row] = client_id
+            self._matrix[row] = vector
+
+    def remove(self, client_id):
+        with self._lock:
+            row = self._rows.pop(client_id, None)
+            if row is None:
+                return
+            self._matrix[row] = 0
+            self._client_ids[row] = -1
+            self._free_rows.append(row)
+
+    def reload(self, client_id):
+        """Перечитывает анкету из базы, например после сохранения в другом процессе."""
+        row = Client.objects.filter(id=client_id).values_list('biography', 'favorite_stack').first()
+        if row:
+            self.upsert(client_id, *row)
+        else:
+            self.remove(client_id)
+
+    def vector_of(self, client_id):
+        with self._lock:
+            row = self._rows.get(client_id)
+            return None if row is None else self._matrix[row].copy()
+
+    def vectors_of(self, client_ids):
+        """Матрица векторов в порядке client_ids; для клиентов вне индекса — нули."""
+        self.ensure_built()
+        vectors = np.zeros((len(client_ids), self.dim), dtype=np.float32)
+        with self._lock:
+            for position, client_id in enumerate(client_ids):
+                row = self._rows.get(client_id)
+                if row is not None:
+                    vectors[position] = self._matrix[row]
+        return vectors
+
+    def top_k(self, client_id, k=10):
+        """id клиентов, больше всего похожих на client_id, по убыванию похожести."""
+        self.ensure_built()
+        with self._lock:
+            row = self._rows.get(client_id)
+            client_ids = self._client_ids[:self._size]
+            if row is None:
+                scores = np.zeros(self._size, dtype=np.float32)
+            else:
+                scores = self._matrix[:self._size] @ self._matrix[row]
+                scores[row] = -np.inf
+            scores[client_ids < 0] = -np.inf
+            candidates = np.count_nonzero(scores > -np.inf)
+            k = min(k, candidates)
+            if not k:
+                return []
+            best = np.argpartition(-scores, k - 1)[:k]
+            best = best[np.argsort(-scores[best], kind='stable')]
+            return client_ids[best].tolist()
+
+
+partner_index = PartnerIndex(env.int('PARTNER_INDEX_DIM', 512))
+shard_events.subscribe('client', partner_index.reload)
+
+
+@receiver(post_save, sender=Client)
+def _client_saved(sender, instance, **kwargs):
+    partner_index.upsert(instance.id, instance.biography, instance.favorite_stack)
+    shard_events.publish('client', instance.id)
+
+
+@receiver(post_delete, sender=Client)
+def _client_deleted(sender, instance, **kwargs):
+    partner_index.remove(instance.id)
+    shard_events.publish('client', instance.id)
@@ -0,0 +1,201 @@
+import json
+from collections import defaultdict
+from threading import Event as ThreadEvent, Lock, Thread
+
+from django.db import close_old_connections, transaction
+from environs import Env
+from telegram.ext import BasePersistence
+
+from bot_logic.models import ConversationState, PersistedData
+
+env = Env()
+env.read_env()
+
+BULK_BATCH_SIZE = 500
+# эти ключи bot_data бот заполняет при каждом старте, а токен оплаты не стоит хранить в базе
+RUNTIME_BOT_DATA_KEYS = {'provider_token', 'broadcast_sender'}
+
+
+class LazyDataDict(defaultdict):
+    """user_data/chat_data, которые читают запись из базы при первом обращении.
+
+    При старте бота ничего не загружается, поэтому перезапуск не зависит от
+    числа сохранённых пользователей."""
+
+    def __init__(self, load):
+        super().__init__(dict)
+        self._load = load
+        self._lock = Lock()
+
+    def __missing__(self, key):
+        with self._lock:
+            if dict.__contains__(self, key):
+                return dict.__getitem__(self, key)
+            value = self[key] = self._load(key)
+            return value
+
+
+def to_json(data, skip=()):
+    """JSON-снимок данных. Значения, которые нельзя сохранить, пропускаются."""
+    saved = {}
+    for key, value in list(data.items()):
+        if key in skip:
+            continue
+        try:
+            json.dumps(value)
+        except (TypeError, ValueError):
+            continue
+        saved[key] = value
+    return json.dumps(saved, sort_keys=True)
+
+
+class DjangoPersistence(BasePersistence):
+    """Хранит состояния ConversationHandler, user_data, chat_data и bot_data в базе.
+
+    Диспетчер сообщает об изменениях после каждого обновления, но в базу
+    ничего не пишется сразу: изменившиеся записи копятся в памяти (для
+    каждого пользователя — только последний снимок) и раз в flush_interval
+    секунд уходят в базу одной пачкой. user_data и chat_data читаются
+    лениво, при первом обращении к пользователю, а состояния диалогов —
+    целиком при старте: в базе лежат только незаконченные диалоги."""
+
+    def __init__(self, flush_interval=1.0, store_user_data=True, store_chat_data=True, store_bot_data=True):
+        super().__init__(store_user_data=store_user_data, store_chat_data=store_chat_data,
+                         store_bot_data=store_bot_data)
+        self.flush_interval = flush_interval
+        self._lock = Lock()
+        self._flush_lock = Lock()
+        self._snapshots = {}
+        self._dirty = {}
+        self._dirty_conversations = {}
+        self._wakeup = ThreadEvent()
+        self._stopped = ThreadEvent()
+        self._thread = Thread(target=self._run, name='persistence', daemon=True)
+
+    # в сохраняемых данных нет объектов Bot, поэтому глубокие копии
+    # BasePersistence на каждое обновление не нужны
+    def insert_bot(self, obj):
+        return obj
+
+    @classmethod
+    def replace_bot(cls, obj):
+        return obj
+
+    def _load(self, kind, key):
+        data = PersistedData.objects.filter(kind=kind, key=key).values_list('data', flat=True).first()
+        data = data or {}
+        with self._lock:
+            self._snapshots.setdefault((kind, key), to_json(data))
+        return data
+
+    def get_user_data(self):
+        return LazyDataDict(lambda user_id: self._load('user', user_id))
+
+    def get_chat_data(self):
+        return LazyDataDict(lambda chat_id: self._load('chat', chat_id))
+
+    def get_bot_data(self):
+        return self._load('bot', 0)
+
+    def get_callback_data(self):
+        return None
+
+    def get_conversations(self, name):
+        return {
+            tuple(json.loads(key)): state
+            for key, state in ConversationState.objects.filter(name=name).values_list('key', 'state')
+        }
+
+    def _mark(self, kind, key, data, skip=()):
+        snapshot = to_json(data, skip)
+        with self._lock:
+            if self._snapshots.get((kind, key)) == snapshot:
+                return
+            self._snapshots[(kind, key)] = snapshot
+            self._dirty[(kind, key)] = snapshot
+
+    def update_user_data(self, user_id, data):
+        self._mark('user', user_id, data)
+
+    def update_chat_data(self, chat_id, data):
+        self._mark('chat', chat_id, data)
+
+    def update_bot_data(self, data):
+        self._mark('bot', 0, data, RUNTIME_BOT_DATA_KEYS)
+
+    def update_conversation(self, name, key, new_state):
+        with self._lock:
+            self._dirty_conversations[(name, json.dumps(list(key)))] = new_state
+
+    def update_callback_data(self, data):
+        pass
+
+    def refresh_user_data(self, user_id, user_data):
+        pass
+
+    def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    def refresh_bot_data(self, bot_data):
+        pass
+
+    def write(self):
+        """Пишет накопленные изменения в базу и возвращает число записей."""
+        with self._flush_lock:
+            with self._lock:
+                dirty, self._dirty = self._dirty, {}
+                conversations, self._dirty_conversations = self._dirty_conversations, {}
+            if not dirty and not conversations:
+                return 0
+            finished = [(name, key) for (name, key), state in conversations.items() if state is None]
+            try:
+                with transaction.atomic():
+                    PersistedData.objects.bulk_create(
+                        [PersistedData(kind=kind, key=key, data=json.loads(snapshot))
+                         for (kind, key), snapshot in dirty.items()],
+                        batch_size=BULK_BATCH_SIZE, update_conflicts=True,
+                        unique_fields=['kind', 'key'], update_fields=['data', 'updated_at'])
+                    ConversationState.objects.bulk_create(
+                        [ConversationState(name=name, key=key, state=state)
+                         for (name, key), state in conversations.items() if state is not None],
+                        batch_size=BULK_BATCH_SIZE, update_conflicts=True,
+                        unique_fields=['name', 'key'], update_fields=['state', 'updated_at'])
+                    for name in {name for name, _ in finished}:
+                        ConversationState.objects.filter(
+                            name=name, key__in=[key for finished_name, key in finished if finished_name == name]
+                        ).delete()
+            except Exception:
+                # вернём изменения, если за это время не пришли более свежие
+                with self._lock:
+                    for item, snapshot in dirty.items():
+                        self._dirty.setdefault(item, snapshot)
+                    for item, state in conversations.items():
+                        self._dirty_conversations.setdefault(item, state)
+                raise
+            return len(dirty) + len(conversations)
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.flush_interval)
+            if self._stopped.is_set():
+                break
+            try:
+                self.write()
+            except Exception as e:
+                print(f'Ошибка при сохранении данных бота: {e}')
+            finally:
+                close_old_connections()
+
+    def start(self):
+        self._thread.start()
+
+    def flush(self):
+        """Вызывается Updater при остановке бота: дописывает всё, что осталось."""
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread.is_alive():
+            self._thread.join()
+        self.write()
+
+
+persistence = DjangoPersistence(env.float('PERSISTENCE_FLUSH_INTERVAL', 1))
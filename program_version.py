@@ -0,0 +1,76 @@
+from threading import Lock
+
+from django.db import close_old_connections
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from bot_logic.models import DataVersion, Event, Session, Speaker, SpeakerSession
+from shard_events import shard_events
+
+
+class ProgramVersion:
+    """Версия программы (мероприятия, доклады, выступления, спикеры) в базе.
+
+    Кэши программы сбрасываются сигналами моделей, но сигналы срабатывают
+    только в том процессе, где сохранили запись. Поэтому каждое изменение —
+    в боте, в админке или через import_schedule — поднимает версию в базе,
+    а процессы бота периодически сверяют её и сбрасывают свои кэши, если
+    программу поменял кто-то другой."""
+
+    def __init__(self, name='program'):
+        self.name = name
+        self._lock = Lock()
+        self._seen = None
+        self._listeners = []
+
+    def add_listener(self, listener):
+        self._listeners.append(listener)
+
+    def current(self):
+        return DataVersion.objects.filter(name=self.name).values_list('version', flat=True).first() or 0
+
+    def bump(self):
+        if not DataVersion.objects.filter(name=self.name).update(version=F('version') + 1):
+            DataVersion.objects.get_or_create(name=self.name, defaults={'version': 1})
+        with self._lock:
+            # своё изменение этот процесс уже учёл сигналами; чужие изменения
+            # поднимут версию ещё выше, и проверка их не пропустит
+            if self._seen is not None:
+                self._seen += 1
+
+    def check(self):
+        """Сбрасывает кэши, если версия в базе изменилась с прошлой проверки."""
+        version = self.current()
+        with self._lock:
+            changed = self._seen is not None and version != self._seen
+            self._seen = version
+        if changed:
+            self.notify()
+        return changed
+
+    def notify(self):
+        for listener in self._listeners:
+            listener()
+
+    def job(self, context):
+        try:
+            self.check()
+        except Exception as e:
+            print(f'Ошибка при проверке версии программы: {e}')
+        finally:
+            close_old_connections()
+
+
+program_version = ProgramVersion()
+# другой шард уже поднял версию, ждать очередной проверки не нужно
+shard_events.subscribe('program', program_version.notify)
+
+
+@receiver([post_save, post_delete], sender=Event)
+@receiver([post_save, post_delete], sender=Session)
+@receiver([post_save, post_delete], sender=Speaker)
+@receiver([post_save, post_delete], sender=SpeakerSession)
+def _program_saved(sender, instance, **kwargs):
+    program_version.bump()
+    shard_events.publish('program')
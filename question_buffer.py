@@ -0,0 +1,103 @@
+from threading import Event as ThreadEvent, Lock, Thread
+
+from django.db import DatabaseError, IntegrityError, close_old_connections, transaction
+from environs import Env
+
+from bot_logic.models import Question
+
+env = Env()
+env.read_env()
+
+BULK_BATCH_SIZE = 500
+
+
+class QuestionBuffer(Thread):
+    """Отложенная запись вопросов к докладам пачками.
+
+    Обработчик кладёт вопрос в буфер и сразу отвечает гостю, а поток раз в
+    flush_interval секунд (или как только набралось max_rows вопросов) пишет
+    всё накопленное одним bulk_create. При остановке бота буфер сбрасывается
+    в базу до конца."""
+
+    def __init__(self, flush_interval=0.2, max_rows=200):
+        super().__init__(name='question_buffer', daemon=True)
+        self.flush_interval = flush_interval
+        self.max_rows = max_rows
+        self._lock = Lock()
+        self._flush_lock = Lock()
+        self._pending = []
+        self._listeners = []
+        self._wakeup = ThreadEvent()
+        self._stopped = ThreadEvent()
+
+    def add(self, question):
+        with self._lock:
+            self._pending.append(question)
+            is_full = len(self._pending) >= self.max_rows
+        if is_full:
+            self._wakeup.set()
+
+    def add_flush_listener(self, callback):
+        """callback(questions) вызывается после каждой успешной записи пачки."""
+        self._listeners.append(callback)
+
+    def flush(self):
+        """Пишет накопленные вопросы в базу и возвращает записанные."""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, []
+            if not batch:
+                return []
+            try:
+                with transaction.atomic():
+                    Question.objects.bulk_create(batch, batch_size=BULK_BATCH_SIZE)
+            except IntegrityError:
+                batch = self._save_one_by_one(batch)
+            except DatabaseError:
+                # база недоступна: вернём пачку в начало буфера до следующей попытки
+                with self._lock:
+                    self._pending[:0] = batch
+                raise
+
+        for listener in self._listeners:
+            try:
+                listener(batch)
+            except Exception as e:
+                print(f'Ошибка в обработчике записанных вопросов: {e}')
+        return batch
+
+    def _save_one_by_one(self, batch):
+        saved = []
+        for question in batch:
+            try:
+                with transaction.atomic():
+                    question.save()
+                saved.append(question)
+            except IntegrityError as e:
+                print(f'Вопрос не сохранён: {e}')
+        return saved
+
+    def run(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            if self._stopped.is_set():
+                # остаток пишет stop() в вызвавшем его потоке
+                break
+            try:
+                self.flush()
+            except Exception as e:
+                print(f'Ошибка при записи вопросов: {e}')
+            finally:
+                close_old_connections()
+
+    def stop(self):
+        self._stopped.set()
+        self._wakeup.set()
+        if self.is_alive():
+            self.join()
+        self.flush()
+
+
+question_buffer = QuestionBuffer(
+    env.float('QUESTION_FLUSH_INTERVAL', 0.2), env.int('QUESTION_FLUSH_ROWS', 200))
@@ -0,0 +1,117 @@
+import re
+import zlib
+from threading import Lock
+
+import numpy as np
+from cachetools import LRUCache
+
+WORD_RE = re.compile(r'\w+')
+SHINGLE_SIZE = 3
+NUM_PERMUTATIONS = 32
+BANDS = 8
+ROWS_PER_BAND = NUM_PERMUTATIONS // BANDS
+PRIME = 4294967311
+SIMILARITY = 0.5
+
+_rng = np.random.default_rng(20240601)
+_A = _rng.integers(1, 2 ** 31, NUM_PERMUTATIONS, dtype=np.uint64)
+_B = _rng.integers(0, 2 ** 31, NUM_PERMUTATIONS, dtype=np.uint64)
+
+
+def shingles(text):
+    normalized = ' '.join(WORD_RE.findall((text or '').lower()))
+    if len(normalized) <= SHINGLE_SIZE:
+        return {normalized}
+    return {normalized[i:i + SHINGLE_SIZE] for i in range(len(normalized) - SHINGLE_SIZE + 1)}
+
+
+def minhash(text):
+    hashes = np.fromiter((zlib.crc32(shingle.encode()) for shingle in shingles(text)), dtype=np.uint64)
+    return ((_A[:, None] * hashes[None, :] + _B[:, None]) % PRIME).min(axis=1)
+
+
+class QuestionCluster:
+    def __init__(self, question_id, text, signature):
+        self.question_ids = [question_id]
+        self.text = text
+        self.signature = signature
+
+    @property
+    def count(self):
+        return len(self.question_ids)
+
+
+class TalkClusters:
+    """Группы похожих вопросов одного выступления (MinHash + LSH).
+
+    Подпись вопроса режется на полосы, и кандидаты в дубликаты ищутся только
+    в корзинах с совпадающей полосой, поэтому добавление вопроса не зависит
+    от числа уже накопленных вопросов."""
+
+    def __init__(self):
+        self.clusters = []
+        self.last_id = 0
+        self._buckets = {}
+        self._cluster_of = {}
+
+    def _band_keys(self, signature):
+        return [(band, signature[band * ROWS_PER_BAND:(band + 1) * ROWS_PER_BAND].tobytes())
+                for band in range(BANDS)]
+
+    def add(self, question_id, text):
+        if question_id in self._cluster_of:
+            return self._cluster_of[question_id]
+        signature = minhash(text)
+        band_keys = self._band_keys(signature)
+
+        best, best_similarity = None, SIMILARITY
+        for key in band_keys:
+            for cluster in self._buckets.get(key, ()):
+                similarity = np.count_nonzero(cluster.signature == signature) / NUM_PERMUTATIONS
+                if similarity >= best_similarity:
+                    best, best_similarity = cluster, similarity
+
+        if best is None:
+            best = QuestionCluster(question_id, text, signature)
+            self.clusters.append(best)
+            for key in band_keys:
+                self._buckets.setdefault(key, []).append(best)
+        else:
+            best.question_ids.append(question_id)
+        self._cluster_of[question_id] = best
+        self.last_id = max(self.last_id, question_id)
+        return best
+
+    def cluster_of(self, question_id):
+        return self._cluster_of.get(question_id)
+
+    def top(self, limit=20):
+        """Самые частые вопросы: сначала большие группы, при равенстве — более ранние."""
+        return sorted(self.clusters, key=lambda cluster: (-cluster.count, cluster.question_ids[0]))[:limit]
+
+
+class QuestionClusterIndex:
+    """Группы вопросов по выступлениям. Новые вопросы догружаются по id,
+    поэтому каждый вопрос разбирается один раз."""
+
+    def __init__(self, max_talks=100):
+        self._lock = Lock()
+        self._talks = LRUCache(maxsize=max_talks)
+
+    def for_talk(self, talk_id, questions):
+        """questions — queryset вопросов выступления; из базы читаются только новые."""
+        with self._lock:
+            clusters = self._talks.get(talk_id)
+            if clusters is None:
+                clusters = self._talks[talk_id] = TalkClusters()
+            for question_id, text in questions.filter(
+                    id__gt=clusters.last_id).order_by('id').values_list('id', 'text'):
+                clusters.add(question_id, text)
+            return clusters
+
+    def clear(self):
+        with self._lock:
+            self._talks.clear()
+
+
+question_clusters = QuestionClusterIndex()
@@ -0,0 +1,34 @@
+from threading import Lock
+from time import monotonic, sleep
+
+
+class TokenBucket:
+    """Классический token bucket: rate токенов в секунду, не больше capacity про запас."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._tokens = self.capacity
+        self._updated = monotonic()
+        self._lock = Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_consume(self, tokens=1):
+        """Забирает токены, если они есть. Иначе возвращает, сколько секунд подождать."""
+        with self._lock:
+            self._refill(monotonic())
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return 0
+            return (tokens - self._tokens) / self.rate
+
+    def consume(self, tokens=1):
+        """Ждёт, пока не наберётся нужное число токенов."""
+        while True:
+            wait = self.try_consume(tokens)
+            if not wait:
+                return
+            sleep(wait)
@@ -0,0 +1,54 @@
+from threading import Lock
+
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from bot_logic.models import Event, Session, Speaker, SpeakerSession
+from program_version import program_version
+
+
+class ScreenCache:
+    """Готовые тексты и клавиатуры экранов с программой.
+
+    Всё закэшированное относится к одной версии данных: любое изменение
+    мероприятий, докладов, спикеров или выступлений поднимает версию и
+    сбрасывает кэш — в этом процессе сразу, а из админки и import_schedule
+    при очередной проверке program_version."""
+
+    def __init__(self):
+        self._lock = Lock()
+        self._version = 0
+        self._screens = {}
+
+    @property
+    def version(self):
+        return self._version
+
+    def get(self, key, render):
+        with self._lock:
+            if key in self._screens:
+                return self._screens[key]
+            version = self._version
+        screen = render()
+        with self._lock:
+            # если данные поменялись, пока мы рендерили, результат уже устарел
+            if version == self._version:
+                self._screens[key] = screen
+        return screen
+
+    def bump(self):
+        with self._lock:
+            self._version += 1
+            self._screens.clear()
+
+
+screen_cache = ScreenCache()
+program_version.add_listener(screen_cache.bump)
+
+
+@receiver([post_save, post_delete], sender=Event)
+@receiver([post_save, post_delete], sender=Session)
+@receiver([post_save, post_delete], sender=Speaker)
+@receiver([post_save, post_delete], sender=SpeakerSession)
+def _program_changed(sender, instance, **kwargs):
+    screen_cache.bump()
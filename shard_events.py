@@ -0,0 +1,34 @@
+from django.db import transaction
+
+
+class ShardEvents:
+    """Сбросы кэшей, которые при BOT_SHARDS > 1 нужно повторить в остальных
+    процессах-обработчиках: профиль пользователя, анкета в индексе
+    собеседников, программа. Процесс-приёмник пересылает событие всем
+    остальным шардам. В одном процессе publish ничего не делает."""
+
+    def __init__(self):
+        self._shard = None
+        self._queue = None
+        self._handlers = {}
+
+    def connect(self, shard, queue):
+        self._shard, self._queue = shard, queue
+
+    def subscribe(self, kind, handler):
+        self._handlers[kind] = handler
+
+    def publish(self, kind, *args):
+        if self._queue is None:
+            return
+        shard, queue = self._shard, self._queue
+        # другие процессы перечитают данные из базы, поэтому шлём только после коммита
+        transaction.on_commit(lambda: queue.put((shard, (kind, args))))
+
+    def apply(self, kind, args):
+        handler = self._handlers.get(kind)
+        if handler:
+            handler(*args)
+
+
+shard_events = ShardEvents()
@@ -0,0 +1,192 @@
+import multiprocessing
+import signal
+from collections import OrderedDict
+from queue import Empty
+from threading import Condition, Event as ThreadEvent, Thread
+
+from telegram import Update
+from telegram.error import TelegramError
+from telegram.ext import Dispatcher
+
+SUPERVISE_INTERVAL = 1
+
+
+def shard_key(update):
+    """chat_id обновления в формате Bot API, а если чата нет — id пользователя,
+    как в LaneDispatcher.lane_for."""
+    for name, value in update.items():
+        if name == 'update_id' or not isinstance(value, dict):
+            continue
+        chat = value.get('chat') or (value.get('message') or {}).get('chat')
+        if chat:
+            return chat['id']
+        user = value.get('from') or value.get('user')
+        if user:
+            return user['id']
+    return 0
+
+
+class ShardedDispatcher(Dispatcher):
+    """Диспетчер процесса-приёмника: сам обработчиков не запускает, а раскладывает
+    обновления по процессам-обработчикам по chat_id.
+
+    Updater получает обновления (поллингом или через webhook) как обычно и
+    кладёт их в update_queue, а этот диспетчер отправляет каждое в очередь
+    процесса chat_id % shards. Обновления одного чата всегда попадают в один
+    процесс и обрабатываются там по порядку.
+
+    Пока процесс не подтвердил обновление, оно хранится здесь же. Если
+    процесс упал, он перезапускается, и все неподтверждённые обновления
+    отправляются ему заново в исходном порядке: обновление, которое
+    обрабатывалось в момент падения, может быть обработано дважды, но не
+    потеряется.
+
+    Через этот же процесс идут события shard_events: сброс кэша в одном
+    процессе-обработчике пересылается всем остальным."""
+
+    def __init__(self, bot, update_queue, shards=2, worker_target=None, worker_options=None,
+                 max_pending=10000, mp_context=None, **kwargs):
+        super().__init__(bot, update_queue, workers=1, **kwargs)
+        self.shards = shards
+        self.worker_target = worker_target or run_worker
+        self.worker_options = worker_options or {}
+        self.max_pending = max_pending
+        # spawn, а не fork: дочерний процесс не наследует потоки и соединения с базой
+        self.mp_context = mp_context or multiprocessing.get_context('spawn')
+        self.acks = self.mp_context.Queue()
+        self.events = self.mp_context.Queue()
+        self.queues = [None] * shards
+        self.processes = [None] * shards
+        self.pending = [OrderedDict() for _ in range(shards)]
+        self.restarts = [0] * shards
+        self._pending_changed = Condition()
+        self._stopping = ThreadEvent()
+        self._threads = []
+
+    def _spawn(self, shard):
+        queue = self.mp_context.Queue()
+        process = self.mp_context.Process(
+            target=self.worker_target,
+            args=(shard, self.shards, queue, self.acks, self.events, self.worker_options),
+            name=f'bot_shard_{shard}')
+        process.start()
+        self.queues[shard], self.processes[shard] = queue, process
+
+    def start(self, ready=None):
+        if not self._threads:
+            for shard in range(self.shards):
+                self._spawn(shard)
+            for target, name in ((self._collect_acks, 'shard_acks'), (self._relay_events, 'shard_events'),
+                                 (self._supervise, 'shard_supervisor')):
+                thread = Thread(target=target, name=name, daemon=True)
+                thread.start()
+                self._threads.append(thread)
+        super().start(ready)
+
+    def process_update(self, update):
+        # Вызывается из потока диспетчера: только передаём обновление процессу шарда.
+        if not isinstance(update, Update):
+            if isinstance(update, TelegramError):
+                print(f'Ошибка при получении обновлений: {update}')
+            return
+        raw = update.to_dict()
+        shard = shard_key(raw) % self.shards
+        with self._pending_changed:
+            # отстающий процесс притормаживает приём, а не копит обновления без конца
+            while len(self.pending[shard]) >= self.max_pending and not self._stopping.is_set():
+                self._pending_changed.wait(SUPERVISE_INTERVAL)
+            self.pending[shard][update.update_id] = raw
+            self.queues[shard].put(raw)
+
+    def _ack(self, shard, update_ids):
+        with self._pending_changed:
+            for update_id in update_ids:
+                self.pending[shard].pop(update_id, None)
+            self._pending_changed.notify_all()
+
+    def _collect_acks(self):
+        while True:
+            item = self.acks.get()
+            if item is None:
+                break
+            self._ack(*item)
+
+    def _relay_events(self):
+        while True:
+            item = self.events.get()
+            if item is None:
+                break
+            source, event = item
+            with self._pending_changed:
+                for shard, queue in enumerate(self.queues):
+                    if shard != source:
+                        queue.put(event)
+
+    def _drain_acks(self):
+        while True:
+            try:
+                item = self.acks.get_nowait()
+            except Empty:
+                return
+            if item is None:
+                self.acks.put(None)
+                return
+            self._ack(*item)
+
+    def _supervise(self):
+        while not self._stopping.wait(SUPERVISE_INTERVAL):
+            for shard, process in enumerate(self.processes):
+                if not process.is_alive() and not self._stopping.is_set():
+                    self.restart(shard)
+
+    def restart(self, shard):
+        """Запускает процесс шарда заново и повторяет ему неподтверждённые обновления."""
+        print(f'Процесс шарда {shard} завершился с кодом {self.processes[shard].exitcode}, перезапускаю')
+        with self._pending_changed:
+            # подтверждения, которые упавший процесс успел отправить, не повторяем
+            self._drain_acks()
+            self._spawn(shard)
+            for raw in self.pending[shard].values():
+                self.queues[shard].put(raw)
+            self.restarts[shard] += 1
+
+    def stop(self):
+        if self.running:
+            # дожидаемся, пока диспетчер разложит уже принятые обновления
+            self.update_queue.join()
+        super().stop()
+        self._stopping.set()
+        for queue in self.queues:
+            if queue is not None:
+                queue.put(None)
+        for process in self.processes:
+            if process is not None:
+                process.join()
+        self.acks.put(None)
+        self.events.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        left = sum(len(pending) for pending in self.pending)
+        if left:
+            print(f'Остались неподтверждённые обновления: {left}')
+
+    def shard_stats(self):
+        """Неподтверждённые обновления и число перезапусков по каждому шарду."""
+        with self._pending_changed:
+            return [
+                {'shard': shard, 'pending': len(self.pending[shard]), 'restarts': self.restarts[shard]}
+                for shard in range(self.shards)
+            ]
+
+
+def run_worker(shard, shards, updates, acks, events, options):
+    """Процесс-обработчик шарда: свой диспетчер со всеми обработчиками, свои кэши
+    и фоновые задачи. Из очереди приходят обновления (dict) и события других
+    шардов (kind, args). Завершается, получив None."""
+    # останавливает процессы приёмник, а не Ctrl+C, пришедший всей группе процессов
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+
+    from bot import run_shard
+    run_shard(shard, shards, updates, acks, events, options)
@@ -0,0 +1,112 @@
+from functools import wraps
+from queue import Queue
+from threading import Thread
+
+from django.db import close_old_connections
+from telegram import Update
+from telegram.ext import Dispatcher, JobQueue
+
+
+def releasing_connection(func):
+    """После вызова отдаёт соединение потока с базой обратно в пул (или
+    закрывает устаревшее), чтобы потоки не держали соединения между обновлениями."""
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        try:
+            return func(*args, **kwargs)
+        finally:
+            close_old_connections()
+
+    return wrapper
+
+
+class LaneDispatcher(Dispatcher):
+    """Диспетчер, который раскладывает обновления по дорожкам (lanes) по chat_id.
+
+    Обновления одного чата всегда попадают в одну и ту же дорожку и
+    обрабатываются строго по порядку, поэтому шаги ConversationHandler
+    не перемешиваются. Разные чаты обрабатываются параллельно.
+
+    В процессе-обработчике шарда все чаты имеют одинаковый chat_id % shards,
+    поэтому дорожка выбирается по chat_id // shards: иначе при
+    BOT_SHARDS == BOT_LANES процесс работал бы одной дорожкой."""
+
+    def __init__(self, *args, lanes: int = 4, lane_queue_size: int = 0, shards: int = 1, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.shards = max(shards, 1)
+        self.lane_queues = [Queue(maxsize=lane_queue_size) for _ in range(max(lanes, 1))]
+        self.lane_processed = [0] * len(self.lane_queues)
+        self.lane_threads = []
+        # вызывается после обработки каждого обновления, например для подтверждения шардированию
+        self.on_processed = None
+
+    def lane_for(self, update: object) -> int:
+        if isinstance(update, Update):
+            if update.effective_chat:
+                return update.effective_chat.id // self.shards % len(self.lane_queues)
+            if update.effective_user:
+                return update.effective_user.id // self.shards % len(self.lane_queues)
+        return 0
+
+    def start(self, ready=None):
+        if not self.lane_threads:
+            for lane in range(len(self.lane_queues)):
+                thread = Thread(target=self._run_lane, args=(lane,),
+                                name=f'lane_{lane}', daemon=True)
+                thread.start()
+                self.lane_threads.append(thread)
+        super().start(ready)
+
+    def process_update(self, update: object) -> None:
+        # Вызывается из потока диспетчера: только кладём обновление в дорожку.
+        # Если очередь дорожки ограничена и заполнена, put() притормозит приём.
+        self.lane_queues[self.lane_for(update)].put(update)
+
+    def _run_lane(self, lane: int):
+        lane_queue = self.lane_queues[lane]
+        while True:
+            update = lane_queue.get()
+            if update is None:
+                break
+            try:
+                super().process_update(update)
+            finally:
+                close_old_connections()
+            self.lane_processed[lane] += 1
+            if self.on_processed:
+                self.on_processed(update)
+
+    def run_async(self, func, *args, update=None, **kwargs):
+        return super().run_async(releasing_connection(func), *args, update=update, **kwargs)
+
+    def stop(self) -> None:
+        if self.running:
+            # дожидаемся, пока диспетчер разложит уже принятые обновления
+            self.update_queue.join()
+        for lane_queue in self.lane_queues:
+            lane_queue.put(None)
+        for thread in self.lane_threads:
+            thread.join()
+        self.lane_threads = []
+        super().stop()
+
+    def lane_stats(self):
+        """Глубина очереди и число обработанных обновлений по каждой дорожке."""
+        return [
+            {'lane': lane, 'queued': lane_queue.qsize(), 'processed': self.lane_processed[lane]}
+            for lane, lane_queue in enumerate(self.lane_queues)
+        ]
+
+
+class ReleasingJobQueue(JobQueue):
+    """JobQueue, задачи которой после каждого запуска отдают соединение с базой в пул."""
+
+    def run_once(self, callback, *args, **kwargs):
+        return super().run_once(releasing_connection(callback), *args, **kwargs)
+
+    def run_repeating(self, callback, *args, **kwargs):
+        return super().run_repeating(releasing_connection(callback), *args, **kwargs)
+
+    def run_daily(self, callback, *args, **kwargs):
+        return super().run_daily(releasing_connection(callback), *args, **kwargs)
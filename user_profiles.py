@@ -0,0 +1,100 @@
+from collections import namedtuple
+from threading import Lock
+
+from cachetools import TTLCache
+from django.db.models import Exists, OuterRef, Subquery
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from environs import Env
+
+from bot_logic.models import UserTg, Client, Speaker
+from shard_events import shard_events
+
+env = Env()
+env.read_env()
+
+UserProfile = namedtuple('UserProfile', [
+    'user_id', 'tg_id', 'nic_tg', 'is_organizator', 'is_speaker',
+    'client_id', 'is_registered', 'speaker_id',
+])
+
+_profiles = TTLCache(
+    maxsize=env.int('PROFILE_CACHE_SIZE', 10000),
+    ttl=env.int('PROFILE_CACHE_TTL', 300))
+_profiles_lock = Lock()
+# растёт при каждом сбросе: профиль, прочитанный до сброса, в кэш не кладём
+_generation = 0
+
+
+def load_user_profile(tg_id):
+    """Достаёт пользователя, его клиента и спикера одним запросом."""
+    clients = Client.objects.filter(user=OuterRef('pk'))
+    speakers = Speaker.objects.filter(user=OuterRef('pk'))
+    row = UserTg.objects.filter(tg_id=tg_id).annotate(
+        client_id=Subquery(clients.values('id')[:1]),
+        is_registered=Exists(clients.filter(is_registered=True)),
+        speaker_id=Subquery(speakers.values('id')[:1]),
+    ).values(
+        'id', 'tg_id', 'nic_tg', 'is_organizator', 'is_speaker',
+        'client_id', 'is_registered', 'speaker_id',
+    ).first()
+    if not row:
+        return None
+    row['user_id'] = row.pop('id')
+    return UserProfile(**row)
+
+
+def get_user_profile(tg_id):
+    """Профиль пользователя из кэша, None если пользователя нет в базе."""
+    with _profiles_lock:
+        if tg_id in _profiles:
+            return _profiles[tg_id]
+        generation = _generation
+    profile = load_user_profile(tg_id)
+    with _profiles_lock:
+        # пока читали, профиль могли изменить: прочитанное может быть уже устаревшим
+        if generation == _generation:
+            _profiles[tg_id] = profile
+    return profile
+
+
+def get_or_create_user_profile(user):
+    profile = get_user_profile(user.id)
+    if profile:
+        return profile
+    UserTg.objects.get_or_create(tg_id=user.id, defaults={'nic_tg': user.username})
+    return get_user_profile(user.id)
+
+
+def invalidate_user_profile(tg_id):
+    global _generation
+    with _profiles_lock:
+        _generation += 1
+        _profiles.pop(tg_id, None)
+
+
+def _invalidate_by_user_id(user_id):
+    global _generation
+    with _profiles_lock:
+        _generation += 1
+        stale = [tg_id for tg_id, profile in _profiles.items()
+                 if profile and profile.user_id == user_id]
+        for tg_id in stale:
+            _profiles.pop(tg_id, None)
+
+
+shard_events.subscribe('profile', invalidate_user_profile)
+shard_events.subscribe('profile_user', _invalidate_by_user_id)
+
+
+@receiver([post_save, post_delete], sender=UserTg)
+def _user_tg_changed(sender, instance, **kwargs):
+    invalidate_user_profile(instance.tg_id)
+    shard_events.publish('profile', instance.tg_id)
+
+
+@receiver([post_save, post_delete], sender=Client)
+@receiver([post_save, post_delete], sender=Speaker)
+def _person_changed(sender, instance, **kwargs):
+    _invalidate_by_user_id(instance.user_id)
+    shard_events.publish('profile_user', instance.user_id)